@@ -0,0 +1,96 @@
+# bench/bench_codec.py
+"""設定編碼/解碼的吞吐量：10k 個伺服器設定。
+
+- 舊版：asdict + json.dumps(indent=2)；json.loads + 逐欄手寫解碼
+- codec：config_codec 的 encode/decode（有 orjson 時用它，否則標準 json）
+- SQLite：經 SqliteStore 一次寫入 / 讀回全部並解碼（含 I/O）
+
+用法：python -m bench.bench_codec [--n 10000]
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+from utils import config_codec
+from utils.config import CritRules, DiceBudget, DiceLimits, GuildConfig, RngSettings, StreamSettings
+from utils.config_codec import decode, dumps, loads, to_payload, upgrade
+from utils.config_store import SqliteStore
+
+def _configs(n: int) -> list[GuildConfig]:
+    rnd = random.Random(1)
+    out = []
+    for i in range(n):
+        cfg = GuildConfig()
+        cfg.stream_log_channel_id = rnd.randrange(1 << 60) if i % 10 == 0 else 0
+        cfg.stream.throttle_ms = rnd.randrange(1000)
+        cfg.crit.d20_crit_success = rnd.randrange(15, 21)
+        out.append(cfg)
+    return out
+
+def _legacy_decode(raw: dict) -> GuildConfig:
+    # 改版前 ConfigManager._load_guild 的手寫解碼（預設值重複寫一份）
+    s = raw.get("stream", {})
+    c = raw.get("crit", {})
+    lim = raw.get("limits", {})
+    rg = raw.get("rng", {})
+    bd = raw.get("budget", {})
+    return GuildConfig(
+        crit_log_channel_id=raw.get("crit_log_channel_id", 0),
+        crit_window_ms=raw.get("crit_window_ms", 2000),
+        stream_log_channel_id=raw.get("stream_log_channel_id", 0),
+        stream=StreamSettings(mode=s.get("mode", "live"), throttle_ms=s.get("throttle_ms", 200),
+                              chunk_limit=s.get("chunk_limit", 1800)),
+        crit=CritRules(d20_crit_success=c.get("d20_crit_success", 20), d20_crit_failure=c.get("d20_crit_failure", 1),
+                       d100_crit_success=c.get("d100_crit_success", 1),
+                       d100_crit_failure=c.get("d100_crit_failure", 100)),
+        limits=DiceLimits(max_dice=lim.get("max_dice", 100), max_sides=lim.get("max_sides", 1000),
+                          max_times=lim.get("max_times", 50)),
+        rng=RngSettings(mode=rg.get("mode", "fast"), seed=rg.get("seed", 0)),
+        budget=DiceBudget(user_burst=bd.get("user_burst", 5000), user_rate=bd.get("user_rate", 100.0),
+                          guild_burst=bd.get("guild_burst", 20000), guild_rate=bd.get("guild_rate", 1000.0),
+                          max_wait=bd.get("max_wait", 3.0)),
+    )
+
+def _timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t
+
+def _row(name: str, n: int, save: float, load: float):
+    print(f"{name:<14}{n / save:>14,.0f}{n / load:>14,.0f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=10000)
+    args = ap.parse_args()
+    cfgs = _configs(args.n)
+    print(f"序列化：{'orjson' if config_codec.orjson else 'json（標準函式庫）'}，{args.n} 個伺服器設定")
+    print(f"{'模式':<14}{'存 (個/秒)':>14}{'讀 (個/秒)':>14}")
+
+    texts, save = _timed(lambda: [json.dumps(asdict(c), ensure_ascii=False, indent=2) for c in cfgs])
+    back, load = _timed(lambda: [_legacy_decode(json.loads(t)) for t in texts])
+    assert back == cfgs
+    _row("舊版", args.n, save, load)
+
+    for name, pretty in (("codec（縮排）", True), ("codec", False)):
+        texts, save = _timed(lambda: [dumps(to_payload(c), pretty=pretty) for c in cfgs])
+        back, load = _timed(lambda: [decode(GuildConfig, upgrade("guild", loads(t))[0]) for t in texts])
+        assert back == cfgs
+        _row(name, args.n, save, load)
+
+    with tempfile.TemporaryDirectory() as d:
+        store = SqliteStore(str(Path(d) / "config.sqlite3"))
+        items = [(("guild", gid), to_payload(c)) for gid, c in enumerate(cfgs)]
+        _, save = _timed(lambda: store.write(items))
+        raws, load = _timed(lambda: [decode(GuildConfig, upgrade("guild", r)[0])
+                                     for r in store.load_guilds(range(args.n)).values()])
+        store.close()
+        assert raws == cfgs
+        _row("SQLite", args.n, save, load)
+
+if __name__ == "__main__":
+    main()
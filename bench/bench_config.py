@@ -0,0 +1,75 @@
+# bench/bench_config.py
+"""設定 setter 的延遲：改版前（每次同步 write_text）vs 延遲寫入。
+
+- 舊版：setter 內直接 Path.write_text 縮排 JSON（無 fsync、無原子取代）
+- 同步：沒有事件迴圈時的路徑（原子寫入 + fsync，每次都寫）
+- 延遲寫入：事件迴圈中 setter 只標記 dirty，合併後在執行緒寫出
+
+用法：python -m bench.bench_config [--n 2000]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+from utils.config import ConfigManager
+
+def _manager() -> tuple[ConfigManager, Path]:
+    d = Path(tempfile.mkdtemp())
+    return ConfigManager(str(d / "config.global.json"), str(d / "guilds")), d
+
+def _summary(name: str, samples: list[float]):
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{name:<10}{statistics.median(samples) * 1e6:>12.1f}{p99 * 1e6:>12.1f}{max(samples) * 1e6:>12.1f}")
+
+def bench_legacy(n: int) -> list[float]:
+    cm, d = _manager()
+    cfg = cm.get_guild_cfg(1)
+    path = d / "guilds" / "1.json"
+    out = []
+    for i in range(n):
+        t = time.perf_counter()
+        cfg.stream.throttle_ms = i
+        path.write_text(json.dumps(asdict(cfg), ensure_ascii=False, indent=2), encoding="utf-8")
+        out.append(time.perf_counter() - t)
+    return out
+
+def bench_sync(n: int) -> list[float]:
+    cm, _ = _manager()
+    out = []
+    for i in range(n):
+        t = time.perf_counter()
+        cm.set_stream_throttle(1, i)
+        out.append(time.perf_counter() - t)
+    return out
+
+async def bench_write_behind(n: int) -> tuple[list[float], int]:
+    cm, _ = _manager()
+    out = []
+    for i in range(n):
+        t = time.perf_counter()
+        cm.set_stream_throttle(1 + i % 8, i)
+        out.append(time.perf_counter() - t)
+        if i % 50 == 0:
+            await asyncio.sleep(0)      # 讓背景寫入有機會跑
+    await cm.flush()
+    return out, cm._writer.writes
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    args = ap.parse_args()
+    print(f"{'模式':<10}{'p50(µs)':>12}{'p99(µs)':>12}{'max(µs)':>12}")
+    _summary("舊版", bench_legacy(args.n))
+    _summary("同步", bench_sync(args.n))
+    samples, writes = asyncio.run(bench_write_behind(args.n))
+    _summary("延遲寫入", samples)
+    print(f"延遲寫入：{args.n} 次修改 → 實際寫檔 {writes} 次")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# bench/bench_inline.py
+"""行內擲骰監聽器的每則訊息成本。
+
+on_message 會看到所有伺服器的每一則訊息；一般聊天（不含 [[）必須幾乎零成本。
+這裡比較 find_inline（子字串預先排除）與直接跑正規式，並量測含骰式訊息的編譯快取效果。
+預算：一般聊天每則 < 1µs。
+
+用法：python -m bench.bench_inline [--n 200000]
+"""
+import argparse
+import random
+import time
+
+from utils.dice import INLINE_RE, compile_expr, find_inline
+
+BUDGET_NS = 1_000   # 一般聊天每則訊息的預算
+
+_WORDS = ("今天", "團務", "角色卡", "哈哈", "ok", "lol", "see you", "先跑一下", "這場", "[wiki]",
+          "https://example.com/a?b=c", "GM", "骰子", "明天晚上八點", "<@123456789>", "😂")
+
+def _chatter(n: int, rng: random.Random) -> list[str]:
+    return [" ".join(rng.choices(_WORDS, k=rng.randint(3, 30))) for _ in range(n)]
+
+def _ns_per(fn, msgs: list[str]) -> float:
+    t = time.perf_counter_ns()
+    for m in msgs:
+        fn(m)
+    return (time.perf_counter_ns() - t) / len(msgs)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000, help="訊息數")
+    args = ap.parse_args()
+    rng = random.Random(1)
+
+    chatter = _chatter(args.n, rng)
+    prefiltered = _ns_per(find_inline, chatter)
+    regex_only = _ns_per(lambda m: INLINE_RE.findall(m), chatter)
+    print(f"一般聊天  find_inline：{prefiltered:8.0f} ns/則（預算 {BUDGET_NS} ns）"
+          f"{'  ✔' if prefiltered < BUDGET_NS else '  ✘ 超出預算'}")
+    print(f"一般聊天  只用正規式：{regex_only:8.0f} ns/則")
+
+    snippets = ["2d6+3", "d20+5>=15", "4d6kh3", "1d8+1d6+2"]
+    dice = [f"攻擊 [[{rng.choice(snippets)}]] 然後傷害 [[{rng.choice(snippets)}]]" for _ in range(args.n // 10)]
+    compile_expr.cache_clear()
+    parse = _ns_per(lambda m: [compile_expr(s) for s in find_inline(m)], dice)
+    info = compile_expr.cache_info()
+    print(f"含骰式    擷取+編譯：  {parse:8.0f} ns/則（快取命中 {info.hits}，未命中 {info.misses}）")
+
+if __name__ == "__main__":
+    main()
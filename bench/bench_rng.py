@@ -0,0 +1,31 @@
+# bench/bench_rng.py
+"""各亂數來源的抽取速度（draws/sec）。
+
+用法：python -m bench.bench_rng [--n 1000000]
+"""
+import argparse
+import time
+
+from utils.rng import EntropyRng, FastRng, SeededRng
+
+def _rate(fn, n: int) -> float:
+    t = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - t)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1_000_000, help="批次抽取顆數")
+    ap.add_argument("--single", type=int, default=100_000, help="逐顆 randint 次數")
+    args = ap.parse_args()
+
+    backends = [FastRng(), EntropyRng(), SeededRng(12345)]
+    print(f"{'backend':<10}{'sides':>8}{'batch draws/s':>18}{'randint/s':>14}")
+    for rng in backends:
+        for sides in (6, 20, 100, 1000):
+            batch = _rate(lambda: rng.draw(sides, args.n), args.n)
+            single = _rate(lambda: [rng.randint(1, sides) for _ in range(args.single)], args.single)
+            print(f"{rng.name:<10}{sides:>8}{batch:>18,.0f}{single:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
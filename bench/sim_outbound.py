@@ -0,0 +1,107 @@
+# bench/sim_outbound.py
+"""以假的 Discord 端點驗證 OutboundScheduler。
+
+FakeDiscord 模擬每頻道 bucket（預設 5 次 / 1 秒，縮短了真實的 5 秒視窗），
+回應時帶 X-RateLimit-* 標頭，超額回 429 並像 discord.py 一樣等 Retry-After 後重試。
+
+情境：同一頻道一邊灌日誌（live 編輯 + batch 送出），一邊有玩家擲骰回覆。
+比較「直接送」與「經過排程器」的回覆延遲、429 次數與實際送出數。
+
+用法：python -m bench.sim_outbound [--seconds 5]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from utils.outbound import OutboundScheduler, Priority
+
+class FakeDiscord:
+    def __init__(self, limit: int = 5, window: float = 1.0, latency: float = 0.02, observe=None):
+        self.limit, self.window, self.latency = limit, window, latency
+        self.observe = observe
+        self._buckets: dict[int, tuple[float, int]] = {}    # channel -> (重置時間, 已用)
+        self.requests = 0
+        self.too_many = 0
+
+    async def request(self, channel_id: int, payload: str) -> str:
+        while True:
+            await asyncio.sleep(self.latency)
+            self.requests += 1
+            now = time.monotonic()
+            reset_at, used = self._buckets.get(channel_id, (now + self.window, 0))
+            if now >= reset_at:
+                reset_at, used = now + self.window, 0
+            if used >= self.limit:
+                self.too_many += 1
+                retry = reset_at - now
+                if self.observe:
+                    self.observe(channel_id, 429, {"Retry-After": f"{retry:.3f}"})
+                await asyncio.sleep(retry)      # discord.py 內建的 429 重試
+                continue
+            used += 1
+            self._buckets[channel_id] = (reset_at, used)
+            if self.observe:
+                self.observe(channel_id, 200, {
+                    "X-RateLimit-Limit": str(self.limit),
+                    "X-RateLimit-Remaining": str(self.limit - used),
+                    "X-RateLimit-Reset-After": f"{reset_at - now:.3f}",
+                })
+            return payload
+
+async def _scenario(seconds: float, use_scheduler: bool) -> dict:
+    sched = OutboundScheduler()
+    api = FakeDiscord(observe=sched.observe if use_scheduler else None)
+    ch = 1
+    latencies: list[float] = []
+    tasks: list[asyncio.Task] = []
+
+    async def send(payload: str, priority: Priority, key=None):
+        if use_scheduler:
+            return await sched.submit(ch, lambda: api.request(ch, payload), priority=priority, key=key)
+        return await api.request(ch, payload)
+
+    async def log_flood():
+        # 每 20ms 一行日誌：live 模式編輯同一則訊息，每 10 行另送一則 batch
+        i = 0
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            i += 1
+            tasks.append(asyncio.create_task(send(f"edit {i}", Priority.LOG, key=("edit", 42))))
+            if i % 10 == 0:
+                tasks.append(asyncio.create_task(send(f"batch {i}", Priority.LOG)))
+            await asyncio.sleep(0.02)
+
+    async def player():
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            t = time.monotonic()
+            await send("reply", Priority.REPLY)
+            latencies.append(time.monotonic() - t)
+            await asyncio.sleep(0.3)
+
+    await asyncio.gather(log_flood(), player())
+    for t in tasks:
+        t.cancel()
+    return {
+        "replies": len(latencies),
+        "p50": statistics.median(latencies),
+        "max": max(latencies),
+        "requests": api.requests,
+        "429": api.too_many,
+        "coalesced": sched.stats.coalesced,
+        "dropped": sched.stats.dropped,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=5.0)
+    args = ap.parse_args()
+    print(f"{'模式':<8}{'回覆數':>6}{'p50(ms)':>10}{'max(ms)':>10}{'請求數':>8}{'429':>6}{'合併':>6}{'丟棄':>6}")
+    for name, flag in (("直接送", False), ("排程器", True)):
+        r = asyncio.run(_scenario(args.seconds, flag))
+        print(f"{name:<8}{r['replies']:>6}{r['p50']*1000:>10.0f}{r['max']*1000:>10.0f}"
+              f"{r['requests']:>8}{r['429']:>6}{r['coalesced']:>6}{r['dropped']:>6}")
+
+if __name__ == "__main__":
+    main()
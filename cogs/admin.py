@@ -3,9 +3,13 @@ import os
 import sys
 import asyncio
 import subprocess 
+from functools import partial
 import discord
 from discord.ext import commands
 from utils.config import ConfigManager
+from utils.history import RollHistory
+from utils.logging_config import LOG_RING, shutdown_logging
+from utils.outbound import OutboundScheduler, Priority
 
 logger = logging.getLogger("trpg_bot")
 
@@ -35,10 +39,20 @@ class ConfirmRestartView(discord.ui.View):
         await interaction.response.edit_message(content="已取消重啟。", view=None)
 
 class AdminCog(commands.Cog, name="Admin"):
-    def __init__(self, bot: commands.Bot, config: ConfigManager, app_owner_id: int | None):
+    def __init__(self, bot: commands.Bot, config: ConfigManager, app_owner_id: int | None,
+                 outbound: OutboundScheduler | None = None, history: RollHistory | None = None):
         self.bot = bot
         self.config = config
         self.app_owner_id = app_owner_id
+        self.history = history
+        self.out = outbound or OutboundScheduler()
+
+    # ---- 送出：經過 OutboundScheduler，與日誌串流共用各頻道的佇列與速率限制 ----
+    async def _reply(self, ctx: commands.Context, *args, **kwargs) -> discord.Message:
+        return await self.out.submit(ctx.channel.id, partial(ctx.reply, *args, **kwargs), priority=Priority.REPLY)
+
+    async def _send(self, ctx: commands.Context, content: str) -> discord.Message:
+        return await self.out.submit(ctx.channel.id, partial(ctx.send, content), priority=Priority.REPLY)
 
     def _is_dev_or_reply(self, ctx, cfg, owner_id):
         if not ((owner_id is not None and ctx.author.id == owner_id) or cfg.is_developer(ctx.author.id)):
@@ -47,20 +61,21 @@ class AdminCog(commands.Cog, name="Admin"):
     
     @commands.group(name="admin", invoke_without_command=True)
     async def admin_group(self, ctx: commands.Context):
-        await ctx.reply("管理指令：`rpg!admin restart`｜`rpg!admin dev add/remove/list`｜"
-                        "`rpg!admin rcfg mode/service/show`｜`rpg!admin gstream ...`")
+        await self._reply(ctx, "管理指令：`rpg!admin restart`｜`rpg!admin dev add/remove/list`｜"
+                               "`rpg!admin rcfg mode/service/show`｜`rpg!admin gstream ...`｜`rpg!admin cache`｜"
+                               "`rpg!admin reload`｜`rpg!admin logq [policy/size]`")
     
     @admin_group.group(name="gstream", invoke_without_command=True)
     async def admin_gstream_group(self, ctx: commands.Context):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
-        await ctx.reply("用法：`rpg!admin gstream set <channel_id|#mention>`｜`rpg!admin gstream off`｜"
-                        "`rpg!admin gstream mode <live|batch>`｜`rpg!admin gstream throttle <毫秒>`｜`rpg!admin gstream show`")
+            return await self._reply(ctx, "你不是開發者。")
+        await self._reply(ctx, "用法：`rpg!admin gstream set <channel_id|#mention>`｜`rpg!admin gstream off`｜"
+                               "`rpg!admin gstream mode <live|batch>`｜`rpg!admin gstream throttle <毫秒>`｜`rpg!admin gstream level <等級>`｜`rpg!admin gstream show`")
     
     @admin_gstream_group.command(name="set")
     async def admin_gstream_set(self, ctx: commands.Context, channel: str):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         # 解析 channel：<#123> 或 純數字
         channel_id = None
         if channel.startswith("<#") and channel.endswith(">"):
@@ -68,69 +83,83 @@ class AdminCog(commands.Cog, name="Admin"):
         elif channel.isdigit():
             channel_id = int(channel)
         else:
-            return await ctx.reply("請提供頻道 ID 或在同伺服器使用 #頻道 提及。")
+            return await self._reply(ctx, "請提供頻道 ID 或在同伺服器使用 #頻道 提及。")
     
         ch = self.bot.get_channel(channel_id)
         if not isinstance(ch, discord.TextChannel):
-            return await ctx.reply("找不到該文字頻道，請確認 bot 有在該伺服器內。")
+            return await self._reply(ctx, "找不到該文字頻道，請確認 bot 有在該伺服器內。")
     
         self.config.set_global_stream_channel(channel_id)
-        await ctx.reply(f"全域日誌輸出頻道已設定為 {ch.mention}")
+        await self._reply(ctx, f"全域日誌輸出頻道已設定為 {ch.mention}")
     
     @admin_gstream_group.command(name="off")
     async def admin_gstream_off(self, ctx: commands.Context):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         self.config.clear_global_stream_channel()
-        await ctx.reply("已關閉全域日誌輸出。")
+        await self._reply(ctx, "已關閉全域日誌輸出。")
     
     @admin_gstream_group.command(name="mode")
     async def admin_gstream_mode(self, ctx: commands.Context, mode: str):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         try:
             self.config.set_global_stream_mode(mode)
         except ValueError as e:
-            return await ctx.reply(str(e))
-        await ctx.reply(f"全域日誌串流模式已設為 **{mode}**")
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"全域日誌串流模式已設為 **{mode}**")
     
     @admin_gstream_group.command(name="throttle")
     async def admin_gstream_throttle(self, ctx: commands.Context, ms: int):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         self.config.set_global_stream_throttle(ms)
-        await ctx.reply(f"全域串流節流已設為 **{ms}ms**")
+        await self._reply(ctx, f"全域串流節流已設為 **{ms}ms**")
+    
+    @admin_gstream_group.command(name="level")
+    async def admin_gstream_level(self, ctx: commands.Context, level: str):
+        if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        try:
+            self.config.set_global_stream_min_level(level)
+        except ValueError as e:
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"全域串流最低等級已設為 **{level.upper()}**")
     
     @admin_gstream_group.command(name="show")
     async def admin_gstream_show(self, ctx: commands.Context):
         if not self._is_dev_or_reply(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         ch_id = self.config.get_global_stream_channel_id()
         s = self.config.get_global_stream_settings()
-        await ctx.reply(f"全域輸出：channel_id=`{ch_id}`，mode=`{s.mode}`，throttle=`{s.throttle_ms}ms`，chunk=`{s.chunk_limit}`")
+        await self._reply(ctx, f"全域輸出：channel_id=`{ch_id}`，mode=`{s.mode}`，throttle=`{s.throttle_ms}ms`，chunk=`{s.chunk_limit}`，level=`{s.min_level}`")
     
 
     @commands.Cog.listener()
     async def on_ready(self):
         logger.info("AdminCog ready.")
 
-    @commands.group(name="admin", invoke_without_command=True)
-    async def admin_group(self, ctx: commands.Context):
-        await ctx.reply("管理指令：`rpg!admin restart`｜`rpg!admin dev add @user`｜`rpg!admin dev remove @user`｜`rpg!admin dev list`")
-
     # ===== 重啟（需要二次確認，開發者限定）=====
     @admin_group.command(name="restart", help="重啟 Bot（開發者限定，需二次確認）")
     async def admin_restart(self, ctx: commands.Context):
         if not is_dev(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者，不能使用此指令。")
+            return await self._reply(ctx, "你不是開發者，不能使用此指令。")
 
         r = self.config.get_restart()
 
         async def do_restart():
             try:
+                # 先把延遲寫入的設定寫完，execv / systemd 都不會再給我們機會
+                await self.config.flush()
                 if r.mode == "execv":
                     # 就地重啟（非 systemd）
                     await asyncio.sleep(0.3)
+                    if self.history is not None:
+                        # 佇列中與寫入器手上的擲骰紀錄
+                        await self.history.close()
+                    logger.info("以 execv 重啟")
+                    # execv 不會執行 atexit：先讓寫出執行緒把佇列寫完、等背景壓縮結束
+                    shutdown_logging()
                     sys.stdout.flush()
                     os.execv(sys.executable, [sys.executable] + sys.argv)
 
@@ -147,64 +176,129 @@ class AdminCog(commands.Cog, name="Admin"):
                     await asyncio.sleep(0.5)
 
                 else:
-                    await ctx.send(f"未知的 restart 模式：{r.mode}")
+                    await self._send(ctx, f"未知的 restart 模式：{r.mode}")
             except Exception as e:
-                await ctx.send(f"重啟失敗：{e}")
+                await self._send(ctx, f"重啟失敗：{e}")
 
         view = ConfirmRestartView(on_confirm=do_restart, requester_id=ctx.author.id)
-        await ctx.reply("⚠️ 確認要重啟 Bot？（30 秒內）", view=view)
+        await self._reply(ctx, "⚠️ 確認要重啟 Bot？（30 秒內）", view=view)
         
     # ---- 開發者名單管理 ----
     @admin_group.group(name="dev", invoke_without_command=True)
     async def admin_dev_group(self, ctx: commands.Context):
-        await ctx.reply("用法：`rpg!admin dev add @user`｜`rpg!admin dev remove @user`｜`rpg!admin dev list`")
+        await self._reply(ctx, "用法：`rpg!admin dev add @user`｜`rpg!admin dev remove @user`｜`rpg!admin dev list`")
 
     @admin_dev_group.command(name="add")
     async def admin_dev_add(self, ctx: commands.Context, user: discord.User):
         # 只有現有開發者或 App Owner 可以新增
         if not is_dev(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者，不能修改開發者名單。")
+            return await self._reply(ctx, "你不是開發者，不能修改開發者名單。")
         self.config.add_dev_user(user.id)
-        await ctx.reply(f"已加入開發者：{user.mention}")
+        await self._reply(ctx, f"已加入開發者：{user.mention}")
 
     @admin_dev_group.command(name="remove")
     async def admin_dev_remove(self, ctx: commands.Context, user: discord.User):
         if not is_dev(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者，不能修改開發者名單。")
+            return await self._reply(ctx, "你不是開發者，不能修改開發者名單。")
         self.config.remove_dev_user(user.id)
-        await ctx.reply(f"已移除開發者：{user.mention}")
+        await self._reply(ctx, f"已移除開發者：{user.mention}")
 
     @admin_dev_group.command(name="list")
     async def admin_dev_list(self, ctx: commands.Context):
         ids = self.config.get_dev_user_ids()
         if not ids:
-            return await ctx.reply("目前沒有開發者。")
+            return await self._reply(ctx, "目前沒有開發者。")
         users = [f"<@{uid}>" for uid in ids]
-        await ctx.reply("開發者名單：\n" + "\n".join(users))
+        await self._reply(ctx, "開發者名單：\n" + "\n".join(users))
 
     # ---- 重啟設定（rcfg）----
     @admin_group.group(name="rcfg", invoke_without_command=True)
     async def restart_cfg_group(self, ctx: commands.Context):
-        await ctx.reply("用法：`rpg!admin rcfg mode <execv|systemd_user|systemd_system>`｜`rpg!admin rcfg service <name>`｜`rpg!admin rcfg show`")
+        await self._reply(ctx, "用法：`rpg!admin rcfg mode <execv|systemd_user|systemd_system>`｜`rpg!admin rcfg service <name>`｜`rpg!admin rcfg show`")
 
     @restart_cfg_group.command(name="mode")
     async def restart_cfg_mode(self, ctx: commands.Context, mode: str):
         if not is_dev(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         try:
             self.config.set_restart_mode(mode)
         except ValueError as e:
-            return await ctx.reply(str(e))
-        await ctx.reply(f"已設定重啟模式為：**{mode}**")
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"已設定重啟模式為：**{mode}**")
 
     @restart_cfg_group.command(name="service")
     async def restart_cfg_service(self, ctx: commands.Context, service_name: str):
         if not is_dev(ctx, self.config, self.app_owner_id):
-            return await ctx.reply("你不是開發者。")
+            return await self._reply(ctx, "你不是開發者。")
         self.config.set_restart_service(service_name)
-        await ctx.reply(f"已設定服務名稱為：**{self.config.get_restart().service}**")
+        await self._reply(ctx, f"已設定服務名稱為：**{self.config.get_restart().service}**")
 
     @restart_cfg_group.command(name="show")
     async def restart_cfg_show(self, ctx: commands.Context):
         r = self.config.get_restart()
-        await ctx.reply(f"重啟設定：mode=`{r.mode}`，service=`{r.service}`")
+        await self._reply(ctx, f"重啟設定：mode=`{r.mode}`，service=`{r.service}`")
+
+    # ---- 設定快取狀態 ----
+    @admin_group.command(name="cache", help="伺服器設定快取的命中/未命中/淘汰統計（開發者限定）")
+    async def admin_cache(self, ctx: commands.Context):
+        if not is_dev(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        c = self.config.guild_cache
+        st = c.stats
+        total = st.hits + st.misses
+        rate = f"{st.hits / total:.1%}" if total else "-"
+        await self._reply(ctx,
+            f"伺服器設定快取：已載入 `{len(c)}`（釘選 `{c.pinned}`，LRU 上限 `{c.capacity}`）\n"
+            f"命中 `{st.hits}`，未命中 `{st.misses}`（命中率 {rate}），淘汰 `{st.evictions}`"
+        )
+
+    # ---- 設定熱重載 ----
+    @admin_group.command(name="reload", help="立即檢查並套用手動修改過的設定檔（開發者限定）")
+    async def admin_reload(self, ctx: commands.Context):
+        if not is_dev(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        applied = await self.config.reload_changed()
+        if not applied:
+            return await self._reply(ctx, "設定檔沒有新的變更。")
+        lines = [f"`{'全域' if key == 'global' else key[1]}`：{', '.join(f)}" for key, f in applied.items()]
+        await self._reply(ctx, "已重新載入設定：\n" + "\n".join(lines[:20]))
+
+    # ---- 日誌交接緩衝 ----
+    @admin_group.group(name="logq", invoke_without_command=True, help="日誌緩衝的深度與丟棄統計（開發者限定）")
+    async def admin_logq(self, ctx: commands.Context):
+        if not is_dev(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        s = LOG_RING.settings
+        st = LOG_RING.stats
+        policy = f"{s.policy}（每 {s.sample_every} 行留 1 行）" if s.policy == "sample" else s.policy
+        dests = ""
+        logs = self.bot.get_cog("Logs")
+        if logs is not None:
+            curs = [cur for _, cur in logs.fanout.items()]
+            if curs:
+                worst = max(cur.lag() for cur in curs)
+                dests = (f"目的地 `{len(curs)}` 個：未讀最多 `{max(len(c) for c in curs)}` 行，"
+                         f"最大延遲 {worst:.1f}s，落後太多而跳過共 `{sum(c.stats.dropped for c in curs)}` 行\n")
+        await self._reply(ctx,
+            f"日誌緩衝：目前 `{len(LOG_RING)}` / 容量 `{s.capacity}`，策略 `{policy}`\n"
+            f"已入列 `{st.enqueued}`，已丟棄 `{st.dropped}`，最大深度 `{st.max_depth}`\n"
+            + dests +
+            "設定：`rpg!admin logq policy <oldest|lowest|sample> [N]`｜`rpg!admin logq size <行數>`"
+        )
+
+    @admin_logq.command(name="policy")
+    async def admin_logq_policy(self, ctx: commands.Context, policy: str, sample_every: int | None = None):
+        if not is_dev(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        try:
+            self.config.set_log_queue_policy(policy, sample_every)
+        except ValueError as e:
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"日誌緩衝滿載策略已設為 **{policy}**")
+
+    @admin_logq.command(name="size")
+    async def admin_logq_size(self, ctx: commands.Context, n: int):
+        if not is_dev(ctx, self.config, self.app_owner_id):
+            return await self._reply(ctx, "你不是開發者。")
+        self.config.set_log_queue_capacity(n)
+        await self._reply(ctx, f"日誌緩衝容量已設為 **{self.config.get_log_queue_settings().capacity}** 行")
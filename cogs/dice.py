@@ -1,180 +1,715 @@
 # cogs/dice.py
+import asyncio
 import logging
+import re
+from functools import partial
+from typing import Awaitable, Callable
 import discord
 from discord.ext import commands
-from utils.dice import parse_and_roll, DiceError, extract_repeat
-from utils.config import ConfigManager
+from utils.dice import compile_expr, roll_bulk, DiceError, extract_repeat, find_inline, simulate as simulate_dice
+from utils.config import ConfigManager, DICE_LIMIT_CEILING
 from utils import coc as coc7
+from utils import prob
+from utils import sim
+from utils.rng import RngRegistry, RngProvider
+from utils.history import RollHistory, RollRecord
+from utils.crit_report import CritBatch, CritPublisher, CritReport
+from utils.outbound import OutboundScheduler, Priority
+from utils.admission import TokenBuckets
+from utils.logging_config import LOG_GUILD
 
 logger = logging.getLogger("trpg_bot")
 
+OFFLOAD_DRAWS = 20_000   # 總骰數超過此值時改在執行緒中擲骰
+SIM_COST = 1000          # rpg!sim 的固定計費（受時間預算限制，與次數無關）
+
+class DiceBudgetExceeded(commands.CheckFailure):
+    """擲骰額度不足（cog_check 拋出，由 cog_command_error 回覆）。"""
+
+def _clip(s: str, limit: int = 1500) -> str:
+    return s if len(s) <= limit else s[:limit] + " …"
+
+CC_RE = re.compile(r"^(?:d100<=)?(\d+)((?:[bp]\d?)*)$", re.IGNORECASE)
+
+def _parse_cc(core: str):
+    """'65'、'd100<=65'、'65 b'、'65 pp'、'65 b2' → (技能, 獎勵骰數, 懲罰骰數)；格式錯誤回傳 None。"""
+    m = CC_RE.match(core.replace(" ", ""))
+    if not m:
+        return None
+    bonus = penalty = 0
+    for tag, n in re.findall(r"([bp])(\d?)", m.group(2).lower()):
+        k = int(n or 1)
+        if tag == "b":
+            bonus += k
+        else:
+            penalty += k
+    return int(m.group(1)), bonus, penalty
+
+INLINE_CC_RE = re.compile(r"^cc\s+(.+)$", re.IGNORECASE)
+
+def _bp_note(bonus: int, penalty: int) -> str:
+    net = bonus - penalty
+    if net > 0:
+        return f"（獎勵骰 ×{min(net, coc7.MAX_BONUS)}）"
+    if net < 0:
+        return f"（懲罰骰 ×{min(-net, coc7.MAX_BONUS)}）"
+    return ""
+
+def _sim_expr_ok(words: list[str]) -> bool:
+    """rpg!sim 的參數（不含次數）是否可解析：cc 需剩下技能值，其餘需能編譯成骰式。"""
+    if words and words[0].lower() == "cc":
+        return _parse_cc(" ".join(w for w in words[1:] if w.lower() != "push")) is not None
+    try:
+        compile_expr(" ".join(words))
+    except DiceError:
+        return False
+    return True
+
+def _sim_embed(title: str, res: sim.SimResult, lines: list[str]) -> discord.Embed:
+    status = "⏱️ 已達時間上限，僅部分結果" if res.timed_out else ("✅ 完成" if res.trials >= res.requested else "⏳ 進行中")
+    head = f"{status}｜{res.trials:,} / {res.requested:,} 次｜{res.elapsed:.1f} 秒"
+    return discord.Embed(title=title, description="\n".join([head, *lines]), color=discord.Color.teal())
+
+def _bars(rows: list[tuple[str, int]], n: int) -> list[str]:
+    peak = max((c for _, c in rows), default=0) or 1
+    return [f"`{label:>11}: {c / n:6.2%}` {'█' * round(c / peak * 20)}" for label, c in rows]
+
+def _dice_sim_lines(plan, res: sim.SimResult) -> list[str]:
+    n = res.trials
+    if not n:
+        return []
+    keys = sorted(res.hist)
+    mean = sum(k * res.hist[k] for k in keys) / n
+    lines = [f"範圍：{keys[0]} ~ {keys[-1]}，平均：**{mean:.2f}**"]
+    if "success" in res.extra:
+        lines.append(f"檢定成功率：**{res.extra['success'] / n:.2%}**（{plan.cmp} {plan.target}）")
+    if plan.crit_sides:
+        lines.append(f"大成功：{res.extra.get('crit', 0) / n:.2%}，大失敗：{res.extra.get('fumble', 0) / n:.2%}")
+    # 值域太寬時分箱，最多 12 列
+    lo, hi = keys[0], keys[-1]
+    width = max(1, -(-(hi - lo + 1) // 12))
+    bins: dict[int, int] = {}
+    for k in keys:
+        b = lo + (k - lo) // width * width
+        bins[b] = bins.get(b, 0) + res.hist[k]
+    rows = [(str(b) if width == 1 else f"{b}~{b + width - 1}", c) for b, c in sorted(bins.items())]
+    return lines + ["— 分布 —", *_bars(rows, n)]
+
+def _coc_sim_lines(res: sim.SimResult) -> list[str]:
+    n = res.trials
+    if not n:
+        return []
+    ok = sum(res.hist.get(k, 0) for k in coc7.SUCCESS_LEVELS)
+    lines = [f"成功率：**{ok / n:.2%}**"]
+    if res.extra.get("pushed"):
+        lines.append(f"孤注一擲：{res.extra['pushed'] / n:.2%} 的檢定進行了重擲")
+    return lines + ["— 分布 —", *_bars([(k, res.hist.get(k, 0)) for k in coc7.LEVELS], n)]
+
+# ---- 連續擲骰分頁 ----
+PAGE_SIZE = 10
+
+class RollPager(discord.ui.View):
+    """連續擲骰的明細分頁：每頁由 render_line(i) 即時產生，不預先組出全部內容；逾時後釋放結果。"""
+
+    def __init__(self, author_id: int, title: str, header: list[str], stats: list[str],
+                 count: int, render_line: Callable[[int], str], footer: str, out: OutboundScheduler,
+                 timeout: float = 180.0):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.title = title
+        self.header = header
+        self.stats = stats
+        self.count = count
+        self.render_line = render_line
+        self.footer = footer
+        self.out = out
+        self.color = discord.Color.random()
+        self.page = 0
+        self.pages = -(-count // PAGE_SIZE)
+        self.message: discord.Message | None = None
+        self._sync_buttons()
+
+    def embed(self) -> discord.Embed:
+        start = self.page * PAGE_SIZE
+        end = min(start + PAGE_SIZE, self.count)
+        lines = [
+            *self.header,
+            f"— 明細（第 {start + 1}–{end} 次｜{self.page + 1}/{self.pages} 頁）—",
+            *(self.render_line(i) for i in range(start, end)),
+            "— 統計 —",
+            *self.stats,
+        ]
+        e = discord.Embed(title=self.title, description="\n".join(lines), color=self.color)
+        e.set_footer(text=self.footer)
+        return e
+
+    def _sync_buttons(self):
+        self.btn_first.disabled = self.btn_prev.disabled = self.page == 0
+        self.btn_next.disabled = self.btn_last.disabled = self.page >= self.pages - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("只有發起者可以翻頁。", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self) -> None:
+        for c in self.children:
+            if isinstance(c, (discord.ui.Button,)):
+                c.disabled = True
+        if self.message:
+            try:
+                await self.out.submit(self.message.channel.id, partial(self.message.edit, view=self),
+                                      priority=Priority.REPLY, key=("edit", self.message.id))
+            except Exception:
+                pass
+        # 釋放擲骰結果，只留下畫面上的那一頁
+        self.render_line = None
+        self.message = None
+
+    async def _go(self, interaction: discord.Interaction, page: int):
+        self.page = max(0, min(self.pages - 1, page))
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="⏮", style=discord.ButtonStyle.secondary)
+    async def btn_first(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._go(interaction, 0)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.primary)
+    async def btn_prev(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._go(interaction, self.page - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.primary)
+    async def btn_next(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._go(interaction, self.page + 1)
+
+    @discord.ui.button(label="⏭", style=discord.ButtonStyle.secondary)
+    async def btn_last(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._go(interaction, self.pages - 1)
+
+    @discord.ui.button(label="關閉", style=discord.ButtonStyle.danger)
+    async def btn_close(self, interaction: discord.Interaction, _: discord.ui.Button):
+        self.render_line = None
+        self.stop()
+        await interaction.response.edit_message(view=None)
+
+async def _send_pager(reply: Callable[..., Awaitable[discord.Message]], pager: RollPager):
+    if pager.pages > 1:
+        pager.message = await reply(embed=pager.embed(), view=pager)
+    else:
+        pager.stop()
+        await reply(embed=pager.embed())
+
 class DiceCog(commands.Cog, name="Dice"):
-    def __init__(self, bot: commands.Bot, config: ConfigManager):
+    def __init__(self, bot: commands.Bot, config: ConfigManager, history: RollHistory | None = None,
+                 outbound: OutboundScheduler | None = None):
         self.bot = bot
         self.config = config
+        self.rngs = RngRegistry()
+        self.history = history
+        self.out = outbound or OutboundScheduler()
+        self.buckets = TokenBuckets()
+        self.crits = CritPublisher(self._send_crits,
+                                   lambda gid: self.config.get_crit_window_ms(gid) / 1000)
 
     @commands.Cog.listener()
     async def on_ready(self):
         logger.info("DiceCog ready.")
 
+    async def cog_unload(self):
+        # 行程池是整個行程共用的（啟動時建立），由 main.py 在結束時關閉
+        await self.crits.close()
+
+    # ---- 額度：以骰數 × 次數計費的權杖桶 ----
+    def _estimate_cost(self, ctx: commands.Context) -> int:
+        """從原始訊息估計這個指令要擲多少顆骰；只解析（編譯有快取），不擲。"""
+        root = ctx.command.root_parent or ctx.command
+        parts = ctx.message.content[len(ctx.prefix or ""):].split(None, 1)
+        args = parts[1] if len(parts) > 1 else ""
+        try:
+            if root.name in ("dnd", "roll"):
+                if args.split(None, 1)[:1] == ["prob"]:
+                    return compile_expr(args.split(None, 1)[1]).dice_count
+                times, core = extract_repeat(args, max_times=DICE_LIMIT_CEILING.max_times)
+                return times * compile_expr(core).dice_count
+            if root.name == "cc":
+                return extract_repeat(args, max_times=DICE_LIMIT_CEILING.max_times)[0]
+        except (DiceError, IndexError):
+            return 1   # 格式錯誤交給指令本身回覆
+        if root.name == "sim":
+            return SIM_COST
+        return 0
+
+    def _acquire(self, guild: discord.Guild | None, user_id: int, cost: int, max_wait: float | None = None):
+        """向玩家桶與伺服器桶同時扣款；回傳 (需等待秒數或 None, 設定)。"""
+        b = self.config.get_dice_budget(guild.id if guild else None)
+        gid = guild.id if guild else 0
+        buckets = [(("u", gid, user_id), b.user_burst, b.user_rate)]
+        if guild:
+            buckets.append((("g", gid), b.guild_burst, b.guild_rate))
+        wait = self.buckets.acquire(buckets, cost, b.max_wait if max_wait is None else max_wait)
+        if wait is None:
+            wait = -self.buckets.retry_after(buckets, cost)   # 負值：拒絕，絕對值為建議等待秒數
+        return wait, b
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        # 群組與子指令各會檢查一次，只計費一次
+        if getattr(ctx, "_dice_charged", False):
+            return True
+        ctx._dice_charged = True
+        cost = self._estimate_cost(ctx)
+        if cost <= 0:
+            return True
+        b = self.config.get_dice_budget(ctx.guild.id if ctx.guild else None)
+        if cost > b.user_burst or (ctx.guild and cost > b.guild_burst):
+            raise DiceBudgetExceeded(f"這次要擲 {cost} 顆骰，超過單次額度上限 {min(b.user_burst, b.guild_burst)}。")
+        wait, b = self._acquire(ctx.guild, ctx.author.id, cost)
+        if wait < 0:
+            raise DiceBudgetExceeded(
+                f"⏳ 擲骰太頻繁了：這次需要 {cost} 顆骰的額度，請約 {-wait:.0f} 秒後再試"
+                f"（每人每秒回復 {b.user_rate:g} 顆，上限 {b.user_burst}）。")
+        if wait > 0:
+            await asyncio.sleep(wait)   # 短暫排隊：額度已預扣
+        return True
+
+    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, DiceBudgetExceeded):
+            await self._reply(ctx, str(error))
+        elif isinstance(error, commands.CommandInvokeError):
+            logger.error(f"指令執行失敗（{ctx.command}）：{error.original}", exc_info=error.original)
+        else:
+            logger.warning(f"指令錯誤（{ctx.command}）：{error}")
+
+    # ---- 送出：一律經過 OutboundScheduler，玩家回覆優先於日誌 ----
+    async def _reply(self, ctx: commands.Context | discord.Message, *args, **kwargs) -> discord.Message:
+        return await self.out.submit(ctx.channel.id, partial(ctx.reply, *args, **kwargs), priority=Priority.REPLY)
+
+    async def _edit(self, msg: discord.Message, **kwargs) -> discord.Message:
+        # 同一則訊息尚未送出的編輯會被較新的取代
+        return await self.out.submit(msg.channel.id, partial(msg.edit, **kwargs),
+                                     priority=Priority.REPLY, key=("edit", msg.id))
+
+    def _crit_kwargs(self, ctx: commands.Context | discord.Message) -> dict:
+        crit_rules = self.config.get_crit_rules(ctx.guild.id if ctx.guild else None)
+        return dict(
+            d20_crit_succ=crit_rules.d20_crit_success,
+            d20_crit_fail=crit_rules.d20_crit_failure,
+            d100_crit_succ=crit_rules.d100_crit_success,
+            d100_crit_fail=crit_rules.d100_crit_failure,
+            rng=self._rng(ctx),
+        )
+
+    def _rng(self, ctx: commands.Context | discord.Message) -> RngProvider:
+        gid = ctx.guild.id if ctx.guild else None
+        s = self.config.get_rng_settings(gid)
+        return self.rngs.for_guild(gid, s.mode, s.seed)
+
+    async def _send_crits(self, batch: CritBatch):
+        # 視窗到期時才讀頻道設定，期間改頻道或關閉都會生效
+        ch_id = self.config.get_crit_log_channel_id(batch.guild_id)
+        ch = self.bot.get_channel(ch_id) if ch_id else None
+        if not isinstance(ch, discord.TextChannel):
+            return
+        color = discord.Color.green() if batch.crits >= batch.fumbles else discord.Color.red()
+        if len(batch.reports) == 1 and not batch.overflow:
+            r = batch.reports[0]
+            if r.kind == "cc":
+                title = "🎲 CoC 7e 大成功/大失敗統計"
+                desc = (f"玩家：{r.user_mention}\n頻道：#{r.channel}\n技能值：{r.label}\n"
+                        f"連續次數：{r.times}\n🎉大成功：{r.crits}，大失敗☠️：{r.fumbles}")
+            else:
+                title = "🎲 D&D 連續擲骰統計"
+                desc = (f"玩家：{r.user_mention}\n頻道：#{r.channel}\n表達式：`{r.label}`\n"
+                        f"連續次數：{r.times}\n大成功：{r.crits}，大失敗：{r.fumbles}")
+            embed = discord.Embed(title=title, description=desc, color=color)
+            return await self.out.submit(ch.id, partial(ch.send, embed=embed), priority=Priority.REPORT)
+
+        lines = []
+        for r in batch.reports:
+            label = f"CoC {r.label}" if r.kind == "cc" else f"`{r.label}`"
+            lines.append(f"{r.user_mention} #{r.channel} {label} x{r.times}：🎉{r.crits} ☠️{r.fumbles}")
+        desc = _clip("\n".join(lines), 3800)
+        if batch.overflow:
+            desc += f"\n…另有 {batch.overflow} 筆未列出"
+        n = len(batch.reports) + batch.overflow
+        embed = discord.Embed(title=f"🎲 大成功/大失敗彙整（{n} 筆）", description=desc, color=color)
+        embed.set_footer(text=f"合計 大成功 {batch.crits}，大失敗 {batch.fumbles}")
+        await self.out.submit(ch.id, partial(ch.send, embed=embed), priority=Priority.REPORT)
+
+    def _report_crits(self, ctx: commands.Context | discord.Message, kind: str, label: str, times: int, crits: int, fumbles: int):
+        # 只排入彙整佇列，不在指令中等待送出
+        if ctx.guild and (crits or fumbles) and self.config.get_crit_log_channel_id(ctx.guild.id):
+            self.crits.submit(ctx.guild.id, CritReport(
+                ctx.author.mention, str(ctx.channel), kind, label, times, crits, fumbles))
+
+    def _record(self, ctx: commands.Context | discord.Message, **fields):
+        # 只放進佇列，由 RollHistory 背景批次寫入
+        if self.history is not None:
+            self.history.record(RollRecord(
+                guild_id=ctx.guild.id if ctx.guild else 0, user_id=ctx.author.id, **fields))
+
+    # ---- 行內擲骰：一般聊天中的 [[2d6+3]] / [[cc 65]] ----
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        # 每則訊息都會經過這裡：find_inline 先以子字串檢查排除，不含 [[ 的訊息幾乎零成本
+        snippets = find_inline(message.content)
+        if not snippets or message.author.bot:
+            return
+        prefixes = await self.bot.get_prefix(message)
+        if message.content.startswith(tuple(prefixes) if isinstance(prefixes, list) else prefixes):
+            return   # 指令本身交給 commands 處理
+        LOG_GUILD.set(message.guild.id if message.guild else 0)
+
+        # 行內擲骰同樣計費；額度不足時不排隊也不回覆，避免洗版
+        cost = sum(1 if INLINE_CC_RE.match(s) else self._snippet_dice(s) for s in snippets)
+        if cost and self._acquire(message.guild, message.author.id, cost, max_wait=0.0)[0] < 0:
+            return
+
+        lines = [line for line in (self._inline_roll(message, s) for s in snippets) if line]
+        if lines:
+            await self._reply(message, "\n".join(lines), mention_author=False)
+
+    @staticmethod
+    def _snippet_dice(snippet: str) -> int:
+        try:
+            return compile_expr(snippet).dice_count
+        except DiceError:
+            return 0
+
+    def _inline_roll(self, message: discord.Message, snippet: str) -> str | None:
+        """擲一段行內骰式；無法解析時回傳 None（[[...]] 也常是一般文字，不回錯誤）。"""
+        m = INLINE_CC_RE.match(snippet)
+        if m:
+            parsed = _parse_cc(m.group(1))
+            if parsed is None:
+                return None
+            skill, bonus, penalty = parsed
+            batch = coc7.evaluate_many(skill, 1, bonus=bonus, penalty=penalty, rng=self._rng(message))
+            r = batch.result(0)
+            self._record(message, kind="cc", expr=m.group(1).strip(), times=1, n_dice=1,
+                         luck_sum=batch.luck_sum(), crits=int(r.is_crit), fumbles=int(r.is_fumble),
+                         checks=1, successes=int(r.level in coc7.SUCCESS_LEVELS), first_total=r.roll)
+            self._report_crits(message, "cc", str(skill), 1, int(r.is_crit), int(r.is_fumble))
+            return f"`cc {r.skill}`{_bp_note(bonus, penalty)} → {r.roll:02d} **{r.level}**"
+
+        limits = self.config.get_dice_limits(message.guild.id if message.guild else None)
+        try:
+            plan = compile_expr(snippet)   # LRU 快取：重複出現的片段不會重新編譯
+            plan.check_limits(max_dice=limits.max_dice, max_sides=limits.max_sides)
+            bulk = roll_bulk(plan, 1, **self._crit_kwargs(message))
+        except DiceError:
+            return None
+        r = bulk.result(0)
+        self._record(message, kind="dnd", expr=plan.expr, times=1, n_dice=plan.dice_count,
+                     luck_sum=bulk.luck_sum(), crits=bulk.crit_count, fumbles=bulk.fumble_count,
+                     checks=int(r.success is not None), successes=int(bool(r.success)), first_total=r.total)
+        self._report_crits(message, "dnd", plan.expr, 1, bulk.crit_count, bulk.fumble_count)
+        line = f"`{plan.expr}` → {_clip(r.detail, 200)} = **{r.total}**"
+        if r.success is not None:
+            line += " ✅" if r.success else " ❌"
+        if r.is_crit_success:
+            line += " 🎉大成功"
+        elif r.is_crit_failure:
+            line += " 💥大失敗"
+        return line
+
     # ---- D&D 骰（取代原 roll），相容舊指令 ----
-    @commands.command(name="dnd", help="D&D 擲骰：rpg!dnd [+次數] <骰式> 例：rpg!dnd 2d6+1 / rpg!dnd +5 d20>=15")
+    @commands.group(name="dnd", invoke_without_command=True,
+                    help="D&D 擲骰：rpg!dnd [+次數] <骰式> 例：rpg!dnd 2d6+1 / rpg!dnd +5 d20>=15")
     async def dnd(self, ctx: commands.Context, *, expr: str):
         await self._do_dnd(ctx, expr)
 
+    @dnd.command(name="prob", help="精確機率：rpg!dnd prob <骰式> 例：rpg!dnd prob d20+5>=15 / rpg!dnd prob 4d6+2")
+    async def dnd_prob(self, ctx: commands.Context, *, expr: str):
+        gid = ctx.guild.id if ctx.guild else None
+        crit_rules = self.config.get_crit_rules(gid)
+        limits = self.config.get_dice_limits(gid)
+        try:
+            plan = compile_expr(expr)
+            plan.check_limits(max_dice=limits.max_dice, max_sides=limits.max_sides)
+            # 分布以 (顆數, 面數) 快取；首次計算大骰式時丟到執行緒
+            rep = await asyncio.to_thread(
+                prob.analyze, plan,
+                d20_crit_succ=crit_rules.d20_crit_success,
+                d20_crit_fail=crit_rules.d20_crit_failure,
+                d100_crit_succ=crit_rules.d100_crit_success,
+                d100_crit_fail=crit_rules.d100_crit_failure,
+            )
+        except DiceError as e:
+            return await self._reply(ctx, str(e))
+        except Exception as e:
+            logger.error(f"機率計算失敗（{expr}）：{e}")
+            return await self._reply(ctx, "無法計算這個骰式的機率分布。")
+
+        d = rep.dist
+        lines = [
+            f"表達式：`{plan.expr}`",
+            f"範圍：{d.min} ~ {d.max}，平均：**{d.mean():.2f}**，標準差：{d.stdev():.2f}",
+            f"中位數：{d.percentile(0.5)}（5%：{d.percentile(0.05)}，95%：{d.percentile(0.95)}）",
+        ]
+        if rep.success is not None:
+            lines.append(f"檢定成功率：**{rep.success:.2%}**（{plan.cmp} {plan.target}）")
+        if plan.crit_sides:
+            lines.append(f"大成功：{rep.crit_success:.2%}，大失敗：{rep.crit_failure:.2%}")
+        lines.append("— 最常見結果 —")
+        top = prob.top_outcomes(d, 10)
+        peak = max(p for _, p in top)
+        for total, p in top:
+            lines.append(f"`{total:>5}: {p:6.2%}` {'█' * max(1, round(p / peak * 20))}")
+
+        embed = discord.Embed(title="📊 機率分布", description="\n".join(lines), color=discord.Color.blurple())
+        embed.set_footer(text=f"{ctx.author} • #{ctx.channel}")
+        await self._reply(ctx, embed=embed)
+
     @commands.command(name="roll", help="（相容）請改用 rpg!dnd；語法相同。")
     async def roll_alias(self, ctx: commands.Context, *, expr: str):
         await self._do_dnd(ctx, expr)
 
     async def _do_dnd(self, ctx: commands.Context, expr: str):
+        gid = ctx.guild.id if ctx.guild else None
+        limits = self.config.get_dice_limits(gid)
         try:
-            times, core = extract_repeat(expr)
+            times, core = extract_repeat(expr, max_times=limits.max_times)
+            # 只編譯一次（LRU 快取），+N 連擲直接重複執行同一份計畫
+            plan = compile_expr(core)
+            plan.check_limits(max_dice=limits.max_dice, max_sides=limits.max_sides)
         except DiceError as e:
-            return await ctx.reply(str(e))
+            return await self._reply(ctx, str(e))
 
-        crit_rules = self.config.get_crit_rules(ctx.guild.id if ctx.guild else None)
+        crit_kwargs = self._crit_kwargs(ctx)
 
-        results = []
-        crit_count = fumble_count = 0
-        for _ in range(times):
-            try:
-                r = parse_and_roll(
-                    core,
-                    d20_crit_succ=crit_rules.d20_crit_success,
-                    d20_crit_fail=crit_rules.d20_crit_failure,
-                    d100_crit_succ=crit_rules.d100_crit_success,
-                    d100_crit_fail=crit_rules.d100_crit_failure,
-                )
-                results.append(r)
-                crit_count += int(r.is_crit_success)
-                fumble_count += int(r.is_crit_failure)
-            except DiceError as e:
-                return await ctx.reply(str(e))
+        # 所有次數一次抽完；量大時丟到執行緒，不卡事件迴圈
+        try:
+            if times * plan.dice_count > OFFLOAD_DRAWS:
+                bulk = await asyncio.to_thread(roll_bulk, plan, times, **crit_kwargs)
+            else:
+                bulk = roll_bulk(plan, times, **crit_kwargs)
+        except DiceError as e:
+            return await self._reply(ctx, str(e))
+
+        crit_count, fumble_count = bulk.crit_count, bulk.fumble_count
 
         # 組合輸出
         if times == 1:
+            r = bulk.result(0)
             title = "🎲 擲骰結果"
-            if results[0].is_crit_success: title = "🎉 大成功！"
-            if results[0].is_crit_failure: title = "💥 大失敗！"
+            if r.is_crit_success: title = "🎉 大成功！"
+            if r.is_crit_failure: title = "💥 大失敗！"
             lines = [
-                f"表達式：`{results[0].expr}`",
-                f"擲出：`{results[0].detail}`",
-                f"總和：**{results[0].total}**",
+                f"表達式：`{r.expr}`",
+                f"擲出：`{_clip(r.detail)}`",
+                f"總和：**{r.total}**",
             ]
-            if results[0].cmp and results[0].target is not None:
-                ok = eval(f"{results[0].total} {results[0].cmp} {results[0].target}")
-                lines.append(f"檢定：**{'成功' if ok else '失敗'}**（{results[0].total} {results[0].cmp} {results[0].target}）")
+            if r.success is not None:
+                lines.append(f"檢定：**{'成功' if r.success else '失敗'}**（{r.total} {r.cmp} {r.target}）")
+            embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.random())
+            embed.set_footer(text=f"{ctx.author} • #{ctx.channel}")
+            await self._reply(ctx, embed=embed)
         else:
-            title = f"🎲 連續擲骰 x{times}"
-            shown = min(10, times)
-            detail_lines = [f"{i+1:>2}: {r.detail} = {r.total}" for i, r in enumerate(results[:shown])]
-            if times > shown:
-                detail_lines.append(f"...（僅顯示前 {shown} 次）")
-            lines = [
-                f"表達式：`{core}`",
-                "— 明細 —",
-                *detail_lines,
-                "— 統計 —",
-                f"大成功：{crit_count} 次， 大失敗：{fumble_count} 次",
-            ]
+            stats = [f"大成功：{crit_count} 次， 大失敗：{fumble_count} 次"]
+            if bulk.success_count is not None:
+                stats.append(f"檢定成功：{bulk.success_count} / {times} 次")
+            width = len(str(times))
 
-        embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.random())
-        embed.set_footer(text=f"{ctx.author} • #{ctx.channel}")
-        await ctx.reply(embed=embed)
-
-        # 上報大成敗
-        if ctx.guild and (crit_count or fumble_count):
-            ch_id = self.config.get_crit_log_channel_id(ctx.guild.id)
-            if ch_id:
-                ch = self.bot.get_channel(ch_id)
-                if isinstance(ch, discord.TextChannel):
-                    desc = (
-                        f"玩家：{ctx.author.mention}\n"
-                        f"頻道：#{ctx.channel}\n"
-                        f"表達式：`{core}`\n"
-                        f"連續次數：{times}\n"
-                        f"大成功：{crit_count}，大失敗：{fumble_count}"
-                    )
-                    await ch.send(embed=discord.Embed(
-                        title="🎲 D&D 連續擲骰統計",
-                        description=desc,
-                        color=discord.Color.green() if crit_count >= fumble_count else discord.Color.red()
-                    ))
+            def render_line(i: int) -> str:
+                r = bulk.result(i)
+                return f"{i+1:>{width}}: {_clip(r.detail, 300)} = {r.total}"
+
+            await _send_pager(partial(self._reply, ctx), RollPager(
+                ctx.author.id, f"🎲 連續擲骰 x{times}", [f"表達式：`{plan.expr}`"], stats,
+                times, render_line, f"{ctx.author} • #{ctx.channel}", self.out,
+            ))
+
+        success_count = bulk.success_count
+        self._record(
+            ctx, kind="dnd", expr=plan.expr, times=times, n_dice=times * plan.dice_count,
+            luck_sum=bulk.luck_sum(), crits=crit_count, fumbles=fumble_count,
+            checks=times if success_count is not None else 0, successes=success_count or 0,
+            first_total=int(bulk.totals[0]),
+        )
+
+        # 上報大成敗（背景彙整）
+        self._report_crits(ctx, "dnd", core, times, crit_count, fumble_count)
 
     # ---- CoC 7e ----
-    @commands.command(name="cc", help="CoC 7e：rpg!cc [+次數] <技能值>（例：rpg!cc 65 / rpg!cc +5 40）或 rpg!cc d100<=65")
+    @commands.command(name="cc", help="CoC 7e：rpg!cc [+次數] <技能值> [b|p]（例：rpg!cc 65 / rpg!cc +5 40 / rpg!cc 65 b）或 rpg!cc d100<=65")
     async def coc(self, ctx: commands.Context, *, expr: str):
+        limits = self.config.get_dice_limits(ctx.guild.id if ctx.guild else None)
         try:
-            times, core = extract_repeat(expr)
+            times, core = extract_repeat(expr, max_times=limits.max_times)
         except DiceError as e:
-            return await ctx.reply(str(e))
+            return await self._reply(ctx, str(e))
 
-        # 解析技能值（容許 'd100<=65' 或純 '65'）
-        skill = None
-        core_strip = core.replace(" ", "")
-        if core_strip.lower().startswith("d100<="):
-            try:
-                skill = int(core_strip[6:])
-            except ValueError:
-                return await ctx.reply("技能值格式錯誤。例：`rpg!cc 65` 或 `rpg!cc d100<=65`")
-        else:
-            try:
-                skill = int(core_strip)
-            except ValueError:
-                return await ctx.reply("技能值格式錯誤。例：`rpg!cc 65` 或 `rpg!cc d100<=65`")
-
-        # 連續擲骰
-        bucket = {"大成功":0,"極限成功":0,"困難成功":0,"普通成功":0,"失敗":0,"大失敗":0}
-        rolls = []
-        for _ in range(times):
-            r = coc7.evaluate(skill, coc7.d100())
-            rolls.append(r)
-            bucket[r.level] += 1
+        # 解析技能值（容許 'd100<=65' 或純 '65'，後綴 b/bb/b2 獎勵骰、p/pp/p2 懲罰骰）
+        parsed = _parse_cc(core)
+        if parsed is None:
+            return await self._reply(ctx, "技能值格式錯誤。例：`rpg!cc 65`、`rpg!cc d100<=65`、`rpg!cc 65 b`（獎勵骰）、`rpg!cc 65 p2`（懲罰骰）")
+        skill, bonus, penalty = parsed
+
+        # 連續擲骰：一次抽完、查表並統計
+        batch = coc7.evaluate_many(skill, times, bonus=bonus, penalty=penalty, rng=self._rng(ctx))
+        bucket = batch.counts
+        bp_note = _bp_note(bonus, penalty)
 
         # 輸出
         if times == 1:
-            r = rolls[0]
+            r = batch.result(0)
             title = "🎲 CoC 7e"
             if r.is_crit: title = "🎉 大成功"
             elif r.is_fumble: title = "💥 大失敗"
             lines = [
-                f"骰值：**{r.skill}**",
-                f"擲出：**{r.roll:02d}**",
+                f"骰值：**{r.skill}**{bp_note}",
+                f"擲出：**{r.roll:02d}**" + (f"（十位骰：{', '.join(f'{t}0' for t in batch.tens[0])}）" if batch.tens else ""),
                 f"判定：**{r.level}**（閾值：極限≤{max(1,r.skill//5)}、困難≤{max(1,r.skill//2)}、普通≤{r.skill}）",
             ]
+            embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.random())
+            embed.set_footer(text=f"{ctx.author} • #{ctx.channel}")
+            await self._reply(ctx, embed=embed)
         else:
-            title = f"🎲 CoC 7e 連續擲骰 x{times}"
-            shown = min(10, times)
-            detail_lines = [f"{i+1:>2}: {r.roll:02d} → {r.level}" for i, r in enumerate(rolls[:shown])]
-            if times > shown:
-                detail_lines.append(f"...（僅顯示前 {shown} 次）")
-            lines = [
-                f"骰值：**{skill}**",
-                "— 明細 —",
-                *detail_lines,
-                "— 統計 —",
-                f"🎉大成功：{bucket['大成功']}｜極限成功：{bucket['極限成功']}｜困難成功：{bucket['困難成功']}｜普通成功：{bucket['普通成功']}｜失敗：{bucket['失敗']}｜大失敗☠️：{bucket['大失敗']}",
-            ]
+            width = len(str(times))
 
-        embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.random())
-        embed.set_footer(text=f"{ctx.author} • #{ctx.channel}")
-        await ctx.reply(embed=embed)
-
-        # 上報（有 大成功 或 大失敗 時）
-        if ctx.guild and (bucket["大成功"] or bucket["大失敗"]):
-            ch_id = self.config.get_crit_log_channel_id(ctx.guild.id)
-            if ch_id:
-                ch = self.bot.get_channel(ch_id)
-                if isinstance(ch, discord.TextChannel):
-                    desc = (
-                        f"玩家：{ctx.author.mention}\n"
-                        f"頻道：#{ctx.channel}\n"
-                        f"技能值：{skill}\n"
-                        f"連續次數：{times}\n"
-                        f"🎉大成功：{bucket['大成功']}，大失敗☠️：{bucket['大失敗']}"
-                    )
-                    await ch.send(embed=discord.Embed(
-                        title="🎲 CoC 7e 大成功/大失敗統計",
-                        description=desc,
-                        color=discord.Color.green() if bucket["大成功"] >= bucket["大失敗"] else discord.Color.red()
-                    ))
+            def render_line(i: int) -> str:
+                return f"{i+1:>{width}}: {batch.rolls[i]:02d} → {batch.result(i).level}"
+
+            await _send_pager(partial(self._reply, ctx), RollPager(
+                ctx.author.id, f"🎲 CoC 7e 連續擲骰 x{times}", [f"骰值：**{batch.skill}**{bp_note}"],
+                [f"🎉大成功：{bucket['大成功']}｜極限成功：{bucket['極限成功']}｜困難成功：{bucket['困難成功']}｜普通成功：{bucket['普通成功']}｜失敗：{bucket['失敗']}｜大失敗☠️：{bucket['大失敗']}"],
+                times, render_line, f"{ctx.author} • #{ctx.channel}", self.out,
+            ))
+
+        self._record(
+            ctx, kind="cc", expr=core.strip(), times=times, n_dice=times,
+            luck_sum=batch.luck_sum(), crits=bucket["大成功"], fumbles=bucket["大失敗"],
+            checks=times, successes=sum(bucket[k] for k in coc7.SUCCESS_LEVELS),
+            first_total=batch.rolls[0],
+        )
+
+        # 上報（有 大成功 或 大失敗 時，背景彙整）
+        self._report_crits(ctx, "cc", str(skill), times, bucket["大成功"], bucket["大失敗"])
+
+    # ---- 蒙地卡羅模擬 ----
+    @commands.command(name="sim", help="模擬：rpg!sim <骰式> [次數] 例：rpg!sim 4d6kh3 100000 / rpg!sim cc 65 push 100000")
+    async def simulate(self, ctx: commands.Context, *, args: str):
+        words = args.split()
+        trials = 100_000
+        # 結尾的數字只有在拿掉後前面仍是完整骰式時才當作次數（`cc 65`、`d20 >= 15` 的數字屬於骰式）
+        if len(words) > 1 and words[-1].isdigit() and _sim_expr_ok(words[:-1]):
+            trials = int(words.pop())
+        if not (1 <= trials <= sim.MAX_TRIALS):
+            return await self._reply(ctx, f"模擬次數 1~{sim.MAX_TRIALS}")
+
+        msg = await self._reply(ctx, f"⏳ 模擬中…（{trials} 次，上限 {sim.DEFAULT_TIME_BUDGET:.0f} 秒）")
+
+        if words and words[0].lower() == "cc":
+            rest = [w for w in words[1:] if w.lower() != "push"]
+            pushed = len(rest) != len(words) - 1
+            parsed = _parse_cc(" ".join(rest))
+            if parsed is None:
+                return await self._edit(msg, content="用法：`rpg!sim cc <技能值> [b|p] [push] [次數]`")
+            skill, bonus, penalty = parsed
+            title = f"🧪 CoC 7e 模擬：技能 {skill}{_bp_note(bonus, penalty)}{'（孤注一擲）' if pushed else ''}"
+
+            def render(res: sim.SimResult) -> discord.Embed:
+                return _sim_embed(title, res, _coc_sim_lines(res))
+
+            async def progress(res: sim.SimResult):
+                # 進度不等送出；尚未送出的舊進度會被新的取代
+                self.out.fire(msg.channel.id, partial(msg.edit, content=None, embed=render(res)),
+                              priority=Priority.REPLY, key=("edit", msg.id))
+
+            res = await coc7.simulate(skill, trials, pushed=pushed, bonus=bonus, penalty=penalty,
+                                      on_progress=progress)
+        else:
+            crit_rules = self.config.get_crit_rules(ctx.guild.id if ctx.guild else None)
+            limits = self.config.get_dice_limits(ctx.guild.id if ctx.guild else None)
+            try:
+                plan = compile_expr(" ".join(words))
+                plan.check_limits(max_dice=limits.max_dice, max_sides=limits.max_sides)
+            except DiceError as e:
+                return await self._edit(msg, content=str(e))
+            title = f"🧪 模擬：`{plan.expr}`"
+
+            def render(res: sim.SimResult) -> discord.Embed:
+                return _sim_embed(title, res, _dice_sim_lines(plan, res))
+
+            async def progress(res: sim.SimResult):
+                # 進度不等送出；尚未送出的舊進度會被新的取代
+                self.out.fire(msg.channel.id, partial(msg.edit, content=None, embed=render(res)),
+                              priority=Priority.REPLY, key=("edit", msg.id))
+
+            try:
+                res = await simulate_dice(
+                    plan, trials, on_progress=progress,
+                    d20_crit_succ=crit_rules.d20_crit_success,
+                    d20_crit_fail=crit_rules.d20_crit_failure,
+                    d100_crit_succ=crit_rules.d100_crit_success,
+                    d100_crit_fail=crit_rules.d100_crit_failure,
+                )
+            except DiceError as e:
+                return await self._edit(msg, content=str(e))
+
+        await self._edit(msg, content=None, embed=render(res))
+
+    # ---- 亂數來源（管理員） ----
+    @commands.group(name="rng", invoke_without_command=True)
+    @commands.guild_only()
+    async def rng_group(self, ctx: commands.Context):
+        s = self.config.get_rng_settings(ctx.guild.id)
+        line = f"[{ctx.guild.name}] 亂數來源：mode=`{s.mode}`"
+        if s.mode == "seeded":
+            st = self._rng(ctx)
+            line += f"，seed=`{s.seed}`，已抽出 `{st.position}` 顆"
+        await self._reply(ctx,
+            line + "\n用法：`rpg!rng mode <fast|entropy|seeded>`｜`rpg!rng seed <整數>`（重設後從頭重播；需要管理伺服器權限）"
+        )
+
+    @rng_group.command(name="mode")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def rng_mode(self, ctx: commands.Context, mode: str):
+        try:
+            self.config.set_rng_mode(ctx.guild.id, mode.lower())
+        except ValueError as e:
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"[{ctx.guild.name}] 亂數來源已設為 **{mode.lower()}**")
+
+    @rng_group.command(name="seed")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def rng_seed(self, ctx: commands.Context, seed: int):
+        self.config.set_rng_seed(ctx.guild.id, seed)
+        self.rngs.reset(ctx.guild.id)
+        await self._reply(ctx, f"[{ctx.guild.name}] 場次種子已設為 `{seed}`，seeded 模式會從頭開始（可重播）")
+
+    # ---- 伺服器擲骰上限（管理員） ----
+    @commands.group(name="dicecfg", invoke_without_command=True)
+    @commands.guild_only()
+    async def dicecfg_group(self, ctx: commands.Context):
+        lim = self.config.get_dice_limits(ctx.guild.id)
+        b = self.config.get_dice_budget(ctx.guild.id)
+        await self._reply(ctx,
+            f"[{ctx.guild.name}] 擲骰上限：顆數=`{lim.max_dice}`，面數=`{lim.max_sides}`，連續次數=`{lim.max_times}`\n"
+            f"擲骰額度（骰數 × 次數）：每人 `{b.user_burst}`（每秒 +{b.user_rate:g}），"
+            f"伺服器 `{b.guild_burst}`（每秒 +{b.guild_rate:g}），超額最多排隊 `{b.max_wait:g}` 秒\n"
+            "用法：`rpg!dicecfg limit <dice|sides|times> <數值>`｜"
+            "`rpg!dicecfg budget <user_burst|user_rate|guild_burst|guild_rate|max_wait> <數值>`（需要管理伺服器權限）"
+        )
+
+    @dicecfg_group.command(name="limit")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def dicecfg_limit(self, ctx: commands.Context, kind: str, value: int):
+        key = {"dice": "max_dice", "sides": "max_sides", "times": "max_times"}.get(kind.lower())
+        if key is None:
+            return await self._reply(ctx, "種類必須是 dice / sides / times")
+        self.config.set_dice_limits(ctx.guild.id, **{key: value})
+        lim = self.config.get_dice_limits(ctx.guild.id)
+        await self._reply(ctx, f"[{ctx.guild.name}] 已設定 `{key}` = **{getattr(lim, key)}**")
+
+    @dicecfg_group.command(name="budget")
+    @commands.has_guild_permissions(manage_guild=True)
+    async def dicecfg_budget(self, ctx: commands.Context, key: str, value: float):
+        key = key.lower()
+        if key not in ("user_burst", "user_rate", "guild_burst", "guild_rate", "max_wait"):
+            return await self._reply(ctx, "種類必須是 user_burst / user_rate / guild_burst / guild_rate / max_wait")
+        self.config.set_dice_budget(ctx.guild.id, **{key: value})
+        b = self.config.get_dice_budget(ctx.guild.id)
+        await self._reply(ctx, f"[{ctx.guild.name}] 已設定 `{key}` = **{getattr(b, key):g}**")
@@ -2,31 +2,35 @@
 from __future__ import annotations
 
 import logging
+from functools import partial
 import discord
 from discord.ext import commands
 
+from utils.outbound import OutboundScheduler, Priority
+
 logger = logging.getLogger("trpg_bot")
 
 # ---- 內部：產生各頁 Embed ----
 def _embed_home(prefix: str) -> discord.Embed:
     e = discord.Embed(
         title="📖 指令總覽",
-        description="按下方按鈕切換分類；支援連續擲骰：在指令後加 `+次數`（上限 50）。",
+        description="按下方按鈕切換分類；支援連續擲骰：在指令後加 `+次數`（預設上限 50，管理員可調整）。",
         color=discord.Color.blurple(),
     )
     e.add_field(
         name="🎲 擲骰",
-        value=f"`{prefix}dnd <骰式>`（相容 `{prefix}roll`）｜`{prefix}cc <技能>`",
+        value=f"`{prefix}dnd <骰式>`（相容 `{prefix}roll`）｜`{prefix}cc <技能>`｜`{prefix}sim <骰式> [次數]`｜`{prefix}stats me/guild/luck`",
         inline=False,
     )
     e.add_field(
         name="🧾 日誌",
-        value=f"`{prefix}log stream set/off/mode/throttle`｜`{prefix}log level`｜`{prefix}log crit set/off`",
+        value=f"`{prefix}log stream set/off/mode/throttle/stats`｜`{prefix}log level`｜`{prefix}log crit set/off`",
         inline=False,
     )
     e.add_field(
         name="🛠️ 管理（開發者）",
-        value=f"`{prefix}admin restart`｜`{prefix}admin dev ...`｜`{prefix}admin rcfg ...`｜`{prefix}admin gstream ...`",
+        value=f"`{prefix}admin restart`｜`{prefix}admin dev ...`｜`{prefix}admin rcfg ...`｜`{prefix}admin gstream ...`｜"
+              f"`{prefix}admin cache`｜`{prefix}admin reload`｜`{prefix}admin logq ...`",
         inline=False,
     )
     e.set_footer(text=f"提示：例如 `{prefix}dnd +5 d20+3`、`{prefix}cc +10 65`")
@@ -39,7 +43,16 @@ def _embed_dice(prefix: str) -> discord.Embed:
         value=(
             "**用法**：\n"
             f"- 一般：`{prefix}dnd 2d6+1`、`{prefix}dnd d100<=65`\n"
-            f"- 連續：`{prefix}dnd +10 d20+5`（上限 50）\n"
+            f"- 組合：`{prefix}dnd 2d6+1d4+3`、`{prefix}dnd d20-(1d4+1)>=10`\n"
+            "- 行內：在一般聊天中寫 `[[2d6+3]]`、`[[cc 65]]`（每則最多 5 段）\n"
+            f"- 連續：`{prefix}dnd +10 d20+5`（預設上限 50；超過 10 次可用按鈕翻頁）\n"
+            f"- 機率：`{prefix}dnd prob d20+5>=15`、`{prefix}dnd prob 4d6+2`\n"
+            f"- 桌規：`4d6kh3`（留高）、`2d20kl1`（留低）、`2d6r2`（≤2 重擲一次）\n"
+            f"- 模擬：`{prefix}sim 4d6kh3 100000`、`{prefix}sim cc 65 push 100000`\n"
+            f"- 上限：`{prefix}dicecfg limit <dice|sides|times> <數值>`（管理員）\n"
+            f"- 額度：依骰數 × 次數計費，短暫超額會排隊、過量會請稍後再試；`{prefix}dicecfg budget ...`（管理員）\n"
+            f"- 亂數：`{prefix}rng mode <fast|entropy|seeded>`、`{prefix}rng seed <整數>`（管理員，seeded 可重播）\n"
+            f"- 統計：`{prefix}stats me 7d`、`{prefix}stats guild 7d`、`{prefix}stats luck 30d`（期間：24h / 7d / 4w / all）\n"
             "**說明**：d20 自然 20/1 與 d100 自然 1/100 會標記大成功/大失敗（可在設定中調整）。"
         ),
         inline=False,
@@ -50,6 +63,7 @@ def _embed_dice(prefix: str) -> discord.Embed:
             "**用法**：\n"
             f"- 技能值：`{prefix}cc 65` 或 `{prefix}cc d100<=65`\n"
             f"- 連續：`{prefix}cc +20 40`\n"
+            f"- 獎勵/懲罰骰：`{prefix}cc 65 b`、`{prefix}cc 65 pp`（各最多 2 顆，互相抵銷）\n"
             "**判定**：CRITICAL / EXTREME / HARD / REGULAR / FAIL / FUMBLE；"
             "符合 7e（01 為極佳、失手依技能值區間判定）。"
         ),
@@ -61,12 +75,17 @@ def _embed_logs(prefix: str) -> discord.Embed:
     e = discord.Embed(title="🧾 日誌 / 紀錄", color=discord.Color.orange())
     e.add_field(
         name=f"{prefix}log stream set #頻道",
-        value="把**一般日誌**即時串流到該伺服器指定頻道（只需管理員）。",
+        value="把**本伺服器**的日誌即時串流到指定頻道（只需管理員）；其他伺服器的紀錄不會出現。",
+        inline=False,
+    )
+    e.add_field(
+        name=f"{prefix}log stream off / mode <live|batch> / throttle <毫秒> / level <等級>",
+        value="關閉或調整串流模式、節流（建議 100–300ms）與最低等級（預設 INFO）。",
         inline=False,
     )
     e.add_field(
-        name=f"{prefix}log stream off / mode <live|batch> / throttle <毫秒>",
-        value="關閉或調整串流模式與節流（建議 100–300ms）。",
+        name=f"{prefix}log stream stats",
+        value="本伺服器日誌串流的積壓、延遲與丟棄統計。",
         inline=False,
     )
     e.add_field(
@@ -75,8 +94,8 @@ def _embed_logs(prefix: str) -> discord.Embed:
         inline=False,
     )
     e.add_field(
-        name=f"{prefix}log crit set #頻道 / off",
-        value="設定/關閉**大成功/大失敗**的上報頻道（每伺服器獨立）。",
+        name=f"{prefix}log crit set #頻道 / off / window <毫秒>",
+        value="設定/關閉**大成功/大失敗**的上報頻道（每伺服器獨立）；視窗內的上報會合併成一則（預設 2000ms）。",
         inline=False,
     )
     e.add_field(
@@ -104,8 +123,23 @@ def _embed_admin(prefix: str) -> discord.Embed:
         inline=False,
     )
     e.add_field(
-        name=f"{prefix}admin gstream set/off/mode/throttle/show",
-        value="設定**全域**日誌輸出頻道與模式。",
+        name=f"{prefix}admin gstream set/off/mode/throttle/level/show",
+        value="設定**全域**日誌輸出頻道、模式與最低等級（收到所有伺服器的紀錄）。",
+        inline=False,
+    )
+    e.add_field(
+        name=f"{prefix}admin cache",
+        value="伺服器設定快取的命中/未命中/淘汰統計。",
+        inline=False,
+    )
+    e.add_field(
+        name=f"{prefix}admin reload",
+        value="立即套用手動修改過的設定檔（平常約 0.5 秒內會自動套用）。",
+        inline=False,
+    )
+    e.add_field(
+        name=f"{prefix}admin logq [policy/size]",
+        value="日誌緩衝的深度、丟棄統計與滿載策略（oldest / lowest / sample）。",
         inline=False,
     )
     return e
@@ -114,19 +148,24 @@ def _embed_all(prefix: str) -> discord.Embed:
     e = discord.Embed(title="📚 全部指令速覽", color=discord.Color.light_grey())
     e.description = (
         f"**D&D**：`{prefix}dnd [+次數] <骰式>`（例：`{prefix}dnd 2d6+1`，`{prefix}dnd +5 d20>=15`）\n"
+        f"**機率**：`{prefix}dnd prob <骰式>`；**模擬**：`{prefix}sim <骰式|cc 技能 [push]> [次數]`\n"
+        f"**統計**：`{prefix}stats me [期間]`，`{prefix}stats guild [期間]`，`{prefix}stats luck [期間]`\n"
+        f"**行內**：聊天中的 `[[2d6+3]]`、`[[cc 65]]`\n"
         f"**相容**：`{prefix}roll ...`\n"
         f"**CoC 7e**：`{prefix}cc [+次數] <技能>` 或 `d100<=技能`\n"
-        f"**日誌**：`{prefix}log stream set/off/mode/throttle`，`{prefix}log level`，`{prefix}log crit set/off`\n"
-        f"**管理**：`{prefix}admin restart`；`{prefix}admin dev ...`；`{prefix}admin rcfg ...`；`{prefix}admin gstream ...`"
+        f"**日誌**：`{prefix}log stream set/off/mode/throttle/stats`，`{prefix}log level`，`{prefix}log crit set/off`\n"
+        f"**管理**：`{prefix}admin restart`；`{prefix}admin dev ...`；`{prefix}admin rcfg ...`；`{prefix}admin gstream ...`；"
+        f"`{prefix}admin cache`；`{prefix}admin reload`；`{prefix}admin logq ...`"
     )
     return e
 
 # ---- 互動面板 ----
 class HelpView(discord.ui.View):
-    def __init__(self, author_id: int, prefix: str, timeout: float = 180.0):
+    def __init__(self, author_id: int, prefix: str, out: OutboundScheduler, timeout: float = 180.0):
         super().__init__(timeout=timeout)
         self.author_id = author_id
         self.prefix = prefix
+        self.out = out
         self.page = "home"
         self.message: discord.Message | None = None
 
@@ -142,7 +181,8 @@ class HelpView(discord.ui.View):
                 c.disabled = True
         if self.message:
             try:
-                await self.message.edit(view=self)
+                await self.out.submit(self.message.channel.id, partial(self.message.edit, view=self),
+                                      priority=Priority.REPLY, key=("edit", self.message.id))
             except Exception:
                 pass
 
@@ -183,8 +223,9 @@ class HelpView(discord.ui.View):
 
 # ---- Cog ----
 class HelpCog(commands.Cog, name="Help"):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, outbound: OutboundScheduler | None = None):
         self.bot = bot
+        self.out = outbound or OutboundScheduler()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -193,11 +234,11 @@ class HelpCog(commands.Cog, name="Help"):
     @commands.command(name="help", aliases=["h"], help="顯示互動式說明")
     async def help_cmd(self, ctx: commands.Context, *, section: str | None = None):
         prefix = ctx.prefix or "rpg!"
-        view = HelpView(author_id=ctx.author.id, prefix=prefix)
+        view = HelpView(author_id=ctx.author.id, prefix=prefix, out=self.out)
         # 選擇預設頁
         sec = (section or "").lower().strip()
         page = {
-            "dice": "dice", "dnd": "dice", "roll": "dice", "cc": "dice",
+            "dice": "dice", "dnd": "dice", "roll": "dice", "cc": "dice", "stats": "dice",
             "log": "logs", "logs": "logs",
             "admin": "admin", "all": "all"
         }.get(sec, "home")
@@ -208,5 +249,6 @@ class HelpCog(commands.Cog, name="Help"):
             "admin": _embed_admin(prefix),
             "all": _embed_all(prefix),
         }[page]
-        msg = await ctx.reply(embed=emb, view=view)
+        msg = await self.out.submit(ctx.channel.id, partial(ctx.reply, embed=emb, view=view),
+                                    priority=Priority.REPLY)
         view.message = msg
@@ -4,32 +4,65 @@ from __future__ import annotations
 import logging
 import asyncio
 import time
+from collections import deque
+from functools import partial
 from dataclasses import dataclass, field
 import discord
 from discord.ext import commands
 
 from utils.config import ConfigManager
-from utils.logging_config import LOG_QUEUE
+from utils.log_fanout import Cursor, LogFanout
+from utils.logging_config import LOG_GUILD, LOG_RING, LOG_ROUTES, to_level
+from utils.outbound import OutboundScheduler, Priority
 
 logger = logging.getLogger("trpg_bot")
 
-def to_level(name: str) -> int:
-    name = (name or "").upper()
-    return getattr(logging, name, logging.INFO)
+LIVE_MAX_CHARS = 1900     # live 訊息中日誌區塊的上限（Discord 訊息 2000 字）
+LIVE_HEADER = "🔴 **Live Log**\n```log\n"
 
 @dataclass
 class LiveState:
+    """live 模式的滾動視窗：只保留最後 limit 個字的行，長度隨行進出增量維護。"""
     message: discord.Message | None = None
-    buffer: list[str] = field(default_factory=list)
+    lines: deque[str] = field(default_factory=deque)
+    chars: int = 0                  # "\n".join(lines) 的長度
     last_edit_ts: float = 0.0
+    shown: str | None = field(default=None, repr=False)    # 訊息目前顯示的內容
+    _text: str | None = field(default=None, repr=False)    # render() 的快取；有新行時失效
+
+    def push(self, lines: list[str], limit: int):
+        for line in lines:
+            if len(line) > limit:
+                line = line[-limit:]
+            self.chars += len(line) + (1 if self.lines else 0)
+            self.lines.append(line)
+        while self.chars > limit and len(self.lines) > 1:
+            self.chars -= len(self.lines.popleft()) + 1
+        self._text = None
+
+    def clear(self):
+        self.lines.clear()
+        self.chars = 0
+        self._text = None
+
+    def render(self) -> str:
+        if self._text is None:
+            self._text = LIVE_HEADER + ("\n".join(self.lines) or "(啟動)") + "\n```"
+        return self._text
 
 class LogsCog(commands.Cog, name="Logs"):
-    def __init__(self, bot: commands.Bot, config: ConfigManager):
+    def __init__(self, bot: commands.Bot, config: ConfigManager, outbound: OutboundScheduler | None = None):
         self.bot = bot
         self.config = config
+        self.out = outbound or OutboundScheduler()
         self._relay_task: asyncio.Task | None = None
         # guild_id -> LiveState；0 代表全域
         self._live_state: dict[int, LiveState] = {}
+        # 日誌只存一份（共用環狀緩衝）；每個目的地（guild_id；0 代表全域）一個讀取位置與 worker，互不阻塞
+        # 伺服器目的地只收自己伺服器的紀錄（publish 時就分流），全域收全部；各自再依 min_level 過濾
+        self.fanout = LogFanout(self._dest_worker, accept=LOG_ROUTES.accepts, route=lambda gid: gid or None)
+        self._dest_snapshot: tuple | None = None
+        self._dest_gch_id = 0
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -37,6 +70,12 @@ class LogsCog(commands.Cog, name="Logs"):
         if self._relay_task is None:
             self._relay_task = self.bot.loop.create_task(self._relay_logs())
 
+    async def cog_unload(self):
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+            self._relay_task = None
+        await self.fanout.close()
+
     # ---------- live 模式輔助 ----------
     def _state(self, guild_id: int) -> LiveState:
         st = self._live_state.get(guild_id)
@@ -45,108 +84,139 @@ class LogsCog(commands.Cog, name="Logs"):
             self._live_state[guild_id] = st
         return st
 
-    def _render_live_text(self, guild_id: int) -> str:
-        st = self._state(guild_id)
-        s = "\n".join(st.buffer)
+    def _live_limit(self, guild_id: int) -> int:
         if guild_id == 0:
             limit = self.config.get_global_stream_settings().chunk_limit
         else:
             limit = self.config.get_stream_settings(guild_id).chunk_limit
-        if len(s) > limit:
-            s = s[-limit:]
-        return "🔴 **Live Log**\n```log\n" + s + "\n```"
+        return min(limit, LIVE_MAX_CHARS)
 
-    async def _ensure_live_message(self, guild_id: int, channel: discord.TextChannel):
+    async def _reply(self, ctx: commands.Context, *args, **kwargs) -> discord.Message:
+        # 指令回覆優先於日誌；與日誌串流走同一個頻道佇列，不會互相撞上速率限制
+        return await self.out.submit(ctx.channel.id, partial(ctx.reply, *args, **kwargs), priority=Priority.REPLY)
+
+    async def _send_log(self, channel: discord.TextChannel, content: str) -> discord.Message | None:
+        # 日誌優先序最低；佇列滿時會被丟棄並回傳 None
+        return await self.out.submit(channel.id, partial(channel.send, content), priority=Priority.LOG)
+
+    async def _live_append(self, guild_id: int, channel: discord.TextChannel, lines: list[str]):
         st = self._state(guild_id)
-        content = self._render_live_text(guild_id)
-        try:
-            if st.message is None:
-                st.message = await channel.send(content if content.strip() else "🔴 **Live Log**\n```log\n(啟動)\n```")
-            else:
-                if len(content) > 1950:
-                    st.message = await channel.send("🔴 **Live Log**\n```log\n(續)\n```")
-                    st.buffer.clear()
-        except Exception:
-            st.message = None
-
-    async def _live_push(self, guild_id: int, channel: discord.TextChannel, line: str):
+        st.push(lines, self._live_limit(guild_id))
+        if st.message is None:
+            text = st.render()
+            try:
+                st.message = await self._send_log(channel, text)
+                st.shown = text
+            except Exception:
+                st.message = None
+
+    async def _start_live(self, guild_id: int, channel: discord.TextChannel):
+        """開一則新的 live 訊息（清空視窗）。"""
         st = self._state(guild_id)
-        st.buffer.append(line)
-        await self._ensure_live_message(guild_id, channel)
+        st.clear()
+        st.message = None
+        st.last_edit_ts = 0.0
+        await self._live_append(guild_id, channel, [])
 
+    def _throttle_left(self, guild_id: int) -> float:
         throttle = (
             self.config.get_global_stream_settings().throttle_ms
             if guild_id == 0 else
             self.config.get_stream_settings(guild_id).throttle_ms
         ) / 1000.0
+        return throttle - (time.monotonic() - self._state(guild_id).last_edit_ts)
 
-        now = time.monotonic()
-        if now - st.last_edit_ts < throttle:
-            return
-        if st.message is None:
+    def _live_edit(self, guild_id: int, channel: discord.TextChannel):
+        st = self._state(guild_id)
+        text = st.render()
+        if st.message is None or text is st.shown:
             return
 
-        try:
-            await st.message.edit(content=self._render_live_text(guild_id))
-            st.last_edit_ts = time.monotonic()
-        except Exception:
-            st.message = None
+        msg = st.message
 
-    async def _batch_push(self, guild_id: int, channel: discord.TextChannel, first_line: str):
-        batch = [first_line]
-        try:
-            while True:
-                msg = await asyncio.wait_for(LOG_QUEUE.get(), timeout=1.0)
-                batch.append(msg)
-                if sum(len(x) for x in batch) > 1800:
-                    break
-        except asyncio.TimeoutError:
-            pass
+        def _failed(_: BaseException):
+            if st.message is msg:
+                st.message = None
+
+        # 不等編輯完成；同一則訊息尚未送出的編輯只保留最新內容
+        self.out.fire(channel.id, partial(msg.edit, content=text),
+                      priority=Priority.LOG, key=("edit", msg.id), on_error=_failed)
+        st.shown = text
+        st.last_edit_ts = time.monotonic()
+
+    async def _batch_push(self, guild_id: int, channel: discord.TextChannel, cursor: Cursor, lines: list[str]):
+        batch = list(lines)
+        size = sum(len(x) for x in batch)
+        # 收集到約 1800 字，或第一行之後滿 1 秒就送出（只等自己的 Cursor，不影響其他目的地）
+        deadline = time.monotonic() + 1.0
+        while size <= 1800:
+            more = await cursor.get_more(deadline - time.monotonic())
+            if not more:
+                break
+            batch.extend(more)
+            size += sum(len(x) for x in more)
 
         text = "```log\n" + "\n".join(batch[-200:]) + "\n```"
-        try:
-            await channel.send(text)
-        except Exception:
-            pass
+        self.out.fire(channel.id, partial(channel.send, text), priority=Priority.LOG)
+
+    def _dest_channel(self, guild_id: int) -> discord.TextChannel | None:
+        ch_id = (self.config.get_global_stream_channel_id() if guild_id == 0
+                 else self.config.get_stream_log_channel_id(guild_id))
+        ch = self.bot.get_channel(ch_id) if ch_id else None
+        return ch if isinstance(ch, discord.TextChannel) else None
+
+    async def _dest_worker(self, guild_id: int, cursor: Cursor):
+        # worker 可能是在某個指令中建立的；它自己的日誌不屬於任何伺服器
+        LOG_GUILD.set(0)
+        while True:
+            lines = await cursor.get_all()
+            ch = self._dest_channel(guild_id)
+            if ch is None:
+                continue
+            mode = (self.config.get_global_stream_settings().mode if guild_id == 0
+                    else self.config.get_stream_settings(guild_id).mode)
+            if mode != "live":
+                await self._batch_push(guild_id, ch, cursor, lines)
+                continue
+            await self._live_append(guild_id, ch, lines)
+            # 節流中：等到可以編輯為止，期間收到的行併入同一次編輯
+            while (wait := self._throttle_left(guild_id)) > 0:
+                more = await cursor.get_more(wait)
+                if more:
+                    await self._live_append(guild_id, ch, more)
+            self._live_edit(guild_id, ch)
+
+    def _sync_destinations(self):
+        """目的地有變動時更新訂閱表與 worker（只比對快照，沒變時幾乎零成本）。"""
+        dests = self.config.stream_destinations()
+        g = self.config.get_global_stream_channel_id()
+        if dests is self._dest_snapshot and g == self._dest_gch_id:
+            return
+        self._dest_snapshot, self._dest_gch_id = dests, g
+        routes = {gid: self.config.get_stream_settings(gid) for gid, _ in dests}
+        if g:
+            routes[0] = self.config.get_global_stream_settings()
+        LOG_ROUTES.update(routes)
+        self.fanout.retain(routes)
+        # 已移除的目的地連同 live 視窗一起釋放
+        for gid in [k for k in self._live_state if k not in routes]:
+            del self._live_state[gid]
 
     async def _relay_logs(self):
+        # 只負責把紀錄寫進共用緩衝（並維護目的地集合），不等待任何送出
+        self._sync_destinations()
         while not self.bot.is_closed():
             try:
-                line = await LOG_QUEUE.get()
-
-                # 先送全域
                 try:
-                    gch_id = self.config.get_global_stream_channel_id()
-                    if gch_id:
-                        gch = self.bot.get_channel(gch_id)
-                        if isinstance(gch, discord.TextChannel):
-                            gmode = self.config.get_global_stream_settings().mode
-                            if gmode == "live":
-                                await self._live_push(0, gch, line)
-                            else:
-                                await self._batch_push(0, gch, line)
-                except Exception:
-                    # 全域串流失敗不應中斷整體
-                    pass
-
-                # 再送每個伺服器
-                try:
-                    for guild_id in self.config.guilds_with_stream_channel():
-                        ch_id = self.config.get_stream_log_channel_id(guild_id)
-                        if not ch_id:
-                            continue
-                        ch = self.bot.get_channel(ch_id)
-                        if not isinstance(ch, discord.TextChannel):
-                            continue
-                        mode = self.config.get_stream_settings(guild_id).mode
-                        if mode == "live":
-                            await self._live_push(guild_id, ch, line)
-                        else:
-                            await self._batch_push(guild_id, ch, line)
-                except Exception:
-                    # 個別伺服器錯誤也不應中斷整體
-                    pass
-
+                    rec = await asyncio.wait_for(LOG_RING.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    rec = None
+                # 沒有新紀錄時也定期檢查，目的地有變動（含熱重載）時訂閱表才會跟上
+                self._sync_destinations()
+                if rec is not None:
+                    self.fanout.publish(rec)
+            except asyncio.CancelledError:
+                raise
             except Exception:
                 # 主 loop catch；避免整個任務崩潰
                 await asyncio.sleep(0.5)
@@ -155,79 +225,92 @@ class LogsCog(commands.Cog, name="Logs"):
     @commands.group(name="log", invoke_without_command=True)
     @commands.has_guild_permissions(manage_guild=True)
     async def log_group(self, ctx: commands.Context):
-        await ctx.reply(
+        await self._reply(ctx,
             "用法：\n"
             "`rpg!log stream set #頻道`｜`rpg!log stream off`\n"
-            "`rpg!log stream mode <live|batch>`｜`rpg!log stream throttle <毫秒>`\n"
-            "`rpg!log level <INFO|DEBUG|...>`｜`rpg!log crit set/off`"
+            "`rpg!log stream mode <live|batch>`｜`rpg!log stream throttle <毫秒>`｜`rpg!log stream level <等級>`｜`rpg!log stream stats`\n"
+            "`rpg!log level <INFO|DEBUG|...>`｜`rpg!log crit set/off/window`"
         )
 
     @log_group.group(name="stream", invoke_without_command=True)
     async def log_stream_group(self, ctx: commands.Context):
-        await ctx.reply("用法：`rpg!log stream set #頻道`｜`rpg!log stream off`｜`rpg!log stream mode <live|batch>`｜`rpg!log stream throttle <毫秒>`")
+        await self._reply(ctx, "用法：`rpg!log stream set #頻道`｜`rpg!log stream off`｜`rpg!log stream mode <live|batch>`｜`rpg!log stream throttle <毫秒>`｜`rpg!log stream level <等級>`｜`rpg!log stream stats`")
 
     @log_stream_group.command(name="set")
     async def log_stream_set(self, ctx: commands.Context, channel: discord.TextChannel):
         self.config.set_stream_log_channel(ctx.guild.id, channel.id)
-        await ctx.reply(f"[{ctx.guild.name}] 一般日誌輸出頻道已設定為 {channel.mention}")
+        self._sync_destinations()
+        await self._reply(ctx, f"[{ctx.guild.name}] 一般日誌輸出頻道已設定為 {channel.mention}（只包含本伺服器的紀錄）")
         if self.config.get_stream_settings(ctx.guild.id).mode == "live":
-            st = self._state(ctx.guild.id)
-            try:
-                st.message = await channel.send("🔴 **Live Log**\n```log\n(啟動)\n```")
-            except Exception:
-                st.message = None
-            st.buffer.clear()
-            st.last_edit_ts = 0.0
+            await self._start_live(ctx.guild.id, channel)
 
     @log_stream_group.command(name="off")
     async def log_stream_off(self, ctx: commands.Context):
         self.config.clear_stream_log_channel(ctx.guild.id)
-        st = self._state(ctx.guild.id)
-        st.message = None
-        st.buffer.clear()
-        await ctx.reply(f"[{ctx.guild.name}] 已關閉一般日誌輸出到頻道。")
+        self._sync_destinations()
+        self._live_state.pop(ctx.guild.id, None)
+        await self._reply(ctx, f"[{ctx.guild.name}] 已關閉一般日誌輸出到頻道。")
 
     @log_stream_group.command(name="mode")
     async def log_stream_mode(self, ctx: commands.Context, mode: str):
         try:
             self.config.set_stream_mode(ctx.guild.id, mode)
         except ValueError as e:
-            return await ctx.reply(str(e))
-        await ctx.reply(f"[{ctx.guild.name}] 日誌串流模式已設為 **{mode}**")
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"[{ctx.guild.name}] 日誌串流模式已設為 **{mode}**")
         if mode == "live":
             ch_id = self.config.get_stream_log_channel_id(ctx.guild.id)
             if ch_id:
                 ch = self.bot.get_channel(ch_id)
                 if isinstance(ch, discord.TextChannel):
-                    st = self._state(ctx.guild.id)
-                    try:
-                        st.message = await ch.send("🔴 **Live Log**\n```log\n(啟動)\n```")
-                    except Exception:
-                        st.message = None
-                    st.buffer.clear()
-                    st.last_edit_ts = 0.0
+                    await self._start_live(ctx.guild.id, ch)
+
+    @log_stream_group.command(name="stats")
+    async def log_stream_stats(self, ctx: commands.Context):
+        cur = self.fanout.cursor(ctx.guild.id)
+        if cur is None:
+            return await self._reply(ctx, f"[{ctx.guild.name}] 目前沒有日誌串流在運作。")
+        st = cur.stats
+        await self._reply(ctx,
+            f"[{ctx.guild.name}] 日誌串流：未讀 `{len(cur)}` 行（延遲 {cur.lag():.1f}s，最大 {st.max_lag:.1f}s）\n"
+            f"已送出 `{st.delivered}` 行，落後太多而跳過 `{st.dropped}` 行"
+        )
+
+    @log_stream_group.command(name="level")
+    async def log_stream_level(self, ctx: commands.Context, level: str):
+        try:
+            self.config.set_stream_min_level(ctx.guild.id, level)
+        except ValueError as e:
+            return await self._reply(ctx, str(e))
+        await self._reply(ctx, f"[{ctx.guild.name}] 日誌串流最低等級已設為 **{level.upper()}**")
 
     @log_stream_group.command(name="throttle")
     async def log_stream_throttle(self, ctx: commands.Context, ms: int):
         self.config.set_stream_throttle(ctx.guild.id, ms)
-        await ctx.reply(f"[{ctx.guild.name}] live 模式節流時間已設為 **{ms}ms**（0 代表每行都更新，可能觸發速率限制）")
+        await self._reply(ctx, f"[{ctx.guild.name}] live 模式節流時間已設為 **{ms}ms**（0 代表每行都更新，可能觸發速率限制）")
 
     @log_group.command(name="level")
     async def log_level(self, ctx: commands.Context, level: str):
         lvl = to_level(level)
         logging.getLogger().setLevel(lvl)
-        await ctx.reply(f"全域日誌等級已設為 **{logging.getLevelName(lvl)}**")
+        await self._reply(ctx, f"全域日誌等級已設為 **{logging.getLevelName(lvl)}**")
 
     @log_group.group(name="crit", invoke_without_command=True)
     async def log_crit_group(self, ctx: commands.Context):
-        await ctx.reply("用法：`rpg!log crit set #頻道` 或 `rpg!log crit off`")
+        await self._reply(ctx, "用法：`rpg!log crit set #頻道`｜`rpg!log crit off`｜`rpg!log crit window <毫秒>`")
 
     @log_crit_group.command(name="set")
     async def log_crit_set(self, ctx: commands.Context, channel: discord.TextChannel):
         self.config.set_crit_log_channel(ctx.guild.id, channel.id)
-        await ctx.reply(f"[{ctx.guild.name}] 大成功/大失敗紀錄頻道已設定為 {channel.mention}")
+        await self._reply(ctx, f"[{ctx.guild.name}] 大成功/大失敗紀錄頻道已設定為 {channel.mention}")
 
     @log_crit_group.command(name="off")
     async def log_crit_off(self, ctx: commands.Context):
         self.config.set_crit_log_channel(ctx.guild.id, 0)
-        await ctx.reply(f"[{ctx.guild.name}] 已關閉大成功/大失敗紀錄上報。")
+        await self._reply(ctx, f"[{ctx.guild.name}] 已關閉大成功/大失敗紀錄上報。")
+
+    @log_crit_group.command(name="window")
+    async def log_crit_window(self, ctx: commands.Context, ms: int):
+        self.config.set_crit_window_ms(ctx.guild.id, ms)
+        ms = self.config.get_crit_window_ms(ctx.guild.id)
+        await self._reply(ctx, f"[{ctx.guild.name}] 大成功/大失敗上報彙整視窗已設為 **{ms}ms**（期間內的上報合併成一則訊息）")
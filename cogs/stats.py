@@ -0,0 +1,114 @@
+# cogs/stats.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from functools import partial
+import discord
+from discord.ext import commands
+
+from utils.history import RollHistory, RollStats
+from utils.outbound import OutboundScheduler, Priority
+
+logger = logging.getLogger("trpg_bot")
+
+PERIOD_RE = re.compile(r"^(\d{1,4})\s*([dhw])$", re.IGNORECASE)
+_UNIT_SECONDS = {"h": 3600, "d": 86400, "w": 7 * 86400}
+
+def parse_period(text: str | None) -> tuple[int | None, str] | None:
+    """'7d' / '24h' / '2w' / 'all' → (起始 unix 秒或 None, 顯示文字)；格式錯誤回傳 None。"""
+    text = (text or "all").strip().lower()
+    if text in ("all", "全部"):
+        return None, "全部"
+    m = PERIOD_RE.match(text)
+    if not m or int(m.group(1)) <= 0:
+        return None
+    n, unit = int(m.group(1)), m.group(2)
+    label = {"h": "小時", "d": "天", "w": "週"}[unit]
+    return int(time.time()) - n * _UNIT_SECONDS[unit], f"近 {n} {label}"
+
+def _stats_lines(st: RollStats) -> list[str]:
+    lines = [
+        f"指令：{st.commands} 次，擲骰：{st.rolls} 次，骰子：{st.n_dice} 顆",
+        f"運氣指數：**{st.luck:.3f}**（0.5 為期望值）",
+        f"大成功：{st.crits}，大失敗：{st.fumbles}",
+    ]
+    if st.success_rate is not None:
+        lines.append(f"檢定成功率：{st.success_rate:.1%}（{st.successes} / {st.checks}）")
+    return lines
+
+class StatsCog(commands.Cog, name="Stats"):
+    def __init__(self, bot: commands.Bot, history: RollHistory, outbound: OutboundScheduler | None = None):
+        self.bot = bot
+        self.history = history
+        self.out = outbound or OutboundScheduler()
+
+    async def cog_load(self):
+        self.history.start()
+
+    async def cog_unload(self):
+        # 關閉前把佇列中的紀錄寫完
+        await self.history.close()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        logger.info("StatsCog ready.")
+
+    async def _reply(self, ctx: commands.Context, *args, **kwargs) -> discord.Message:
+        return await self.out.submit(ctx.channel.id, partial(ctx.reply, *args, **kwargs), priority=Priority.REPLY)
+
+    @commands.group(name="stats", invoke_without_command=True,
+                    help="擲骰統計：rpg!stats me [期間]｜rpg!stats guild [期間]｜rpg!stats luck [期間]（期間如 7d、24h、all）")
+    async def stats_group(self, ctx: commands.Context):
+        await self._reply(ctx, "用法：`rpg!stats me [期間]`｜`rpg!stats guild [期間]`｜`rpg!stats luck [期間]`"
+                               "（期間：`24h`、`7d`、`4w`、`all`；統計以 UTC 日為單位）")
+
+    @stats_group.command(name="me", help="自己的擲骰統計（在伺服器內只算本伺服器）")
+    async def stats_me(self, ctx: commands.Context, period: str | None = None):
+        p = parse_period(period)
+        if p is None:
+            return await self._reply(ctx, "期間格式錯誤，例：`7d`、`24h`、`4w`、`all`")
+        since, label = p
+        gid = ctx.guild.id if ctx.guild else None
+        st = await asyncio.to_thread(self.history.user_stats, ctx.author.id, gid, since)
+        if not st.commands:
+            return await self._reply(ctx, f"{label}沒有擲骰紀錄。")
+        embed = discord.Embed(title=f"📈 {ctx.author.display_name} 的擲骰統計（{label}）",
+                              description="\n".join(_stats_lines(st)), color=discord.Color.blurple())
+        await self._reply(ctx, embed=embed)
+
+    @stats_group.command(name="guild", help="本伺服器的擲骰統計")
+    @commands.guild_only()
+    async def stats_guild(self, ctx: commands.Context, period: str | None = None):
+        p = parse_period(period)
+        if p is None:
+            return await self._reply(ctx, "期間格式錯誤，例：`7d`、`24h`、`4w`、`all`")
+        since, label = p
+        st = await asyncio.to_thread(self.history.guild_stats, ctx.guild.id, since)
+        if not st.commands:
+            return await self._reply(ctx, f"{label}沒有擲骰紀錄。")
+        embed = discord.Embed(title=f"📈 {ctx.guild.name} 擲骰統計（{label}）",
+                              description="\n".join(_stats_lines(st)), color=discord.Color.blurple())
+        await self._reply(ctx, embed=embed)
+
+    @stats_group.command(name="luck", aliases=["luckiest"], help="本伺服器最幸運的玩家（至少 20 顆骰）")
+    @commands.guild_only()
+    async def stats_luck(self, ctx: commands.Context, period: str | None = None):
+        p = parse_period(period)
+        if p is None:
+            return await self._reply(ctx, "期間格式錯誤，例：`7d`、`24h`、`4w`、`all`")
+        since, label = p
+        top = await asyncio.to_thread(self.history.luckiest, ctx.guild.id, since)
+        if not top:
+            return await self._reply(ctx, f"{label}還沒有人擲滿 20 顆骰。")
+        medals = ["🥇", "🥈", "🥉"]
+        lines = [
+            f"{medals[i] if i < len(medals) else f'{i+1}.'} <@{st.user_id}>："
+            f"**{st.luck:.3f}**（{st.n_dice} 顆，大成功 {st.crits}）"
+            for i, st in enumerate(top)
+        ]
+        embed = discord.Embed(title=f"🍀 幸運排行（{label}）", description="\n".join(lines),
+                              color=discord.Color.gold())
+        await self._reply(ctx, embed=embed, allowed_mentions=discord.AllowedMentions.none())
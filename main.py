@@ -4,10 +4,16 @@ from dotenv import load_dotenv, find_dotenv
 import discord
 from discord.ext import commands
 
-from utils.logging_config import setup_logging
+from utils.logging_config import LOG_GUILD, LOG_RING, setup_logging
 from utils.config import ConfigManager
+from utils.config_store import open_store
+from utils.history import RollHistory
+from utils.outbound import OutboundScheduler
+from utils import sim
 
 # --- 啟動階段 ---
+# 模擬用的行程池以 fork 建立：必須在任何執行緒（日誌寫出等）啟動之前
+sim.start_pool()
 load_dotenv(find_dotenv())
 setup_logging()
 logger = logging.getLogger("trpg_bot")
@@ -18,10 +24,17 @@ if not TOKEN:
 
 intents = discord.Intents.default()
 intents.message_content = True  # 需要讀取訊息內容才能解析擲骰
-bot = commands.Bot(command_prefix="rpg!", intents=intents, help_command=None)
+# 所有送出/編輯共用的排程器；http_trace 把速率限制標頭回報給它
+outbound = OutboundScheduler()
+bot = commands.Bot(command_prefix="rpg!", intents=intents, help_command=None,
+                   http_trace=outbound.trace_config())
 
-# 共用設定管理器（讓各 cogs 使用）
-config_manager = ConfigManager()
+# 共用設定管理器（讓各 cogs 使用）；CONFIG_BACKEND=json（預設）或 sqlite
+config_manager = ConfigManager(store=open_store(os.getenv("CONFIG_BACKEND", "json")))
+# 日誌交接緩衝直接參照全域設定（rpg!admin logq 或熱重載修改後立即生效）
+LOG_RING.settings = config_manager.get_log_queue_settings()
+# 擲骰紀錄（SQLite，背景批次寫入）
+roll_history = RollHistory()
 # 取得應用程式擁有者（做為預設開發者）
 app_own_id = None
 
@@ -40,16 +53,28 @@ async def setup_hook():
     except Exception as e:
         logger.warning(f"讀取 application owner 失敗：{e}")
 
+    # 手動編輯設定檔後自動套用（不必 rpg!admin restart）
+    config_manager.start_watch()
+    # 日誌串流目的地：JSON 後端要逐檔解析，在執行緒中先建好
+    await config_manager.load_stream_index()
+
     # 載入各類 cogs
     await bot.add_cog(
-        __import__("cogs.dice", fromlist=["DiceCog"]).DiceCog(bot, config_manager))
+        __import__("cogs.dice", fromlist=["DiceCog"]).DiceCog(bot, config_manager, roll_history, outbound))
+    await bot.add_cog(
+        __import__("cogs.stats", fromlist=["StatsCog"]).StatsCog(bot, roll_history, outbound))
         
     await bot.add_cog(
-        __import__("cogs.logs", fromlist=["LogsCog"]).LogsCog(bot, config_manager))
+        __import__("cogs.logs", fromlist=["LogsCog"]).LogsCog(bot, config_manager, outbound))
     await bot.add_cog(
-        __import__("cogs.admin", fromlist=["AdminCog"]).AdminCog(bot, config_manager, app_owner_id))
+        __import__("cogs.admin", fromlist=["AdminCog"]).AdminCog(bot, config_manager, app_owner_id, outbound, roll_history))
     await bot.add_cog(
-        __import__("cogs.help", fromlist=["HelpCog"]).HelpCog(bot))
+        __import__("cogs.help", fromlist=["HelpCog"]).HelpCog(bot, outbound))
+@bot.before_invoke
+async def tag_log_guild(ctx: commands.Context):
+    # 這個指令之後記錄的日誌只會串流到本伺服器（與全域）的日誌頻道
+    LOG_GUILD.set(ctx.guild.id if ctx.guild else 0)
+
 @bot.event
 async def on_ready():
     logger.info(f"Logged in as {bot.user} (id={bot.user.id})")
@@ -60,3 +85,7 @@ async def on_ready():
 
     
 bot.run(TOKEN)
+# 事件迴圈已結束：同步寫出尚未寫入的設定與擲骰紀錄
+config_manager.flush_sync()
+roll_history.close_sync()
+sim.shutdown_pool()
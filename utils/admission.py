@@ -0,0 +1,62 @@
+# utils/admission.py
+from __future__ import annotations
+
+import time
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+SWEEP_INTERVAL = 60.0   # 秒；多久清一次已回滿的桶
+
+class TokenBuckets:
+    """以 GCRA 表示的一組權杖桶：每個桶只存一個浮點數「回滿的時間點」。
+
+    桶在回滿之後與不存在等價，定期清掉，所以閒置的玩家不佔記憶體。
+    容量與速率不存在桶裡，由呼叫端每次傳入（可隨伺服器設定即時改變）。
+    """
+
+    def __init__(self, *, clock: Callable[[], float] = time.monotonic):
+        self._full_at: Dict[Hashable, float] = {}
+        self._clock = clock
+        self._next_sweep = clock() + SWEEP_INTERVAL
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+    def level(self, key: Hashable, burst: float, rate: float) -> float:
+        """目前剩餘的權杖數。"""
+        behind = self._full_at.get(key, 0.0) - self._clock()
+        return burst - behind * rate if behind > 0 else float(burst)
+
+    def acquire(self, buckets: Sequence[Tuple[Hashable, float, float]], cost: float,
+                max_wait: float = 0.0) -> Optional[float]:
+        """同時向多個 (key, burst, rate) 桶扣 cost。
+
+        成功時回傳需要等待的秒數（0 表示立即可用；>0 表示已預扣、排在前面的請求之後），
+        需要等超過 max_wait 時不扣款並回傳 None。
+        """
+        now = self._clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        wait = 0.0
+        new_full_at = []
+        for key, burst, rate in buckets:
+            full_at = max(self._full_at.get(key, now), now) + cost / rate
+            # 扣完後超出容量的部分要等它回復
+            wait = max(wait, full_at - now - burst / rate)
+            new_full_at.append((key, full_at))
+        if wait > max_wait:
+            return None
+        for key, full_at in new_full_at:
+            self._full_at[key] = full_at
+        return wait
+
+    def retry_after(self, buckets: Sequence[Tuple[Hashable, float, float]], cost: float) -> float:
+        """cost 要能不排隊直接通過，還需要等幾秒。"""
+        now = self._clock()
+        return max(0.0, max(max(self._full_at.get(k, now), now) + cost / r - now - b / r
+                            for k, b, r in buckets))
+
+    def _sweep(self, now: float):
+        for key in [k for k, t in self._full_at.items() if t <= now]:
+            del self._full_at[key]
+        self._next_sweep = now + SWEEP_INTERVAL
@@ -1,9 +1,18 @@
 # utils/coc.py
+from collections import Counter
 from dataclasses import dataclass
-import random
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 import math
 
-@dataclass
+from utils import sim
+from utils.rng import FastRng, RngProvider, default_rng
+
+LEVELS = ("大成功", "極限成功", "困難成功", "普通成功", "失敗", "大失敗")
+SUCCESS_LEVELS = LEVELS[:4]
+MAX_BONUS = 2   # 7e：獎勵/懲罰骰最多各 2 顆（兩者先互相抵銷）
+
+@dataclass(frozen=True, slots=True)
 class CcResult:
     roll: int
     skill: int
@@ -11,12 +20,14 @@ class CcResult:
     is_crit: bool
     is_fumble: bool
 
-def d100() -> int:
+def d100(rng: Optional[RngProvider] = None) -> int:
     # 1~100，00 視為 100
-    return random.randint(1, 100)
+    return (rng or default_rng()).randint(1, 100)
 
-def evaluate(skill: int, roll: int) -> CcResult:
-    skill = max(0, min(99 if skill < 100 else 100, skill))  # 常見桌規：99 前正常、100 幾乎必失敗
+def _clamp_skill(skill: int) -> int:
+    return max(0, min(99 if skill < 100 else 100, skill))  # 常見桌規：99 前正常、100 幾乎必失敗
+
+def _compute(skill: int, roll: int) -> CcResult:
     hard = math.floor(skill / 2)
     extreme = math.floor(skill / 5)
 
@@ -38,3 +49,89 @@ def evaluate(skill: int, roll: int) -> CcResult:
         level = "失敗"
 
     return CcResult(roll=roll, skill=skill, level=level, is_crit=is_crit, is_fumble=is_fumble)
+
+# 預先算好 101 × 101（技能 0~100 × 骰值 0~100）的共用結果；索引 0 的骰值不會用到
+_TABLE: Tuple[Tuple[CcResult, ...], ...] = tuple(
+    tuple(_compute(s, r) for r in range(101)) for s in range(101)
+)
+
+def evaluate(skill: int, roll: int) -> CcResult:
+    skill = _clamp_skill(skill)
+    if 1 <= roll <= 100:
+        return _TABLE[skill][roll]
+    return _compute(skill, roll)
+
+# ---------- 獎勵骰 / 懲罰骰 ----------
+def _net_bonus(bonus: int, penalty: int) -> int:
+    net = bonus - penalty
+    return max(-MAX_BONUS, min(MAX_BONUS, net))
+
+def _combine(units: int, tens: Sequence[int], net: int) -> int:
+    """個位骰 + 數顆十位骰（皆 0~9）→ 依獎勵（取小）或懲罰（取大）組出 1~100。"""
+    vals = [(t * 10 + units) or 100 for t in tens]
+    return min(vals) if net > 0 else max(vals)
+
+@dataclass
+class CcBatch:
+    """一次擲 n 次的結果；rolls 為最終骰值，tens 在有獎勵/懲罰骰時為每次的十位骰。"""
+    skill: int
+    rolls: Sequence[int]
+    counts: Dict[str, int]
+    tens: Optional[List[Tuple[int, ...]]] = None
+
+    def result(self, i: int) -> CcResult:
+        return _TABLE[self.skill][self.rolls[i]]
+
+    def luck_sum(self) -> float:
+        """各次 (100-骰值)/99 的總和：骰越小越幸運，期望值為次數的一半。"""
+        return (100 * len(self.rolls) - sum(self.rolls)) / 99
+
+def roll_many(n: int, *, bonus: int = 0, penalty: int = 0,
+              rng: Optional[RngProvider] = None) -> Tuple[List[int], Optional[List[Tuple[int, ...]]]]:
+    rng = rng or default_rng()
+    net = _net_bonus(bonus, penalty)
+    if not net:
+        return [int(x) for x in rng.draw(100, n)], None
+    k = abs(net) + 1
+    units = rng.draw(10, n)
+    tens_flat = rng.draw(10, n * k)
+    rolls, tens = [], []
+    for i in range(n):
+        ts = tuple(int(t) - 1 for t in tens_flat[i * k:(i + 1) * k])
+        tens.append(ts)
+        rolls.append(_combine(int(units[i]) - 1, ts, net))
+    return rolls, tens
+
+def evaluate_many(skill: int, n: int, *, bonus: int = 0, penalty: int = 0,
+                  rng: Optional[RngProvider] = None) -> CcBatch:
+    """一次擲 n 次並統計各等級次數：每次只是查表，計數以骰值彙總後再對應到等級。"""
+    skill = _clamp_skill(skill)
+    rolls, tens = roll_many(n, bonus=bonus, penalty=penalty, rng=rng)
+    row = _TABLE[skill]
+    counts = dict.fromkeys(LEVELS, 0)
+    for roll, c in Counter(rolls).items():
+        counts[row[roll].level] += c
+    return CcBatch(skill=skill, rolls=rolls, counts=counts, tens=tens)
+
+# ---------- 蒙地卡羅模擬 ----------
+def simulate_chunk(skill: int, trials: int, seed: int, pushed: bool = False,
+                   bonus: int = 0, penalty: int = 0) -> sim.ChunkResult:
+    """worker 端：以獨立種子擲 trials 次；pushed=True 時失敗（非大失敗）會孤注一擲重擲一次。"""
+    rng = FastRng(seed)
+    batch = evaluate_many(skill, trials, bonus=bonus, penalty=penalty, rng=rng)
+    hist: Dict[str, int] = dict(batch.counts)
+    n_pushed = 0
+    if pushed and hist["失敗"]:
+        # 重擲沿用相同的獎勵/懲罰骰
+        n_pushed = hist.pop("失敗")
+        again = evaluate_many(skill, n_pushed, bonus=bonus, penalty=penalty, rng=rng)
+        for k, v in again.counts.items():
+            hist[k] = hist.get(k, 0) + v
+    return hist, {"pushed": n_pushed}
+
+async def simulate(skill: int, trials: int, *, pushed: bool = False, bonus: int = 0, penalty: int = 0,
+                   time_budget: float = sim.DEFAULT_TIME_BUDGET,
+                   on_progress: Optional[Callable[[sim.SimResult], Awaitable[None]]] = None) -> sim.SimResult:
+    fn = partial(simulate_chunk, skill, pushed=pushed, bonus=bonus, penalty=penalty)
+    return await sim.run_chunks(fn, trials, sim.CHUNK_DRAWS // 2,
+                                time_budget=time_budget, on_progress=on_progress)
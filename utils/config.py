@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-import json
-from dataclasses import dataclass, asdict, field
-from pathlib import Path
+import asyncio
+import contextvars
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, is_dataclass
 import logging
-from typing import Dict, Optional, List
+from typing import Any, Dict, Hashable, Iterator, Optional, List, Tuple
+
+from utils.config_codec import SCHEMA_VERSION, decode, to_payload, upgrade
+from utils.config_store import ConfigStore, JsonDirStore
+from utils.persist import WriteBehind
 
 logger = logging.getLogger("trpg_bot")
 
@@ -15,17 +20,50 @@ class CritRules:
     d100_crit_success: int = 1
     d100_crit_failure: int = 100
 
+@dataclass
+class DiceLimits:
+    max_dice: int = 100         # 單次擲骰的骰子顆數
+    max_sides: int = 1000       # 骰面數
+    max_times: int = 50         # +N 連續次數
+
+# 管理員可調整的上限（避免單一指令佔住整個事件迴圈）
+DICE_LIMIT_CEILING = DiceLimits(max_dice=100_000, max_sides=1_000_000, max_times=10_000)
+
+@dataclass
+class DiceBudget:
+    """擲骰的權杖桶：以「骰子顆數 × 次數」計費，而非指令數。"""
+    user_burst: int = 5000      # 單一玩家桶容量（一次最多可用掉的骰數）
+    user_rate: float = 100.0    # 每秒回復
+    guild_burst: int = 20000    # 整個伺服器共用
+    guild_rate: float = 1000.0
+    max_wait: float = 3.0       # 超額時最多排隊幾秒，超過就拒絕
+
+@dataclass
+class RngSettings:
+    mode: str = "fast"      # "fast" | "entropy" | "seeded"
+    seed: int = 0           # seeded 模式的場次種子（同 seed 可重播）
+
 @dataclass
 class StreamSettings:
     mode: str = "live"      # "live" | "batch"
     throttle_ms: int = 200
     chunk_limit: int = 1800
+    min_level: str = "INFO"     # 送到這個目的地的最低日誌等級
 
 @dataclass
 class RestartSettings:
     mode: str = "execv"         # "execv" | "systemd_user" | "systemd_system"
     service: str = "trpg-bot.service"
 
+@dataclass
+class LogQueueSettings:
+    """日誌交接緩衝（logging → Discord 串流）的容量與滿載策略。"""
+    capacity: int = 2000
+    policy: str = "oldest"      # "oldest" 丟最舊 | "lowest" 先丟等級最低的 | "sample" 滿載時每 N 行留 1 行
+    sample_every: int = 10
+
+LOG_QUEUE_POLICIES = ("oldest", "lowest", "sample")
+
 @dataclass
 class GlobalConfig:
     dev_user_ids: List[int] = field(default_factory=list)
@@ -33,80 +71,167 @@ class GlobalConfig:
      # ↓↓↓ 新增：全域日誌串流位置與設定
     gstream_channel_id: int = 0
     gstream: StreamSettings = field(default_factory=StreamSettings)
+    logq: LogQueueSettings = field(default_factory=LogQueueSettings)
 
 @dataclass
 class GuildConfig:
     crit_log_channel_id: int = 0
+    crit_window_ms: int = 2000      # 大成功/大失敗上報的彙整視窗
     stream_log_channel_id: int = 0
     stream: StreamSettings = field(default_factory=StreamSettings)
     crit: CritRules = field(default_factory=CritRules)
+    limits: DiceLimits = field(default_factory=DiceLimits)
+    rng: RngSettings = field(default_factory=RngSettings)
+    budget: DiceBudget = field(default_factory=DiceBudget)
 
-class ConfigManager:
-    def __init__(self, global_path: str = "data/config.global.json", guilds_dir: str = "data/guilds"):
-        self.global_path = Path(global_path)
-        self.guilds_dir = Path(guilds_dir)
-        self.guilds_dir.mkdir(parents=True, exist_ok=True)
-        self.global_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # 舊版 config.json -> 全域設定遷移
-        legacy_path = self.global_path.parent / "config.json"
-        if legacy_path.exists() and not self.global_path.exists():
-            try:
-                raw = json.loads(legacy_path.read_text(encoding="utf-8"))
-                g = GlobalConfig(
-                    dev_user_ids=raw.get("dev_user_ids", []),
-                    restart=RestartSettings(
-                        mode=raw.get("restart", {}).get("mode", "execv"),
-                        service=raw.get("restart", {}).get("service", "trpg-bot.service"),
-                    )
-                )
-                self.global_config = g
-                self._save_global()
-                logger.info("已從舊版 data/config.json 移轉全域設定到 data/config.global.json")
-            except Exception as e:
-                logger.warning(f"舊版設定移轉失敗：{e}")
-                self.global_config = GlobalConfig()
-                self._save_global()
-        else:
-            self.global_config = self._load_global()
+GUILD_CACHE_SIZE = 512     # 未釘選的伺服器設定最多留在記憶體的份數
+WATCH_INTERVAL = 0.5       # 秒；檢查設定檔是否被手動修改的間隔
 
-        self.guild_cache: Dict[int, GuildConfig] = {}
-        # 預先載入已存在的 guild 設定
-        for p in self.guilds_dir.glob("*.json"):
-            try:
-                gid = int(p.stem)
-                self.guild_cache[gid] = self._load_guild(gid)
-            except Exception:
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+class GuildCache:
+    """guild_id → GuildConfig 的 LRU。
+
+    設有串流/上報頻道的伺服器會被釘選（背景任務隨時要讀），不佔 LRU 名額也不會被淘汰；
+    其餘超過 capacity 時淘汰最久未用的（設定都已寫回磁碟，下次用到再讀）。
+    """
+
+    def __init__(self, capacity: int = GUILD_CACHE_SIZE):
+        self.capacity = capacity
+        self._lru: "OrderedDict[int, GuildConfig]" = OrderedDict()
+        self._pinned: Dict[int, GuildConfig] = {}
+        self.stats = CacheStats()
+
+    @staticmethod
+    def _wants_pin(cfg: GuildConfig) -> bool:
+        return bool(cfg.stream_log_channel_id or cfg.crit_log_channel_id)
+
+    def __len__(self) -> int:
+        return len(self._lru) + len(self._pinned)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._pinned or guild_id in self._lru
+
+    def items(self) -> Iterator[Tuple[int, GuildConfig]]:
+        yield from self._pinned.items()
+        yield from self._lru.items()
+
+    @property
+    def pinned(self) -> int:
+        return len(self._pinned)
+
+    def peek(self, guild_id: int) -> Optional[GuildConfig]:
+        """不計入統計、不更新 LRU 順序。"""
+        return self._pinned.get(guild_id) or self._lru.get(guild_id)
+
+    def get(self, guild_id: int) -> Optional[GuildConfig]:
+        cfg = self._pinned.get(guild_id)
+        if cfg is None:
+            cfg = self._lru.get(guild_id)
+            if cfg is None:
+                self.stats.misses += 1
+                return None
+            self._lru.move_to_end(guild_id)
+        self.stats.hits += 1
+        return cfg
+
+    def __setitem__(self, guild_id: int, cfg: GuildConfig):
+        self._pinned.pop(guild_id, None)
+        self._lru.pop(guild_id, None)
+        if self._wants_pin(cfg):
+            self._pinned[guild_id] = cfg
+            return
+        self._lru[guild_id] = cfg
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+            self.stats.evictions += 1
+
+    def refresh(self, guild_id: int):
+        """設定變更後重新判斷是否釘選。"""
+        cfg = self.peek(guild_id)
+        if cfg is not None and self._wants_pin(cfg) != (guild_id in self._pinned):
+            self[guild_id] = cfg
+
+def _merge(dst: Any, src: Any, prefix: str = "") -> Tuple[List[str], List[str]]:
+    """把 src 中不同的欄位就地寫進 dst（保留各處持有的參照）。
+
+    回傳 (已套用的欄位, 型別不符而略過的欄位)，欄位以 "stream.throttle_ms" 形式表示。
+    """
+    changed, rejected = [], []
+    for f in fields(dst):
+        a, b = getattr(dst, f.name), getattr(src, f.name)
+        name = prefix + f.name
+        if is_dataclass(a):
+            c, r = _merge(a, b, name + ".")
+            changed += c
+            rejected += r
+        elif a != b:
+            numeric = isinstance(a, (int, float)) and isinstance(b, (int, float))
+            if type(a) is not type(b) and not numeric:
+                rejected.append(name)
                 continue
+            setattr(dst, f.name, b)
+            changed.append(name)
+    return changed, rejected
+
+class ConfigManager:
+    def __init__(self, global_path: str = "data/config.global.json", guilds_dir: str = "data/guilds",
+                 guild_cache_size: int = GUILD_CACHE_SIZE, store: Optional[ConfigStore] = None):
+        # 預設每伺服器一個 JSON 檔；也可傳入 SqliteStore（見 utils/config_store.py）
+        self.store = store or JsonDirStore(global_path, guilds_dir)
+        self._writer = WriteBehind(self.store.write, to_payload)
+
+        # 舊版 data/config.json 由後端標成第 0 版，讀取時經 config_codec 的遷移升級
+        self.global_config = self._load_global()
+
+        # 伺服器設定在第一次用到時才讀取；啟動時間與加入過的伺服器數量無關
+        self.guild_cache = GuildCache(guild_cache_size)
+        self._stream_index: Optional[Dict[int, int]] = None
+        self._stream_snapshot: Tuple[Tuple[int, int], ...] = ()
+        self._watch_task: Optional[asyncio.Task] = None
 
     # ---------- Global ----------
+    def _read_global_raw(self) -> Optional[dict]:
+        try:
+            return self.store.load_global()
+        except Exception as e:
+            logger.error(f"讀取全域設定失敗：{e}")
+            return None
+
     def _load_global(self) -> GlobalConfig:
+        raw = self._read_global_raw()
+        if raw is None:
+            return GlobalConfig()
         try:
-            if self.global_path.exists():
-                raw = json.loads(self.global_path.read_text(encoding="utf-8"))
-                r = raw.get("restart", {})
-                s = raw.get("gstream", {})  # 可能不存在
-                return GlobalConfig(
-                    dev_user_ids=raw.get("dev_user_ids", []),
-                    restart=RestartSettings(
-                        mode=r.get("mode", "execv"),
-                        service=r.get("service", "trpg-bot.service"),
-                    ),
-                    gstream_channel_id=raw.get("gstream_channel_id", 0),
-                    gstream=StreamSettings(
-                        mode=s.get("mode", "live"),
-                        throttle_ms=s.get("throttle_ms", 200),
-                        chunk_limit=s.get("chunk_limit", 1800),
-                    ),
-                )
+            cfg, migrated = self._decode("global", GlobalConfig, raw)
         except Exception as e:
             logger.error(f"讀取全域設定失敗：{e}")
-        return GlobalConfig()
+            return GlobalConfig()
+        if migrated:
+            self._writer.mark("global", cfg)
+            logger.info(f"全域設定已升級到第 {SCHEMA_VERSION} 版（{self.store.name}）")
+        return cfg
+
+    @staticmethod
+    def _decode(kind: str, cls: type, raw: dict) -> Tuple[Any, bool]:
+        """升級到目前版本後依 dataclass 定義解碼；回傳 (設定, 是否經過遷移)。"""
+        raw, migrated = upgrade(kind, raw)
+        return decode(cls, raw), migrated
 
     def _save_global(self):
-        payload = asdict(self.global_config)
-        self.global_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-        logger.info("全域設定已儲存")
+        self._writer.mark("global", self.global_config)
+
+    # ---------- 寫入 ----------
+    async def flush(self):
+        """立即寫出所有尚未寫入的設定。"""
+        await self._writer.flush()
+
+    def flush_sync(self):
+        self._writer.flush_sync()
 
     # Developer（全域）
     def get_dev_user_ids(self) -> List[int]:
@@ -142,52 +267,39 @@ class ConfigManager:
         self._save_global()
 
     # ---------- Guild ----------
-    def _guild_file(self, guild_id: int) -> Path:
-        return self.guilds_dir / f"{guild_id}.json"
-
     def _load_guild(self, guild_id: int) -> GuildConfig:
-        path = self._guild_file(guild_id)
-        if not path.exists():
+        try:
+            raw = self.store.load_guild(guild_id)
+        except Exception as e:
+            logger.error(f"讀取伺服器設定失敗（{guild_id}）：{e}，使用預設值")
+            return GuildConfig()
+        if raw is None:
             cfg = GuildConfig()
             self.guild_cache[guild_id] = cfg
             self._save_guild(guild_id)
             return cfg
         try:
-            raw = json.loads(path.read_text(encoding="utf-8"))
-            s = raw.get("stream", {})
-            c = raw.get("crit", {})
-            return GuildConfig(
-                crit_log_channel_id=raw.get("crit_log_channel_id", 0),
-                stream_log_channel_id=raw.get("stream_log_channel_id", 0),
-                stream=StreamSettings(
-                    mode=s.get("mode", "live"),
-                    throttle_ms=s.get("throttle_ms", 200),
-                    chunk_limit=s.get("chunk_limit", 1800),
-                ),
-                crit=CritRules(
-                    d20_crit_success=c.get("d20_crit_success", 20),
-                    d20_crit_failure=c.get("d20_crit_failure", 1),
-                    d100_crit_success=c.get("d100_crit_success", 1),
-                    d100_crit_failure=c.get("d100_crit_failure", 100),
-                )
-            )
+            cfg, migrated = self._decode("guild", GuildConfig, raw)
         except Exception as e:
             logger.error(f"讀取伺服器設定失敗（{guild_id}）：{e}，使用預設值")
             return GuildConfig()
+        if migrated:
+            self._writer.mark(("guild", guild_id), cfg)
+        return cfg
 
     def _save_guild(self, guild_id: int):
-        cfg = self.guild_cache.get(guild_id)
+        cfg = self.guild_cache.peek(guild_id)
         if cfg is None:
             return
-        path = self._guild_file(guild_id)
-        payload = asdict(cfg)
-        path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-        logger.info(f"伺服器設定已儲存：{guild_id}")
+        self.guild_cache.refresh(guild_id)
+        # 只標記 dirty；背景合併後在執行緒中原子寫入
+        self._writer.mark(("guild", guild_id), cfg)
 
     def get_guild_cfg(self, guild_id: int) -> GuildConfig:
         cfg = self.guild_cache.get(guild_id)
         if cfg is None:
-            cfg = self._load_guild(guild_id)
+            # 已被淘汰但還沒寫出的設定直接取回，不讀磁碟上的舊檔
+            cfg = self._writer.pending(("guild", guild_id)) or self._load_guild(guild_id)
             self.guild_cache[guild_id] = cfg
         return cfg
 
@@ -204,6 +316,52 @@ class ConfigManager:
                 setattr(cfg.crit, k, int(v))
         self._save_guild(guild_id)
 
+    def get_dice_limits(self, guild_id: Optional[int] = None) -> DiceLimits:
+        if guild_id is None:
+            return DiceLimits()
+        return self.get_guild_cfg(guild_id).limits
+
+    def set_dice_limits(self, guild_id: int, **kwargs):
+        cfg = self.get_guild_cfg(guild_id)
+        for k, v in kwargs.items():
+            if hasattr(cfg.limits, k):
+                ceiling = getattr(DICE_LIMIT_CEILING, k)
+                setattr(cfg.limits, k, max(1, min(ceiling, int(v))))
+        self._save_guild(guild_id)
+
+    def get_dice_budget(self, guild_id: Optional[int] = None) -> DiceBudget:
+        if guild_id is None:
+            return DiceBudget()
+        return self.get_guild_cfg(guild_id).budget
+
+    def set_dice_budget(self, guild_id: int, **kwargs):
+        cfg = self.get_guild_cfg(guild_id)
+        for k, v in kwargs.items():
+            if k in ("user_burst", "guild_burst"):
+                setattr(cfg.budget, k, max(1, int(v)))
+            elif k in ("user_rate", "guild_rate"):
+                setattr(cfg.budget, k, max(0.01, float(v)))
+            elif k == "max_wait":
+                setattr(cfg.budget, k, max(0.0, min(30.0, float(v))))
+        self._save_guild(guild_id)
+
+    def get_rng_settings(self, guild_id: Optional[int] = None) -> RngSettings:
+        if guild_id is None:
+            return RngSettings()
+        return self.get_guild_cfg(guild_id).rng
+
+    def set_rng_mode(self, guild_id: int, mode: str):
+        if mode not in ("fast", "entropy", "seeded"):
+            raise ValueError("mode 必須是 fast / entropy / seeded")
+        cfg = self.get_guild_cfg(guild_id)
+        cfg.rng.mode = mode
+        self._save_guild(guild_id)
+
+    def set_rng_seed(self, guild_id: int, seed: int):
+        cfg = self.get_guild_cfg(guild_id)
+        cfg.rng.seed = int(seed)
+        self._save_guild(guild_id)
+
     def get_crit_log_channel_id(self, guild_id: int) -> int:
         return self.get_guild_cfg(guild_id).crit_log_channel_id
 
@@ -212,6 +370,14 @@ class ConfigManager:
         cfg.crit_log_channel_id = int(channel_id)
         self._save_guild(guild_id)
 
+    def get_crit_window_ms(self, guild_id: int) -> int:
+        return self.get_guild_cfg(guild_id).crit_window_ms
+
+    def set_crit_window_ms(self, guild_id: int, ms: int):
+        cfg = self.get_guild_cfg(guild_id)
+        cfg.crit_window_ms = max(0, min(60_000, int(ms)))
+        self._save_guild(guild_id)
+
     def get_stream_log_channel_id(self, guild_id: int) -> int:
         return self.get_guild_cfg(guild_id).stream_log_channel_id
 
@@ -219,11 +385,13 @@ class ConfigManager:
         cfg = self.get_guild_cfg(guild_id)
         cfg.stream_log_channel_id = int(channel_id)
         self._save_guild(guild_id)
+        self._index_stream(guild_id, cfg.stream_log_channel_id)
 
     def clear_stream_log_channel(self, guild_id: int):
         cfg = self.get_guild_cfg(guild_id)
         cfg.stream_log_channel_id = 0
         self._save_guild(guild_id)
+        self._index_stream(guild_id, 0)
 
     def get_stream_settings(self, guild_id: int) -> StreamSettings:
         return self.get_guild_cfg(guild_id).stream
@@ -235,6 +403,14 @@ class ConfigManager:
         cfg.stream.mode = mode
         self._save_guild(guild_id)
 
+    def set_stream_min_level(self, guild_id: int, level: str):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError("等級必須是 DEBUG / INFO / WARNING / ERROR / CRITICAL")
+        cfg = self.get_guild_cfg(guild_id)
+        cfg.stream.min_level = level
+        self._save_guild(guild_id)
+
     def set_stream_throttle(self, guild_id: int, ms: int):
         cfg = self.get_guild_cfg(guild_id)
         cfg.stream.throttle_ms = max(0, int(ms))
@@ -245,26 +421,62 @@ class ConfigManager:
         cfg.stream.chunk_limit = max(200, int(n))
         self._save_guild(guild_id)
 
-    def guilds_with_stream_channel(self) -> List[int]:
-        ids: List[int] = []
-        # 先看快取
+    # ---------- 串流目的地索引 ----------
+    # guild_id → 串流頻道；啟動時在執行緒中向後端查詢一次（JSON 要逐檔解析、SQLite 走索引），之後由 set/clear 增量維護。
+    # 對外提供不可變的快照，日誌轉送每一行只是走訪它，不做任何檔案 I/O。
+    def _query_index(self, field: str) -> Dict[int, int]:
+        """後端的跨伺服器查詢（可在執行緒中呼叫）。"""
+        try:
+            return self.store.guilds_with(field)
+        except Exception as e:
+            logger.error(f"查詢伺服器設定失敗（{field}）：{e}")
+            return {}
+
+    def _overlay(self, index: Dict[int, int], field: str) -> Dict[int, int]:
+        """以記憶體中（快取、尚未寫出）的設定覆蓋後端的查詢結果；在事件迴圈中呼叫。"""
+        for key, obj in self._writer.pending_items():
+            if key != "global":
+                index[key[1]] = getattr(obj, field)
         for gid, cfg in self.guild_cache.items():
-            if cfg.stream_log_channel_id:
-                ids.append(gid)
-        # 再掃描磁碟補上未載入的
-        for p in self.guilds_dir.glob("*.json"):
-            try:
-                gid = int(p.stem)
-                if gid in self.guild_cache:
-                    continue
-                raw = json.loads(p.read_text(encoding="utf-8"))
-                if raw.get("stream_log_channel_id", 0):
-                    ids.append(gid)
-                    # 載入到快取
-                    self.guild_cache[gid] = self._load_guild(gid)
-            except Exception:
-                continue
-        return ids
+            index[gid] = getattr(cfg, field)
+        return {gid: ch for gid, ch in index.items() if ch}
+
+    def _channel_index(self, field: str) -> Dict[int, int]:
+        return self._overlay(self._query_index(field), field)
+
+    def _set_stream_index(self, index: Dict[int, int]):
+        self._stream_index = index
+        self._stream_snapshot = tuple(index.items())
+
+    async def load_stream_index(self):
+        """在執行緒中建立串流目的地索引；啟動時（setup_hook）呼叫，第一次轉送日誌時就不必在事件迴圈上讀檔。"""
+        field = "stream_log_channel_id"
+        index = await asyncio.to_thread(self._query_index, field)
+        # 查詢期間的 set/clear 已反映在快取與待寫入的設定中，覆蓋後不會遺失
+        self._set_stream_index(self._overlay(index, field))
+
+    def _index_stream(self, guild_id: int, channel_id: int):
+        if self._stream_index is None:
+            return      # 尚未建立；建立時會從後端讀到已儲存的值
+        if channel_id:
+            self._stream_index[guild_id] = channel_id
+        else:
+            self._stream_index.pop(guild_id, None)
+        self._set_stream_index(self._stream_index)
+
+    def stream_destinations(self) -> Tuple[Tuple[int, int], ...]:
+        """(guild_id, channel_id) 的快照；O(1)，呼叫端可以放心在每一行日誌時使用。"""
+        if self._stream_index is None:
+            # 沒有先呼叫 load_stream_index()（例如不經 bot 直接使用）時才同步查詢
+            self._set_stream_index(self._channel_index("stream_log_channel_id"))
+        return self._stream_snapshot
+
+    def guilds_with_stream_channel(self) -> List[int]:
+        return [gid for gid, _ in self.stream_destinations()]
+
+    def guilds_with_crit_channel(self) -> Dict[int, int]:
+        """guild_id → 大成功/大失敗上報頻道（SQLite 後端為單一索引查詢）。"""
+        return self._channel_index("crit_log_channel_id")
 
     # ---------- Global stream（新） ----------
     def get_global_stream_channel_id(self) -> int:
@@ -291,6 +503,126 @@ class ConfigManager:
         self.global_config.gstream.throttle_ms = max(0, int(ms))
         self._save_global()
 
+    def set_global_stream_min_level(self, level: str):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError("等級必須是 DEBUG / INFO / WARNING / ERROR / CRITICAL")
+        self.global_config.gstream.min_level = level
+        self._save_global()
+
     def set_global_stream_chunk_limit(self, n: int):
         self.global_config.gstream.chunk_limit = max(200, int(n))
         self._save_global()
+
+    # ---------- 日誌交接緩衝（全域） ----------
+    def get_log_queue_settings(self) -> LogQueueSettings:
+        return self.global_config.logq
+
+    def set_log_queue_policy(self, policy: str, sample_every: Optional[int] = None):
+        if policy not in LOG_QUEUE_POLICIES:
+            raise ValueError("policy 必須是 oldest / lowest / sample")
+        self.global_config.logq.policy = policy
+        if sample_every is not None:
+            self.global_config.logq.sample_every = max(2, int(sample_every))
+        self._save_global()
+
+    def set_log_queue_capacity(self, n: int):
+        self.global_config.logq.capacity = max(100, min(int(n), 100_000))
+        self._save_global()
+
+    # ---------- 熱重載 ----------
+    # 手動編輯設定檔後不必重啟：只重讀有變動的檔案，與記憶體中的設定逐欄比對後就地套用。
+    def start_watch(self, interval: float = WATCH_INTERVAL):
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(
+                self._watch(interval), context=contextvars.Context())
+
+    async def stop_watch(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, interval: float):
+        await asyncio.to_thread(self.store.changed, self._watched())     # 建立基準
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_changed()
+            except Exception as e:
+                logger.error(f"設定熱重載失敗：{e}")
+
+    def _watched(self) -> List[int]:
+        # 輪詢時優先檢查的伺服器：已載入的，以及有串流頻道的（其餘由後端較久一次的完整掃描涵蓋）
+        ids = {gid for gid, _ in self.guild_cache.items()}
+        if self._stream_index is not None:
+            ids.update(self._stream_index)
+        return list(ids)
+
+    async def reload_changed(self) -> Dict[Hashable, List[str]]:
+        """套用外部修改，回傳 key → 已變更的欄位。"""
+        keys = await asyncio.to_thread(self.store.changed, self._watched())
+        rebuild = keys is None
+        if keys is None:
+            # 後端無法指出是哪些：重讀已載入的部分，串流索引整個重建
+            keys = ["global"] + [("guild", gid) for gid, _ in self.guild_cache.items()]
+        if not keys:
+            return {}
+        loaded, errors = await asyncio.to_thread(self._read_raw, keys)
+        for key, e in errors:
+            logger.error(f"重新載入設定失敗（{key}）：{e}")
+
+        applied: Dict[Hashable, List[str]] = {}
+        for key, raw in loaded.items():
+            if self._writer.pending(key) is not None:
+                # 記憶體中有尚未寫出的修改：以它為準，寫出時會覆蓋這次的手動編輯
+                logger.warning(f"設定檔有未寫出的修改，略過手動編輯（{key}）")
+                continue
+            try:
+                if key == "global":
+                    changed, rejected = _merge(self.global_config, self._decode("global", GlobalConfig, raw)[0])
+                else:
+                    changed, rejected = self._apply_guild(key[1], self._decode("guild", GuildConfig, raw)[0])
+            except Exception as e:
+                logger.error(f"重新載入設定失敗（{key}）：{e}")
+                continue
+            if rejected:
+                logger.warning(f"設定檔欄位型別不符，已略過（{key}）：{', '.join(rejected)}")
+            if changed:
+                applied[key] = changed
+                logger.info(f"已重新載入設定（{key}）：{', '.join(changed)}")
+        if rebuild and self._stream_index is not None:
+            await self.load_stream_index()
+        return applied
+
+    def _read_raw(self, keys: List[Hashable]) -> Tuple[Dict[Hashable, dict], List[Tuple[Hashable, Exception]]]:
+        # 在執行緒中呼叫：只讀取與解析 JSON，錯誤帶回事件迴圈再記錄
+        out, errors = {}, []
+        for key in keys:
+            try:
+                raw = self.store.load_global() if key == "global" else self.store.load_guild(key[1])
+            except Exception as e:
+                errors.append((key, e))
+                continue
+            if raw is not None:
+                out[key] = raw
+        return out, errors
+
+    def _apply_guild(self, guild_id: int, new: GuildConfig) -> Tuple[List[str], List[str]]:
+        cfg = self.guild_cache.peek(guild_id)
+        if cfg is None:
+            # 尚未載入：下次用到時會直接讀到新檔，只需要同步串流索引
+            ch = new.stream_log_channel_id
+            if self._stream_index is None or not isinstance(ch, int) or self._stream_index.get(guild_id, 0) == ch:
+                return [], []
+            self._index_stream(guild_id, ch)
+            return ["stream_log_channel_id"], []
+        changed, rejected = _merge(cfg, new)
+        if changed:
+            self.guild_cache.refresh(guild_id)
+            if "stream_log_channel_id" in changed:
+                self._index_stream(guild_id, cfg.stream_log_channel_id)
+        return changed, rejected
@@ -0,0 +1,131 @@
+# utils/config_codec.py
+"""設定 dataclass 的編碼/解碼與版本遷移。
+
+解碼由 dataclass 欄位定義驅動：缺少的鍵用欄位預設值（預設值只寫在 dataclass 一處），
+巢狀 dataclass 遞迴處理，未知的鍵忽略。型別不做檢查（熱重載時由 _merge 把關）。
+有安裝 orjson 時用它序列化，否則退回標準函式庫 json。
+"""
+from __future__ import annotations
+
+import json
+import typing
+from dataclasses import MISSING, fields, is_dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:     # 選用
+    orjson = None
+
+SCHEMA_VERSION = 1
+VERSION_KEY = "_v"
+
+# ---------- 編碼 / 解碼 ----------
+# 每個類別第一次用到時依欄位定義產生專用的 encode/decode 函式（與 dataclasses 產生 __init__ 的做法相同），
+# 之後每次呼叫只是一個函式呼叫加上字典取值，不再逐欄走訪 fields()。
+_decoders: Dict[type, Callable[[Any], Any]] = {}
+_encoders: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+def _list_or(v: Any, factory: Callable[[], list]) -> list:
+    return list(v) if isinstance(v, list) else factory()
+
+def _compile(cls: type):
+    hints = typing.get_type_hints(cls)
+    ns: Dict[str, Any] = {"cls": cls, "_list_or": _list_or, "_MISSING": MISSING}
+    dec_args, enc_items = [], []
+    for n, f in enumerate(fields(cls)):
+        t = hints[f.name]
+        key = repr(f.name)
+        if is_dataclass(t):
+            ns[f"dec{n}"], ns[f"enc{n}"] = _decoder(t), _encoder(t)
+            dec_args.append(f"{f.name}=dec{n}(g({key}))")
+            enc_items.append(f"{key}: enc{n}(o.{f.name})")
+        elif typing.get_origin(t) in (list, List):
+            ns[f"df{n}"] = f.default_factory
+            dec_args.append(f"{f.name}=_list_or(g({key}, _MISSING), df{n})")
+            enc_items.append(f"{key}: list(o.{f.name})")
+        else:
+            if f.default_factory is not MISSING:
+                ns[f"df{n}"] = f.default_factory
+                dec_args.append(f"{f.name}=g({key}) if {key} in raw else df{n}()")
+            else:
+                ns[f"d{n}"] = f.default
+                dec_args.append(f"{f.name}=g({key}, d{n})")
+            enc_items.append(f"{key}: o.{f.name}")
+    src = (
+        "def decode(raw):\n"
+        "    if not isinstance(raw, dict):\n"
+        "        raw = {}\n"
+        "    g = raw.get\n"
+        f"    return cls({', '.join(dec_args)})\n"
+        "def encode(o):\n"
+        f"    return {{{', '.join(enc_items)}}}\n"
+    )
+    exec(src, ns)
+    _decoders[cls], _encoders[cls] = ns["decode"], ns["encode"]
+
+def _decoder(cls: type) -> Callable[[Any], Any]:
+    if cls not in _decoders:
+        _compile(cls)
+    return _decoders[cls]
+
+def _encoder(cls: type) -> Callable[[Any], Dict[str, Any]]:
+    if cls not in _encoders:
+        _compile(cls)
+    return _encoders[cls]
+
+def decode(cls: type, raw: Any):
+    """dict → dataclass；缺少的鍵用預設值，raw 不是 dict 時視為空（全部預設值）。"""
+    return _decoder(cls)(raw)
+
+def encode(obj: Any) -> Dict[str, Any]:
+    """dataclass → dict；list 會複製，結果不與原物件共用可變狀態（比 asdict 的 deepcopy 便宜）。"""
+    return _encoder(type(obj))(obj)
+
+def to_payload(obj: Any) -> Dict[str, Any]:
+    """寫入用：encode 後加上版本號。"""
+    out = encode(obj)
+    out[VERSION_KEY] = SCHEMA_VERSION
+    return out
+
+# ---------- 序列化 ----------
+if orjson is not None:
+    def dumps(payload: Dict[str, Any], pretty: bool = False) -> str:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2 if pretty else 0).decode("utf-8")
+
+    def loads(text: str | bytes) -> Any:
+        return orjson.loads(text)
+else:
+    def dumps(payload: Dict[str, Any], pretty: bool = False) -> str:
+        if pretty:
+            return json.dumps(payload, ensure_ascii=False, indent=2)
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(text: str | bytes) -> Any:
+        return json.loads(text)
+
+# ---------- 版本遷移 ----------
+# 沒有版本號的檔案視為第 1 版（加入版本號前的格式）；舊版 data/config.json 由儲存後端標成第 0 版。
+def _global_v0(raw: dict) -> dict:
+    # 舊版 config.json 只有開發者名單與重啟設定，其餘鍵不屬於全域設定
+    return {"dev_user_ids": raw.get("dev_user_ids", []), "restart": raw.get("restart", {})}
+
+# kind（"global" / "guild"）→ {舊版本: 升級到下一版的函式}
+MIGRATIONS: Dict[str, Dict[int, Callable[[dict], dict]]] = {
+    "global": {0: _global_v0},
+    "guild": {},
+}
+
+def upgrade(kind: str, raw: dict) -> Tuple[dict, bool]:
+    """把 raw 逐版升級到 SCHEMA_VERSION，回傳 (新 raw, 是否有升級)。"""
+    v = raw.get(VERSION_KEY, 1)
+    if v > SCHEMA_VERSION:
+        raise ValueError(f"設定版本 {v} 比程式支援的 {SCHEMA_VERSION} 新")
+    steps = MIGRATIONS[kind]
+    start = v
+    while v < SCHEMA_VERSION:
+        step = steps.get(v)
+        if step is not None:
+            raw = step(raw)
+        v += 1
+    return raw, v != start
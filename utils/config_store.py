@@ -0,0 +1,354 @@
+# utils/config_store.py
+"""設定的儲存後端：每伺服器一個 JSON 檔（預設）或單一 SQLite 資料庫。
+
+兩者資料格式相同（utils.config_codec 編碼後的 dict），可用本模組互相遷移：
+
+    python -m utils.config_store --from json --to sqlite [--data data]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from utils.config_codec import VERSION_KEY, dumps, loads
+from utils.persist import atomic_write_text
+
+logger = logging.getLogger("trpg_bot")
+
+# 可做跨伺服器查詢的欄位（SQLite 後端為它們建立索引）
+INDEXED_FIELDS = ("stream_log_channel_id", "crit_log_channel_id")
+BATCH = 500
+FULL_SCAN_INTERVAL = 30.0   # 秒；JSON 後端完整走訪 guilds 目錄的最長間隔（其餘輪詢只 stat 關注中的檔案）
+
+Payload = Dict[str, Any]
+WriteItem = Tuple[Hashable, Payload]     # key 為 "global" 或 ("guild", guild_id)
+
+def _read_legacy(path: Optional[Path]) -> Optional[Payload]:
+    """舊版 data/config.json（全域設定尚未獨立成檔前）；標成第 0 版交給遷移處理。"""
+    if path is None or not path.exists():
+        return None
+    raw = loads(path.read_bytes())
+    raw[VERSION_KEY] = 0
+    return raw
+
+class ConfigStore(ABC):
+    name = "base"
+
+    @abstractmethod
+    def load_global(self) -> Optional[Payload]:
+        ...
+
+    def load_guild(self, guild_id: int) -> Optional[Payload]:
+        return self.load_guilds([guild_id]).get(guild_id)
+
+    @abstractmethod
+    def load_guilds(self, guild_ids: Iterable[int]) -> Dict[int, Payload]:
+        ...
+
+    @abstractmethod
+    def guild_ids(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    def guilds_with(self, field: str) -> Dict[int, int]:
+        """field（INDEXED_FIELDS 之一）不為 0 的伺服器 → 該欄位值。"""
+
+    @abstractmethod
+    def write(self, items: List[WriteItem]) -> List[Tuple[Hashable, Exception]]:
+        """批次寫入（在執行緒中呼叫）；回傳失敗的 (key, 例外)。"""
+
+    def changed(self, watch: Optional[Iterable[int]] = None) -> Optional[List[Hashable]]:
+        """上次呼叫後被外部（手動編輯）修改的 key；自己寫入的不算。
+
+        watch 是呼叫端在意的伺服器（已載入的、有串流頻道的）；後端可以只檢查它們，
+        其餘的較久才完整檢查一次。None 表示全部檢查。
+        回傳 None 表示後端無法得知是哪些（呼叫端應重讀已載入的全部設定）。
+        第一次呼叫只建立基準，回傳空串列。
+        """
+        return []
+
+    def close(self):
+        pass
+
+class JsonDirStore(ConfigStore):
+    """data/config.global.json + data/guilds/<id>.json；每檔以暫存檔 + rename 原子寫入。"""
+    name = "json"
+
+    def __init__(self, global_path: str = "data/config.global.json", guilds_dir: str = "data/guilds"):
+        self.global_path = Path(global_path)
+        self.legacy_path = self.global_path.parent / "config.json"
+        self.guilds_dir = Path(guilds_dir)
+        self.guilds_dir.mkdir(parents=True, exist_ok=True)
+        self.global_path.parent.mkdir(parents=True, exist_ok=True)
+        # key → (mtime_ns, size)；寫入時更新，changed() 比對它找出手動編輯過的檔案
+        self._sigs: Optional[Dict[Hashable, Tuple[int, int]]] = None
+        self._dir_mtime = 0             # guilds_dir 的 mtime（新增/刪除/rename 檔案時改變）
+        self._full_at = 0.0             # 上次完整掃描的時間（monotonic）
+        self._sig_lock = threading.Lock()
+
+    def _guild_file(self, guild_id: int) -> Path:
+        return self.guilds_dir / f"{guild_id}.json"
+
+    def load_global(self) -> Optional[Payload]:
+        if not self.global_path.exists():
+            return _read_legacy(self.legacy_path)
+        return loads(self.global_path.read_bytes())
+
+    def load_guild(self, guild_id: int) -> Optional[Payload]:
+        path = self._guild_file(guild_id)
+        if not path.exists():
+            return None
+        return loads(path.read_bytes())
+
+    def load_guilds(self, guild_ids: Iterable[int]) -> Dict[int, Payload]:
+        out = {}
+        for gid in guild_ids:
+            try:
+                raw = self.load_guild(gid)
+            except Exception as e:
+                logger.error(f"讀取伺服器設定失敗（{gid}）：{e}")
+                continue
+            if raw is not None:
+                out[gid] = raw
+        return out
+
+    def guild_ids(self) -> List[int]:
+        ids = []
+        for p in self.guilds_dir.glob("*.json"):
+            try:
+                ids.append(int(p.stem))
+            except ValueError:
+                continue
+        return ids
+
+    def guilds_with(self, field: str) -> Dict[int, int]:
+        # 這個格式沒有索引：只能逐檔讀取
+        out = {}
+        for gid, raw in self.load_guilds(self.guild_ids()).items():
+            v = raw.get(field, 0)
+            if v:
+                out[gid] = int(v)
+        return out
+
+    def write(self, items: List[WriteItem]) -> List[Tuple[Hashable, Exception]]:
+        errors = []
+        for key, payload in items:
+            path = self.global_path if key == "global" else self._guild_file(key[1])
+            try:
+                text = dumps(payload, pretty=True)     # 保留縮排，方便手動編輯
+                # 寫檔與記錄簽章要一起完成，changed() 才不會把自己的寫入當成外部修改
+                with self._sig_lock:
+                    atomic_write_text(path, text)
+                    if self._sigs is not None:
+                        st = path.stat()
+                        self._sigs[key] = (st.st_mtime_ns, st.st_size)
+                        if key != "global":
+                            # rename 也改了目錄的 mtime；自己的寫入不該觸發完整掃描
+                            self._dir_mtime = self.guilds_dir.stat().st_mtime_ns
+            except Exception as e:
+                errors.append((key, e))
+        return errors
+
+    def _scan(self) -> Dict[Hashable, Tuple[int, int]]:
+        sigs: Dict[Hashable, Tuple[int, int]] = {}
+        try:
+            st = self.global_path.stat()
+            sigs["global"] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+        with os.scandir(self.guilds_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json") or entry.name.startswith("."):
+                    continue
+                try:
+                    gid = int(entry.name[:-5])
+                    st = entry.stat()
+                except (ValueError, FileNotFoundError):
+                    continue
+                sigs[("guild", gid)] = (st.st_mtime_ns, st.st_size)
+        return sigs
+
+    def _stat_keys(self, keys: List[Hashable]) -> Dict[Hashable, Tuple[int, int]]:
+        sigs: Dict[Hashable, Tuple[int, int]] = {}
+        for key in keys:
+            path = self.global_path if key == "global" else self._guild_file(key[1])
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            sigs[key] = (st.st_mtime_ns, st.st_size)
+        return sigs
+
+    def changed(self, watch: Optional[Iterable[int]] = None) -> Optional[List[Hashable]]:
+        # mtime 輪詢，只 stat 不讀檔。平常只看全域檔、watch 中的伺服器檔與目錄的 mtime，
+        # 每次輪詢的成本與伺服器總數無關；目錄有變動（新增/刪除檔案）或每 FULL_SCAN_INTERVAL 秒才走訪整個目錄
+        now = time.monotonic()
+        with self._sig_lock:
+            try:
+                dir_mtime = self.guilds_dir.stat().st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime = 0
+            old = self._sigs
+            if old is None or watch is None or dir_mtime != self._dir_mtime or now - self._full_at >= FULL_SCAN_INTERVAL:
+                sigs = self._scan()
+                self._sigs, self._dir_mtime, self._full_at = sigs, dir_mtime, now
+                if old is None:
+                    return []
+                return [key for key, sig in sigs.items() if old.get(key) != sig]
+            keys: List[Hashable] = ["global"] + [("guild", gid) for gid in watch]
+            sigs = self._stat_keys(keys)
+            out = []
+            for key in keys:
+                sig = sigs.get(key)
+                if sig is None:
+                    continue    # 刪除檔案會改變目錄 mtime，交給完整掃描
+                if old.get(key) != sig:
+                    old[key] = sig
+                    out.append(key)
+            return out
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS global_config (
+    id   INTEGER PRIMARY KEY CHECK (id = 0),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id              INTEGER PRIMARY KEY,
+    data                  TEXT    NOT NULL,
+    stream_log_channel_id INTEGER NOT NULL DEFAULT 0,
+    crit_log_channel_id   INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_guild_stream ON guild_config(stream_log_channel_id) WHERE stream_log_channel_id != 0;
+CREATE INDEX IF NOT EXISTS idx_guild_crit ON guild_config(crit_log_channel_id) WHERE crit_log_channel_id != 0;
+"""
+
+class SqliteStore(ConfigStore):
+    """單一 SQLite 檔（WAL）：讀取與跨伺服器查詢都是單一查詢，一批修改為一個交易。"""
+    name = "sqlite"
+
+    def __init__(self, path: str = "data/config.sqlite3", legacy_path: Optional[str] = None):
+        self.path = Path(path)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()   # 寫入在執行緒、讀取在事件迴圈，共用一條連線
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._data_version: Optional[int] = None
+
+    def load_global(self) -> Optional[Payload]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM global_config WHERE id = 0").fetchone()
+        return loads(row[0]) if row else _read_legacy(self.legacy_path)
+
+    def load_guilds(self, guild_ids: Iterable[int]) -> Dict[int, Payload]:
+        ids = list(guild_ids)
+        out = {}
+        for i in range(0, len(ids), BATCH):
+            chunk = ids[i:i + BATCH]
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT guild_id, data FROM guild_config WHERE guild_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            for gid, data in rows:
+                out[gid] = loads(data)
+        return out
+
+    def guild_ids(self) -> List[int]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT guild_id FROM guild_config")]
+
+    def guilds_with(self, field: str) -> Dict[int, int]:
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"未建立索引的欄位：{field}")
+        with self._lock:
+            rows = self._db.execute(f"SELECT guild_id, {field} FROM guild_config WHERE {field} != 0").fetchall()
+        return dict(rows)
+
+    def write(self, items: List[WriteItem]) -> List[Tuple[Hashable, Exception]]:
+        guilds, glob = [], None
+        for key, payload in items:
+            if key == "global":
+                glob = dumps(payload)
+            else:
+                guilds.append((key[1], dumps(payload),
+                               int(payload.get("stream_log_channel_id", 0) or 0),
+                               int(payload.get("crit_log_channel_id", 0) or 0)))
+        try:
+            with self._lock, self._db:
+                if glob is not None:
+                    self._db.execute("INSERT OR REPLACE INTO global_config (id, data) VALUES (0, ?)", (glob,))
+                if guilds:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO guild_config "
+                        "(guild_id, data, stream_log_channel_id, crit_log_channel_id) VALUES (?, ?, ?, ?)",
+                        guilds,
+                    )
+        except Exception as e:
+            return [(key, e) for key, _ in items]
+        return []
+
+    def changed(self, watch: Optional[Iterable[int]] = None) -> Optional[List[Hashable]]:
+        # data_version 只在「其他連線」提交後改變，自己的寫入不會觸發
+        with self._lock:
+            v = self._db.execute("PRAGMA data_version").fetchone()[0]
+        old, self._data_version = self._data_version, v
+        if old is None or old == v:
+            return []
+        return None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_store(kind: str, data_dir: str = "data") -> ConfigStore:
+    d = Path(data_dir)
+    if kind == "json":
+        return JsonDirStore(str(d / "config.global.json"), str(d / "guilds"))
+    if kind == "sqlite":
+        return SqliteStore(str(d / "config.sqlite3"), str(d / "config.json"))
+    raise ValueError("backend 必須是 json / sqlite")
+
+def migrate(src: ConfigStore, dst: ConfigStore) -> int:
+    """把 src 的全部設定複製到 dst（覆寫同 id），回傳伺服器數。"""
+    g = src.load_global()
+    if g is not None:
+        errors = dst.write([("global", g)])
+        if errors:
+            raise errors[0][1]
+    ids = src.guild_ids()
+    for i in range(0, len(ids), BATCH):
+        batch = src.load_guilds(ids[i:i + BATCH])
+        errors = dst.write([(("guild", gid), raw) for gid, raw in batch.items()])
+        if errors:
+            raise errors[0][1]
+    return len(ids)
+
+def main():
+    ap = argparse.ArgumentParser(description="設定儲存後端遷移")
+    ap.add_argument("--from", dest="src", choices=("json", "sqlite"), required=True)
+    ap.add_argument("--to", dest="dst", choices=("json", "sqlite"), required=True)
+    ap.add_argument("--data", default="data", help="資料目錄（預設 data）")
+    args = ap.parse_args()
+    if args.src == args.dst:
+        ap.error("來源與目的相同")
+    src, dst = open_store(args.src, args.data), open_store(args.dst, args.data)
+    try:
+        n = migrate(src, dst)
+    finally:
+        src.close()
+        dst.close()
+    print(f"已將 {n} 個伺服器設定從 {args.src} 遷移到 {args.dst}；"
+          f"請在 .env 設定 CONFIG_BACKEND={args.dst} 後重新啟動")
+
+if __name__ == "__main__":
+    main()
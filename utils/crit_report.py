@@ -0,0 +1,79 @@
+# utils/crit_report.py
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger("trpg_bot")
+
+MAX_PENDING = 200   # 單一伺服器一個視窗內最多保留幾筆，超過只累計次數
+
+@dataclass
+class CritReport:
+    user_mention: str
+    channel: str
+    kind: str           # "dnd" | "cc"
+    label: str          # 骰式或技能值
+    times: int
+    crits: int
+    fumbles: int
+
+@dataclass
+class CritBatch:
+    guild_id: int
+    reports: List[CritReport]
+    overflow: int = 0       # 超過 MAX_PENDING 而未保留明細的筆數
+    crits: int = 0
+    fumbles: int = 0
+
+class CritPublisher:
+    """大成功/大失敗上報：按伺服器在 window 秒內彙整成一批，由背景任務送出。
+
+    submit() 不做任何 I/O，指令回覆玩家後就結束；同一視窗內的多筆上報只會送出一則訊息。
+    """
+
+    def __init__(self, send: Callable[[CritBatch], Awaitable[None]],
+                 window: Callable[[int], float]):
+        self._send = send
+        self._window = window
+        self._pending: Dict[int, CritBatch] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+
+    def submit(self, guild_id: int, report: CritReport):
+        batch = self._pending.get(guild_id)
+        if batch is None:
+            batch = self._pending[guild_id] = CritBatch(guild_id, [])
+        if len(batch.reports) < MAX_PENDING:
+            batch.reports.append(report)
+        else:
+            batch.overflow += 1
+        batch.crits += report.crits
+        batch.fumbles += report.fumbles
+        if guild_id not in self._timers:
+            self._timers[guild_id] = asyncio.get_running_loop().create_task(self._flush_later(guild_id))
+
+    async def _flush_later(self, guild_id: int):
+        try:
+            await asyncio.sleep(max(0.0, self._window(guild_id)))
+        finally:
+            self._timers.pop(guild_id, None)
+        await self._flush(guild_id)
+
+    async def _flush(self, guild_id: int):
+        batch = self._pending.pop(guild_id, None)
+        if batch is None:
+            return
+        try:
+            await self._send(batch)
+        except Exception as e:
+            logger.warning(f"大成功/大失敗上報失敗（{guild_id}，{len(batch.reports)} 筆）：{e}")
+
+    async def close(self):
+        """取消等待中的計時器並立即送出所有未送出的批次。"""
+        for t in list(self._timers.values()):
+            t.cancel()
+        self._timers.clear()
+        for gid in list(self._pending):
+            await self._flush(gid)
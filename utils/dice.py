@@ -1,86 +1,482 @@
-import random
+import operator
 import re
+from array import array
+from collections import Counter
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from functools import lru_cache, partial
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 
-DICE_RE = re.compile(
-    r"^\s*(?:(?P<count>\d*)d(?P<sides>\d+)(?P<mod>[+-]\d+)?)\s*(?:(?P<cmp><=|>=|<|>)\s*(?P<target>\d+))?\s*$",
+from utils import sim
+from utils.rng import FastRng, RngProvider, default_rng
+
+try:  # 選用：有 NumPy 時大量擲骰改走向量化
+    import numpy as np
+except ImportError:  # pragma: no cover - 依環境而定
+    np = None
+
+# 詞法：骰子項、整數、運算子、括號、比較
+TOKEN_RE = re.compile(
+    r"\s*(?:(?P<dice>(?P<count>\d*)d(?P<sides>\d+)(?:r(?P<reroll>\d+))?(?:k(?P<kdir>[hl]?)(?P<keep>\d+))?)"
+    r"|(?P<num>\d+)|(?P<cmp><=|>=|<|>)|(?P<op>[+\-()]))",
     re.IGNORECASE,
 )
 
-@dataclass
+_CMP_OPS: dict[str, Callable[[int, int], bool]] = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+PLAN_CACHE_SIZE = 256
+BULK_MAX_DRAWS = 2_000_000     # 單次指令（顆數 × 次數）的總骰數上限
+
+def _typecode(sides: int) -> str:
+    return "H" if sides <= 0xFFFF else "I"
+
 class RollResult:
-    rolls: List[int]
-    total: int
-    expr: str
-    detail: str
-    cmp: Optional[str] = None
-    target: Optional[int] = None
-    is_crit_success: bool = False
-    is_crit_failure: bool = False
+    """單次擲骰結果：骰值以 array 緊湊保存（依 plan 各組順序攤平），detail 要顯示時才組字串並快取。"""
+    __slots__ = ("plan", "rolls", "total", "is_crit_success", "is_crit_failure", "_detail")
+
+    def __init__(self, plan: "DicePlan", rolls: Sequence[int], total: int,
+                 is_crit_success: bool = False, is_crit_failure: bool = False):
+        self.plan = plan
+        self.rolls = rolls
+        self.total = total
+        self.is_crit_success = is_crit_success
+        self.is_crit_failure = is_crit_failure
+        self._detail: Optional[str] = None
+
+    @property
+    def expr(self) -> str:
+        return self.plan.expr
+
+    @property
+    def cmp(self) -> Optional[str]:
+        return self.plan.cmp
+
+    @property
+    def target(self) -> Optional[int]:
+        return self.plan.target
+
+    @property
+    def success(self) -> Optional[bool]:
+        """有比較式時的檢定結果"""
+        return self.plan.check(self.total)
+
+    @property
+    def detail(self) -> str:
+        if self._detail is None:
+            per_term, i = [], 0
+            for t in self.plan.terms:
+                per_term.append(self.rolls[i:i + t.count])
+                i += t.count
+            self._detail = _format_detail(self.plan, per_term)
+        return self._detail
+
+    def __repr__(self) -> str:
+        return f"RollResult(expr={self.expr!r}, total={self.total}, rolls={len(self.rolls)} dice)"
 
 class DiceError(ValueError):
     pass
 
-def parse_and_roll(expr: str, *, max_dice: int = 100, max_sides: int = 1000,
-                   d20_crit_succ: int = 20, d20_crit_fail: int = 1,
-                   d100_crit_succ: int = 1, d100_crit_fail: int = 100) -> RollResult:
-    m = DICE_RE.match(expr)
-    if not m:
-        raise DiceError("骰式不合法。範例：d6、2d6+1、d100<=65、d20>=15")
-
-    count_s = m.group("count") or "1"
-    sides_s = m.group("sides")
-    mod_s = m.group("mod") or "0"
-    cmp = m.group("cmp")
-    target_s = m.group("target")
-
-    count = int(count_s)
-    sides = int(sides_s)
-    mod = int(mod_s)
-    target = int(target_s) if target_s else None
-
-    if not (1 <= count <= max_dice):
-        raise DiceError(f"骰子顆數 1~{max_dice}")
-    if not (2 <= sides <= max_sides):
-        raise DiceError(f"骰面數 2~{max_sides}")
-
-    rolls = [random.randint(1, sides) for _ in range(count)]
-    total = sum(rolls) + mod
-
-    # 判定大成功/大失敗（依最典型需求：自然值）
-    is_crit_success = False
-    is_crit_failure = False
-    if count == 1 and sides == 20:
-        if rolls[0] == d20_crit_succ:
-            is_crit_success = True
-        elif rolls[0] == d20_crit_fail:
-            is_crit_failure = True
-    if count == 1 and sides == 100:
-        if rolls[0] == d100_crit_succ:
-            is_crit_success = True
-        elif rolls[0] == d100_crit_fail:
-            is_crit_failure = True
-
-    parts = [f"{count}d{sides}"]
+_SYNTAX_HINT = "骰式不合法。範例：d6、2d6+1、2d6+1d4+3、d20-(1d4+1)>=10、4d6kh3、2d6r2、d100<=65"
+
+@dataclass(frozen=True)
+class DiceTerm:
+    sign: int       # +1 / -1（括號展開後的正負號）
+    count: int
+    sides: int
+    reroll: int = 0     # rN：點數 ≤ N 的骰子重擲一次
+    keep: int = 0       # khK → +K（留高）；klK → -K（留低）；0 = 全留
+
+    def kept(self, rs: Sequence[int]) -> Sequence[int]:
+        if not self.keep:
+            return rs
+        s = sorted(rs)
+        return s[-self.keep:] if self.keep > 0 else s[:-self.keep]
+
+    def notation(self) -> str:
+        out = f"{self.count}d{self.sides}"
+        if self.reroll:
+            out += f"r{self.reroll}"
+        if self.keep:
+            out += f"kh{self.keep}" if self.keep > 0 else f"kl{-self.keep}"
+        return out
+
+@dataclass(frozen=True)
+class DicePlan:
+    """編譯後的骰式：括號已展開成「帶號骰組 + 常數」，可重複執行。"""
+    terms: Tuple[DiceTerm, ...]
+    mod: int
+    cmp: Optional[str]
+    target: Optional[int]
+    expr: str                                   # 正規化後的表達式（顯示用）
+    compare: Optional[Callable[[int, int], bool]] = None
+    crit_sides: int = 0                         # 單顆 d20/d100 時記錄面數，用於判定大成功/大失敗
+
+    @property
+    def dice_count(self) -> int:
+        return sum(t.count for t in self.terms)
+
+    def check_limits(self, *, max_dice: int = 100, max_sides: int = 1000):
+        n = self.dice_count
+        if not (1 <= n <= max_dice):
+            raise DiceError(f"骰子顆數 1~{max_dice}")
+        for t in self.terms:
+            if not (2 <= t.sides <= max_sides):
+                raise DiceError(f"骰面數 2~{max_sides}")
+
+    def check(self, total: int) -> Optional[bool]:
+        if self.compare is None:
+            return None
+        return self.compare(total, self.target)
+
+    @property
+    def has_house_rules(self) -> bool:
+        return any(t.reroll or t.keep for t in self.terms)
+
+    @property
+    def typecode(self) -> str:
+        return _typecode(max(t.sides for t in self.terms))
+
+    def roll(self, *, d20_crit_succ: int = 20, d20_crit_fail: int = 1,
+             d100_crit_succ: int = 1, d100_crit_fail: int = 100,
+             rng: Optional[RngProvider] = None) -> RollResult:
+        randint = (rng or default_rng()).randint
+        rolls = array(self.typecode)
+        total = self.mod
+        for t in self.terms:
+            rs = [randint(1, t.sides) for _ in range(t.count)]
+            if t.reroll:
+                rs = [x if x > t.reroll else randint(1, t.sides) for x in rs]
+            rolls.extend(rs)
+            total += t.sign * sum(t.kept(rs))
+
+        # 判定大成功/大失敗（依最典型需求：單顆 d20/d100 的自然值）
+        is_crit_success = is_crit_failure = False
+        if self.crit_sides == 20:
+            is_crit_success = rolls[0] == d20_crit_succ
+            is_crit_failure = not is_crit_success and rolls[0] == d20_crit_fail
+        elif self.crit_sides == 100:
+            is_crit_success = rolls[0] == d100_crit_succ
+            is_crit_failure = not is_crit_success and rolls[0] == d100_crit_fail
+
+        return RollResult(self, rolls, total, is_crit_success, is_crit_failure)
+
+def _format_detail(plan: DicePlan, per_term: Sequence[Sequence[int]]) -> str:
+    """例：單組 `3 + 4 +1`；多組 `(3 + 4) + (2) +3`；留高/留低 `6 + 5 + 4 [捨 1]`。"""
+    multi = len(plan.terms) > 1
+    groups: List[str] = []
+    for i, (t, rs) in enumerate(zip(plan.terms, per_term)):
+        if t.keep:
+            dropped = Counter(rs) - Counter(t.kept(rs))
+            shown, tail = [], sorted(dropped.elements())
+            for x in rs:
+                if dropped[x]:
+                    dropped[x] -= 1
+                else:
+                    shown.append(x)
+            g = " + ".join(map(str, shown)) + f" [捨 {', '.join(map(str, tail))}]"
+        else:
+            g = " + ".join(map(str, rs))
+        if multi or t.sign < 0:
+            g = f"({g})"
+        if i:
+            groups.append("+" if t.sign > 0 else "-")
+        elif t.sign < 0:
+            g = "-" + g
+        groups.append(g)
+    detail = " ".join(groups)
+    if plan.mod:
+        detail += f" {plan.mod:+d}"
+    return detail
+
+def _tokenize(expr: str) -> List[Tuple[str, object]]:
+    tokens: List[Tuple[str, object]] = []
+    pos, end = 0, len(expr.rstrip())
+    while pos < end:
+        m = TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise DiceError(_SYNTAX_HINT)
+        pos = m.end()
+        if m.group("dice"):
+            keep = int(m.group("keep") or "0")
+            if (m.group("kdir") or "").lower() == "l":
+                keep = -keep
+            tokens.append(("dice", (int(m.group("count") or "1"), int(m.group("sides")),
+                                    int(m.group("reroll") or "0"), keep, m.group("keep") is not None)))
+        elif m.group("num"):
+            tokens.append(("num", int(m.group("num"))))
+        elif m.group("cmp"):
+            tokens.append(("cmp", m.group("cmp")))
+        else:
+            tokens.append(("op", m.group("op")))
+    return tokens
+
+class _Parser:
+    """遞迴下降：sum := term (('+'|'-') term)* ；term := dice | num | '(' sum ')' | '-' term"""
+
+    def __init__(self, tokens: List[Tuple[str, object]]):
+        self.tokens = tokens
+        self.i = 0
+        self.terms: List[DiceTerm] = []
+        self.mod = 0
+
+    def peek(self) -> Tuple[str, object]:
+        return self.tokens[self.i] if self.i < len(self.tokens) else ("end", None)
+
+    def take(self) -> Tuple[str, object]:
+        tok = self.peek()
+        self.i += 1
+        return tok
+
+    def parse_sum(self, sign: int, depth: int = 0):
+        if depth > 16:
+            raise DiceError("括號巢狀過深")
+        self.parse_term(sign, depth)
+        while self.peek() in (("op", "+"), ("op", "-")):
+            _, op = self.take()
+            self.parse_term(sign if op == "+" else -sign, depth)
+
+    def parse_term(self, sign: int, depth: int):
+        kind, val = self.take()
+        if kind == "dice":
+            count, sides, reroll, keep, has_keep = val
+            if has_keep and not (1 <= abs(keep) <= count):
+                raise DiceError(f"保留顆數 1~{count}")
+            if reroll and reroll >= sides:
+                raise DiceError("重擲門檻必須小於骰面數")
+            self.terms.append(DiceTerm(sign=sign, count=count, sides=sides, reroll=reroll, keep=keep))
+        elif kind == "num":
+            self.mod += sign * val
+        elif (kind, val) == ("op", "("):
+            self.parse_sum(sign, depth + 1)
+            if self.take() != ("op", ")"):
+                raise DiceError("括號不對稱")
+        elif (kind, val) == ("op", "-"):
+            self.parse_term(-sign, depth)
+        else:
+            raise DiceError(_SYNTAX_HINT)
+
+def _canonical(terms: Tuple[DiceTerm, ...], mod: int) -> str:
+    out = []
+    for i, t in enumerate(terms):
+        if i or t.sign < 0:
+            out.append("+" if t.sign > 0 else "-")
+        out.append(t.notation())
     if mod:
-        parts.append(f"{mod:+d}")
+        out.append(f"{mod:+d}")
+    return "".join(out)
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def compile_expr(expr: str) -> DicePlan:
+    """把骰式編譯成 DicePlan；以原字串為鍵放進 LRU，重複的骰式不再重新解析。"""
+    tokens = _tokenize(expr)
+    cmp = target = None
+    if len(tokens) >= 2 and tokens[-2][0] == "cmp":
+        if tokens[-1][0] != "num":
+            raise DiceError(_SYNTAX_HINT)
+        cmp, target = tokens[-2][1], tokens[-1][1]
+        tokens = tokens[:-2]
+
+    p = _Parser(tokens)
+    p.parse_sum(1)
+    if p.i != len(tokens):
+        raise DiceError(_SYNTAX_HINT)
+    if not p.terms:
+        raise DiceError(_SYNTAX_HINT)
+
+    terms = tuple(p.terms)
+    crit_sides = 0
+    if len(terms) == 1 and terms[0].count == 1 and terms[0].sign > 0 and terms[0].sides in (20, 100):
+        crit_sides = terms[0].sides
+
+    shown = _canonical(terms, p.mod)
     if cmp and target is not None:
-        parts.append(f" {cmp} {target}")
-    detail = f"{' + '.join(map(str, rolls))}{f' {mod:+d}' if mod else ''}"
-
-    return RollResult(
-        rolls=rolls,
-        total=total,
-        expr="".join(parts),
-        detail=detail,
+        shown += f" {cmp} {target}"
+
+    return DicePlan(
+        terms=terms,
+        mod=p.mod,
         cmp=cmp,
         target=target,
-        is_crit_success=is_crit_success,
-        is_crit_failure=is_crit_failure,
+        expr=shown,
+        compare=_CMP_OPS[cmp] if cmp else None,
+        crit_sides=crit_sides,
     )
 
-REPEAT_RE = re.compile(r"^\s*\+(\d{1,2})\s+(.*)$")
+def parse_and_roll(expr: str, *, max_dice: int = 100, max_sides: int = 1000,
+                   d20_crit_succ: int = 20, d20_crit_fail: int = 1,
+                   d100_crit_succ: int = 1, d100_crit_fail: int = 100,
+                   rng: Optional[RngProvider] = None) -> RollResult:
+    plan = compile_expr(expr)
+    plan.check_limits(max_dice=max_dice, max_sides=max_sides)
+    return plan.roll(
+        d20_crit_succ=d20_crit_succ, d20_crit_fail=d20_crit_fail,
+        d100_crit_succ=d100_crit_succ, d100_crit_fail=d100_crit_fail,
+        rng=rng,
+    )
+
+# ---------- 大量擲骰（一次抽出全部次數的骰子） ----------
+def _draw(sides: int, n: int, rng: RngProvider):
+    """抽 n 顆 1..sides；有 NumPy 時統一成 uint16/uint32 ndarray，否則為 array('H'/'I')。"""
+    d = rng.draw(sides, n)
+    if np is not None:
+        return np.asarray(d, dtype=np.uint16 if sides <= 0xFFFF else np.uint32)
+    return array(_typecode(sides), d)
+
+def _draw_term(t: DiceTerm, times: int, rng: RngProvider):
+    d = _draw(t.sides, t.count * times, rng)
+    if t.reroll:
+        if np is not None:
+            mask = d <= t.reroll
+            d[mask] = _draw(t.sides, int(mask.sum()), rng)
+        else:
+            idx = [i for i, x in enumerate(d) if x <= t.reroll]
+            for i, x in zip(idx, _draw(t.sides, len(idx), rng)):
+                d[i] = x
+    return d
+
+def _term_sums(t: DiceTerm, d, times: int):
+    """每次的該組點數和（已套用留高/留低）。"""
+    c = t.count
+    if np is not None:
+        m = d.reshape(times, c)
+        if t.keep:
+            m = np.sort(m, axis=1)
+            m = m[:, -t.keep:] if t.keep > 0 else m[:, :-t.keep]
+        return m.sum(axis=1, dtype=np.int64)
+    if c == 1:
+        return d
+    if t.keep:
+        return [sum(t.kept(d[i * c:(i + 1) * c])) for i in range(times)]
+    return [sum(d[i * c:(i + 1) * c]) for i in range(times)]
+
+@dataclass
+class BulkRollResult:
+    """plan 執行 times 次的結果；draws[k] 為第 k 組骰子的扁平陣列（times × count）。"""
+    plan: DicePlan
+    times: int
+    draws: List[Sequence[int]]
+    totals: Sequence[int]           # 每次的總和
+    crit_flags: Sequence[int]       # 每次是否大成功（0/1）
+    fumble_flags: Sequence[int]     # 每次是否大失敗（0/1）
+
+    @property
+    def crit_count(self) -> int:
+        if np is not None:
+            return int(np.count_nonzero(self.crit_flags))
+        return sum(self.crit_flags)
+
+    @property
+    def fumble_count(self) -> int:
+        if np is not None:
+            return int(np.count_nonzero(self.fumble_flags))
+        return sum(self.fumble_flags)
+
+    @property
+    def success_count(self) -> Optional[int]:
+        if self.plan.compare is None:
+            return None
+        cmp, target = self.plan.compare, self.plan.target
+        if np is not None:
+            return int(cmp(self.totals, target).sum())
+        return sum(1 for t in self.totals if cmp(t, target))
+
+    def luck_sum(self) -> float:
+        """所有骰子正規化點數 (x-1)/(面數-1) 的總和（留高/留低前的原始骰值），期望值為顆數的一半。"""
+        out = 0.0
+        for t, d in zip(self.plan.terms, self.draws):
+            if t.sides > 1:
+                s = int(d.sum(dtype=np.int64)) if np is not None else sum(d)
+                out += (s - len(d)) / (t.sides - 1)
+        return out
+
+    def histogram(self) -> Dict[int, int]:
+        if np is not None:
+            vals, cnts = np.unique(self.totals, return_counts=True)
+            return dict(zip(vals.tolist(), cnts.tolist()))
+        return dict(Counter(self.totals))
+
+    def result(self, i: int) -> RollResult:
+        """第 i 次的 RollResult：只複製該列骰值（只在要顯示時才做）。"""
+        plan = self.plan
+        rolls = array(plan.typecode)
+        for t, d in zip(plan.terms, self.draws):
+            row = d[i * t.count:(i + 1) * t.count]
+            rolls.extend(row.tolist())   # 各組的 typecode 可能不同，array.extend 不接受不同型別的 array
+        return RollResult(plan, rolls, int(self.totals[i]),
+                          bool(self.crit_flags[i]), bool(self.fumble_flags[i]))
+
+def roll_bulk(plan: DicePlan, times: int, *, d20_crit_succ: int = 20, d20_crit_fail: int = 1,
+              d100_crit_succ: int = 1, d100_crit_fail: int = 100,
+              rng: Optional[RngProvider] = None) -> BulkRollResult:
+    """一次向 rng 批次抽出 times 次所需的全部骰子；有 NumPy 時向量化加總。"""
+    if times * plan.dice_count > BULK_MAX_DRAWS:
+        raise DiceError(f"總骰數（顆數 × 次數）上限 {BULK_MAX_DRAWS}")
+
+    rng = rng or default_rng()
+    draws = [_draw_term(t, times, rng) for t in plan.terms]
+
+    if np is not None:
+        totals = np.full(times, plan.mod, dtype=np.int64)
+        for t, d in zip(plan.terms, draws):
+            totals += t.sign * _term_sums(t, d, times)
+    else:
+        totals = array("q", [plan.mod]) * times
+        for t, d in zip(plan.terms, draws):
+            for i, x in enumerate(_term_sums(t, d, times)):
+                totals[i] += t.sign * x
+
+    if plan.crit_sides:
+        succ, fail = ((d20_crit_succ, d20_crit_fail) if plan.crit_sides == 20
+                      else (d100_crit_succ, d100_crit_fail))
+        first = draws[0]    # 單顆 d20/d100：每次恰好一顆
+        if np is not None:
+            crit = (first == succ).astype(np.int8)
+            fumble = ((first == fail) & (first != succ)).astype(np.int8)
+        else:
+            crit = array("b", [x == succ for x in first])
+            fumble = array("b", [x == fail and x != succ for x in first])
+    else:
+        crit = fumble = array("b", bytes(times))
+
+    return BulkRollResult(plan=plan, times=times, draws=draws, totals=totals,
+                          crit_flags=crit, fumble_flags=fumble)
+
+# ---------- 蒙地卡羅模擬（在 utils.sim 的行程池中執行） ----------
+def simulate_chunk(plan: DicePlan, trials: int, seed: int, crit_kwargs: Dict[str, int]) -> sim.ChunkResult:
+    """worker 端：以獨立種子跑 trials 次，回傳總和直方圖與大成敗/檢定計數。"""
+    rng = FastRng(seed)
+    hist: Dict[int, int] = {}
+    extra: Dict[str, int] = {}
+    done = 0
+    step = max(1, BULK_MAX_DRAWS // max(1, plan.dice_count))
+    while done < trials:
+        n = min(step, trials - done)
+        b = roll_bulk(plan, n, rng=rng, **crit_kwargs)
+        for k, v in b.histogram().items():
+            hist[k] = hist.get(k, 0) + v
+        extra["crit"] = extra.get("crit", 0) + b.crit_count
+        extra["fumble"] = extra.get("fumble", 0) + b.fumble_count
+        if plan.compare is not None:
+            extra["success"] = extra.get("success", 0) + b.success_count
+        done += n
+    return hist, extra
+
+async def simulate(plan: DicePlan, trials: int, *, time_budget: float = sim.DEFAULT_TIME_BUDGET,
+                   on_progress: Optional[Callable[[sim.SimResult], Awaitable[None]]] = None,
+                   d20_crit_succ: int = 20, d20_crit_fail: int = 1,
+                   d100_crit_succ: int = 1, d100_crit_fail: int = 100) -> sim.SimResult:
+    """把 plan 跑 trials 次（行程池、分塊、各塊獨立種子），超過 time_budget 秒即停止並回傳部分結果。"""
+    crit_kwargs = dict(d20_crit_succ=d20_crit_succ, d20_crit_fail=d20_crit_fail,
+                       d100_crit_succ=d100_crit_succ, d100_crit_fail=d100_crit_fail)
+    chunk = max(1_000, sim.CHUNK_DRAWS // plan.dice_count)
+    return await sim.run_chunks(partial(simulate_chunk, plan, crit_kwargs=crit_kwargs), trials, chunk,
+                                time_budget=time_budget, on_progress=on_progress)
+
+REPEAT_RE = re.compile(r"^\s*\+(\d{1,5})\s+(.*)$")
 
 def extract_repeat(expr: str, *, max_times: int = 50) -> tuple[int, str]:
     """
@@ -93,3 +489,21 @@ def extract_repeat(expr: str, *, max_times: int = 50) -> tuple[int, str]:
     if not (1 <= times <= max_times):
         raise DiceError(f"連續次數 1~{max_times}")
     return times, m.group(2).strip()
+
+# ---------- 聊天中的行內擲骰 [[...]] ----------
+INLINE_RE = re.compile(r"\[\[([^\[\]\n]{1,80})\]\]")
+MAX_INLINE = 5      # 單則訊息最多處理幾段
+
+def find_inline(text: str, limit: int = MAX_INLINE) -> List[str]:
+    """取出訊息中的 [[...]] 片段。
+
+    監聽器會看到每一則訊息，絕大多數不含骰式：先用子字串檢查快速排除，才跑正規式。
+    """
+    if "[[" not in text or "]]" not in text:
+        return []
+    out = []
+    for m in INLINE_RE.finditer(text):
+        out.append(m.group(1).strip())
+        if len(out) >= limit:
+            break
+    return out
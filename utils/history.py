@@ -0,0 +1,268 @@
+# utils/history.py
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger("trpg_bot")
+
+DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rolls (
+    id          INTEGER PRIMARY KEY,
+    ts          INTEGER NOT NULL,       -- unix 秒
+    guild_id    INTEGER NOT NULL,       -- 0 = 私訊
+    user_id     INTEGER NOT NULL,
+    kind        TEXT    NOT NULL,       -- 'dnd' | 'cc'
+    expr        TEXT    NOT NULL,
+    times       INTEGER NOT NULL,
+    n_dice      INTEGER NOT NULL,
+    luck_sum    REAL    NOT NULL,       -- 各骰正規化點數 (x-1)/(面數-1) 的總和；CoC 以 (100-x)/99 計
+    crits       INTEGER NOT NULL,
+    fumbles     INTEGER NOT NULL,
+    checks      INTEGER NOT NULL,       -- 有比較式/技能檢定的次數
+    successes   INTEGER NOT NULL,
+    first_total INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_rolls_guild_ts ON rolls(guild_id, ts);
+CREATE INDEX IF NOT EXISTS idx_rolls_user_ts ON rolls(user_id, ts);
+
+-- 每日彙總：統計查詢只掃這張表，列數與「天 × 活躍玩家」成正比，而不是與擲骰次數成正比
+CREATE TABLE IF NOT EXISTS daily (
+    guild_id  INTEGER NOT NULL,
+    day       INTEGER NOT NULL,         -- ts // 86400
+    user_id   INTEGER NOT NULL,
+    commands  INTEGER NOT NULL,
+    rolls     INTEGER NOT NULL,
+    n_dice    INTEGER NOT NULL,
+    luck_sum  REAL    NOT NULL,
+    crits     INTEGER NOT NULL,
+    fumbles   INTEGER NOT NULL,
+    checks    INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, day, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_daily_user ON daily(user_id, day);
+"""
+
+_UPSERT_DAILY = """
+INSERT INTO daily (guild_id, day, user_id, commands, rolls, n_dice, luck_sum, crits, fumbles, checks, successes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (guild_id, day, user_id) DO UPDATE SET
+    commands  = commands + excluded.commands,
+    rolls     = rolls + excluded.rolls,
+    n_dice    = n_dice + excluded.n_dice,
+    luck_sum  = luck_sum + excluded.luck_sum,
+    crits     = crits + excluded.crits,
+    fumbles   = fumbles + excluded.fumbles,
+    checks    = checks + excluded.checks,
+    successes = successes + excluded.successes
+"""
+
+_AGG = ("SUM(commands), SUM(rolls), SUM(n_dice), SUM(luck_sum), "
+        "SUM(crits), SUM(fumbles), SUM(checks), SUM(successes)")
+
+@dataclass
+class RollRecord:
+    guild_id: int
+    user_id: int
+    kind: str
+    expr: str
+    times: int
+    n_dice: int
+    luck_sum: float
+    crits: int = 0
+    fumbles: int = 0
+    checks: int = 0
+    successes: int = 0
+    first_total: Optional[int] = None
+    ts: int = 0
+
+@dataclass
+class RollStats:
+    commands: int = 0
+    rolls: int = 0
+    n_dice: int = 0
+    luck_sum: float = 0.0
+    crits: int = 0
+    fumbles: int = 0
+    checks: int = 0
+    successes: int = 0
+    user_id: int = 0
+
+    @property
+    def luck(self) -> float:
+        """平均正規化點數，0.5 為期望值；越高越幸運。"""
+        return self.luck_sum / self.n_dice if self.n_dice else 0.5
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.successes / self.checks if self.checks else None
+
+    @classmethod
+    def from_row(cls, row, user_id: int = 0) -> "RollStats":
+        if row is None or row[0] is None:
+            return cls(user_id=user_id)
+        return cls(*row[:8], user_id=user_id)
+
+class RollHistory:
+    """只增不改的擲骰紀錄（SQLite WAL）。record() 只是放進佇列，由背景任務批次寫入，指令不等磁碟。"""
+
+    def __init__(self, path: str = "data/history.sqlite3", *, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_pending: int = 50_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[RollRecord] = asyncio.Queue(maxsize=max_pending)
+        self._task: asyncio.Task | None = None
+        self._batch: List[RollRecord] = []      # 寫入器已從佇列取出、尚未寫入的紀錄
+        self._writing = False                   # 寫入器正在執行緒中寫入（此時不能取消，否則會重寫或遺失）
+        self._closing = False
+        self._closed = False
+        self._lock = threading.Lock()   # 寫入執行緒與查詢執行緒共用同一連線
+        self.dropped = 0
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    # ---------- 寫入 ----------
+    def record(self, rec: RollRecord):
+        if not rec.ts:
+            rec.ts = int(time.time())
+        try:
+            self._queue.put_nowait(rec)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        if self._task is None:
+            # 所有伺服器共用的寫入器：不沿用呼叫端的 context（LOG_GUILD）
+            self._task = asyncio.get_running_loop().create_task(self._writer(), context=contextvars.Context())
+
+    async def close(self):
+        if self._closed:
+            return
+        if self._task is not None:
+            # 正在寫入時等它寫完自行結束；還在收集時取消，已取出的那批由下面一併寫入
+            self._closing = True
+            if not self._writing:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 把剩下的寫完
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await asyncio.to_thread(self._write_batch, batch)
+        self._close_db()
+
+    def close_sync(self):
+        """事件迴圈已結束後使用：寫完佇列中剩下的紀錄並關閉資料庫（已 close 過則不做事）。"""
+        if self._closed:
+            return
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"寫入擲骰紀錄失敗（{len(batch)} 筆）：{e}")
+        self._close_db()
+
+    def _close_db(self):
+        self._closed = True
+        with self._lock:
+            self._db.close()
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            self._writing = True
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"寫入擲骰紀錄失敗（{len(batch)} 筆）：{e}")
+            finally:
+                self._writing = False
+                self._batch = []
+
+    def _write_batch(self, batch: List[RollRecord]):
+        rows = [(r.ts, r.guild_id, r.user_id, r.kind, r.expr, r.times, r.n_dice, r.luck_sum,
+                 r.crits, r.fumbles, r.checks, r.successes, r.first_total) for r in batch]
+        # 同一批先在記憶體合併成 (guild, day, user) 一列，減少 upsert 次數
+        agg: dict[tuple, list] = {}
+        for r in batch:
+            key = (r.guild_id, r.ts // DAY, r.user_id)
+            a = agg.get(key)
+            if a is None:
+                agg[key] = [1, r.times, r.n_dice, r.luck_sum, r.crits, r.fumbles, r.checks, r.successes]
+            else:
+                for i, v in enumerate((1, r.times, r.n_dice, r.luck_sum, r.crits, r.fumbles, r.checks, r.successes)):
+                    a[i] += v
+        daily = [(*k, *v) for k, v in agg.items()]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO rolls (ts, guild_id, user_id, kind, expr, times, n_dice, luck_sum, "
+                "crits, fumbles, checks, successes, first_total) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                rows,
+            )
+            self._db.executemany(_UPSERT_DAILY, daily)
+
+    # ---------- 查詢（皆走 daily 彙總表的索引） ----------
+    def _query(self, sql: str, args: tuple):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _since_day(since: Optional[int]) -> int:
+        return since // DAY if since else 0
+
+    def user_stats(self, user_id: int, guild_id: Optional[int] = None, since: Optional[int] = None) -> RollStats:
+        sql = f"SELECT {_AGG} FROM daily WHERE user_id = ? AND day >= ?"
+        args: tuple = (user_id, self._since_day(since))
+        if guild_id is not None:
+            sql += " AND guild_id = ?"
+            args += (guild_id,)
+        return RollStats.from_row(self._query(sql, args)[0], user_id)
+
+    def guild_stats(self, guild_id: int, since: Optional[int] = None) -> RollStats:
+        rows = self._query(f"SELECT {_AGG} FROM daily WHERE guild_id = ? AND day >= ?",
+                           (guild_id, self._since_day(since)))
+        return RollStats.from_row(rows[0])
+
+    def luckiest(self, guild_id: int, since: Optional[int] = None, *,
+                 min_dice: int = 20, limit: int = 5) -> List[RollStats]:
+        rows = self._query(
+            f"SELECT user_id, {_AGG} FROM daily WHERE guild_id = ? AND day >= ? "
+            "GROUP BY user_id HAVING SUM(n_dice) >= ? "
+            "ORDER BY SUM(luck_sum) / SUM(n_dice) DESC LIMIT ?",
+            (guild_id, self._since_day(since), min_dice, limit),
+        )
+        return [RollStats.from_row(r[1:], r[0]) for r in rows]
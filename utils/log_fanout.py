@@ -0,0 +1,270 @@
+# utils/log_fanout.py
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from dataclasses import dataclass
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("trpg_bot")
+
+LOG_HISTORY = 2000  # 共用環狀緩衝保留的行數；目的地落後超過這麼多行時，最舊的部分會被跳過
+
+Record = Tuple[int, int, str]       # (levelno, guild_id, 已格式化的訊息)
+Accept = Callable[[Hashable, int, int], bool]   # (目的地, guild_id, levelno) → 是否送到該目的地
+Route = Callable[[Hashable], Optional[int]]     # 目的地 → 只收哪個 guild_id 的紀錄（None：全部）
+
+class SharedLog:
+    """只附加的共用環狀緩衝；每個訂閱者各自持有讀取位置（Cursor），紀錄本身只存一份。
+
+    位置是單調遞增的序號，第 seq 行放在 seq % capacity；序號小於 head - capacity 的已被覆寫。
+    append 時依紀錄的 guild_id 分流：有人訂閱的伺服器另記一份序號索引，並只喚醒該伺服器與
+    讀取全部紀錄的訂閱者，每行的成本不隨伺服器數量增加。只在事件迴圈中使用。
+    """
+
+    def __init__(self, capacity: int = LOG_HISTORY, *, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.head = 0                   # 下一行的序號
+        self._recs: List[Optional[Record]] = [None] * capacity
+        self._times: List[float] = [0.0] * capacity
+        self._index: Dict[int, Deque[int]] = {}     # guild_id → 該伺服器未讀紀錄的序號（只記有人訂閱的）
+        self._lost: Dict[int, int] = {}             # guild_id → append 時清掉的已覆寫序號數（由 Cursor 取走計數）
+        self._changed: Dict[Optional[int], asyncio.Future] = {}    # None：等任何紀錄的訂閱者
+        self._clock = clock
+
+    @property
+    def tail(self) -> int:
+        """仍保留的最舊序號。"""
+        return max(0, self.head - self.capacity)
+
+    def watch(self, guild_id: int) -> Deque[int]:
+        return self._index.setdefault(guild_id, deque())
+
+    def unwatch(self, guild_id: int):
+        self._index.pop(guild_id, None)
+        self._lost.pop(guild_id, None)
+
+    def take_lost(self, guild_id: int) -> int:
+        return self._lost.pop(guild_id, 0)
+
+    def append(self, rec: Record):
+        seq = self.head
+        i = seq % self.capacity
+        self._recs[i] = rec
+        self._times[i] = self._clock()
+        self.head += 1
+        guild_id = rec[1]
+        idx = self._index.get(guild_id)
+        if idx is not None:
+            idx.append(seq)
+            # 讀取端落後時，索引長度維持在 capacity 以內
+            tail = self.tail
+            if idx[0] < tail:
+                n = 0
+                while idx[0] < tail:
+                    idx.popleft()
+                    n += 1
+                self._lost[guild_id] = self._lost.get(guild_id, 0) + n
+        if self._changed:
+            # 只喚醒與這行有關的等待者；沒有人在等時不做任何事
+            self._wake(None)
+            if idx is not None:
+                self._wake(guild_id)
+
+    def _wake(self, key: Optional[int]):
+        fut = self._changed.pop(key, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    def time_of(self, seq: int) -> float:
+        return self._times[seq % self.capacity]
+
+    def get(self, seq: int) -> Record:
+        return self._recs[seq % self.capacity]
+
+    def slice(self, start: int, end: int) -> List[Record]:
+        if end == start:
+            return []
+        cap = self.capacity
+        a, b = start % cap, end % cap
+        if a < b:
+            return self._recs[a:b]
+        return self._recs[a:] + self._recs[:b]
+
+    async def wait(self, guild_id: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """等到下一筆 guild_id 的紀錄（None：任何紀錄）；逾時回傳 False。"""
+        fut = self._changed.get(guild_id)
+        if fut is None:
+            fut = self._changed[guild_id] = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+@dataclass
+class CursorStats:
+    delivered: int = 0      # 已讀出（且屬於這個目的地）的行數
+    dropped: int = 0        # 落後太多、被覆寫而跳過的紀錄數
+    max_lag: float = 0.0    # 曾經出現過的最大延遲（秒）
+
+class Cursor:
+    """單一目的地在 SharedLog 上的讀取位置；讀出時只留下 accept 接受的紀錄。
+
+    guild_id 為 None 時讀全部紀錄；否則只走該伺服器的序號索引，不碰其他伺服器的紀錄。
+    同一個 guild_id 只能有一個 Cursor（索引在讀出時消耗）。
+    """
+
+    def __init__(self, log: SharedLog, key: Hashable = None, accept: Optional[Accept] = None,
+                 guild_id: Optional[int] = None):
+        self.log = log
+        self.key = key
+        self.accept = accept
+        self.guild_id = guild_id
+        self._index = log.watch(guild_id) if guild_id is not None else None
+        self.pos = log.head     # 只讀訂閱之後的新紀錄
+        self.stats = CursorStats()
+
+    def close(self):
+        if self.guild_id is not None:
+            self.log.unwatch(self.guild_id)
+
+    def _trim(self):
+        """丟掉已被覆寫的未讀行並計數。"""
+        log = self.log
+        if self._index is None:
+            if self.pos < log.tail:
+                self.stats.dropped += log.tail - self.pos
+                self.pos = log.tail
+            return
+        idx, tail = self._index, log.tail
+        self.stats.dropped += log.take_lost(self.guild_id)
+        while idx and idx[0] < tail:
+            idx.popleft()
+            self.stats.dropped += 1
+
+    def __len__(self) -> int:
+        self._trim()
+        if self._index is None:
+            return self.log.head - self.pos
+        return len(self._index)
+
+    def _oldest(self) -> int:
+        return self.pos if self._index is None else self._index[0]
+
+    def lag(self) -> float:
+        """最舊一行未讀的行已經等了幾秒。"""
+        if not len(self):
+            return 0.0
+        return self.log._clock() - self.log.time_of(self._oldest())
+
+    def _take(self) -> List[str]:
+        lag = self.lag()    # 順便 _trim
+        if lag > self.stats.max_lag:
+            self.stats.max_lag = lag
+        log = self.log
+        if self._index is None:
+            recs = log.slice(self.pos, log.head)
+            self.pos = log.head
+        else:
+            recs = [log.get(seq) for seq in self._index]
+            self._index.clear()
+        accept, key = self.accept, self.key
+        if accept is None:
+            lines = [msg for _, _, msg in recs]
+        else:
+            lines = [msg for level, guild_id, msg in recs if accept(key, guild_id, level)]
+        self.stats.delivered += len(lines)
+        return lines
+
+    async def get_all(self) -> List[str]:
+        """等到至少有一行屬於這個目的地，取出全部未讀的行。"""
+        while True:
+            while not len(self):
+                await self.log.wait(self.guild_id)
+            lines = self._take()
+            if lines:
+                return lines
+
+    async def get_more(self, timeout: float) -> List[str]:
+        """最多等 timeout 秒；逾時回傳空串列。"""
+        deadline = self.log._clock() + timeout
+        while True:
+            lines = self._take()
+            if lines:
+                return lines
+            left = deadline - self.log._clock()
+            if left <= 0 or not await self.log.wait(self.guild_id, left):
+                return []
+
+Worker = Callable[[Hashable, Cursor], Awaitable[None]]
+
+class LogFanout:
+    """每筆紀錄只寫入共用緩衝一次，每個目的地一個 worker 以自己的 Cursor 按自己的速度讀取。
+
+    publish() 不等待任何 I/O；慢的或被限速的頻道只會讓自己的 Cursor 落後（落後超過 LOG_HISTORY
+    行時跳過最舊的部分並計數），不會拖慢其他目的地。retain() 決定目前有哪些目的地。
+    route 把目的地對應到它的伺服器，publish 時就分流，worker 只被自己伺服器的紀錄喚醒。
+    """
+
+    def __init__(self, worker: Worker, capacity: int = LOG_HISTORY, accept: Optional[Accept] = None,
+                 route: Optional[Route] = None):
+        self._worker = worker
+        self._accept = accept
+        self._route = route
+        self.log = SharedLog(capacity)
+        self._cursors: Dict[Hashable, Cursor] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def cursor(self, key: Hashable) -> Optional[Cursor]:
+        return self._cursors.get(key)
+
+    def items(self) -> Iterable[Tuple[Hashable, Cursor]]:
+        return self._cursors.items()
+
+    def publish(self, rec: Record):
+        self.log.append(rec)
+
+    def retain(self, keys: Iterable[Hashable]):
+        """目的地集合改為 keys：新的開始訂閱，不在其中的停止。"""
+        keep = set(keys)
+        for key in [k for k in self._cursors if k not in keep]:
+            task = self._tasks.pop(key, None)
+            if task is not None:
+                task.cancel()
+            self._cursors.pop(key).close()
+        for key in keep:
+            if key not in self._cursors:
+                guild_id = self._route(key) if self._route is not None else None
+                cur = self._cursors[key] = Cursor(self.log, key, self._accept, guild_id)
+                self._tasks[key] = asyncio.get_running_loop().create_task(
+                    self._run(key, cur), context=contextvars.Context())
+
+    async def _run(self, key: Hashable, cur: Cursor):
+        try:
+            while True:
+                try:
+                    await self._worker(key, cur)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # 單一目的地出錯不影響其他目的地；稍候重啟它的 worker
+                    logger.debug(f"日誌目的地 {key} 的 worker 失敗：{e}")
+                    await asyncio.sleep(0.5)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        for cur in self._cursors.values():
+            cur.close()
+        self._cursors.clear()
@@ -1,43 +1,335 @@
 # utils/logging_config.py
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
 from pathlib import Path
 import asyncio
+import atexit
+import bz2
 import gzip
+import lzma
 import os
+import queue
 import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
-LOG_QUEUE: asyncio.Queue[str] = asyncio.Queue()
+from utils.config import LogQueueSettings, StreamSettings
+
+# 目前這段程式是替哪個伺服器工作（0 = 不屬於任何伺服器）；指令執行前設定，
+# 同一個 task 裡（以及它建立的 task）記錄的日誌都會帶上它
+LOG_GUILD: ContextVar[int] = ContextVar("log_guild", default=0)
+
+LogRecordTuple = Tuple[int, int, str]     # (levelno, guild_id, 已格式化的訊息)
+
+def to_level(name: str) -> int:
+    name = (name or "").upper()
+    return getattr(logging, name, logging.INFO)
+
+class LogRoutes:
+    """日誌串流的訂閱表：目的地（guild_id；0 為全域）→ 它的 StreamSettings（含最低等級）。
+
+    由事件迴圈整份替換，handler 可在任何執行緒讀取；StreamSettings 是設定中的同一個物件，
+    修改最低等級（含熱重載）不必重建。
+    """
+
+    def __init__(self):
+        self._dests: Dict[int, StreamSettings] = {}
+
+    def update(self, dests: Dict[int, StreamSettings]):
+        self._dests = dict(dests)
+
+    def accepts(self, dest: int, guild_id: int, level: int) -> bool:
+        """dest 是否要收這筆紀錄：全域收所有伺服器的，伺服器只收自己的。"""
+        if dest and dest != guild_id:
+            return False
+        s = self._dests.get(dest)
+        return s is not None and level >= to_level(s.min_level)
+
+    def wants(self, guild_id: int, level: int) -> bool:
+        """有沒有任何目的地要這筆紀錄；沒有就不必格式化。"""
+        return self.accepts(0, guild_id, level) or (guild_id != 0 and self.accepts(guild_id, guild_id, level))
+
+LOG_ROUTES = LogRoutes()
+
+@dataclass
+class LogRingStats:
+    enqueued: int = 0
+    dropped: int = 0
+    max_depth: int = 0
+
+class LogRing:
+    """logging → Discord 串流的有界交接緩衝。
+
+    put() 可在任何執行緒呼叫（logging 不保證在事件迴圈裡）；只有消費端正在等待時，
+    才用 call_soon_threadsafe 喚醒它。滿載時依 settings.policy 丟棄並計數，記憶體不會無限成長。
+    settings 直接參照全域設定中的物件，修改（含熱重載）下一行就生效。
+    """
+
+    def __init__(self, settings: Optional[LogQueueSettings] = None):
+        self.settings = settings or LogQueueSettings()
+        self.stats = LogRingStats()
+        self._buf: Deque[LogRecordTuple] = deque()
+        self._levels: Counter = Counter()               # levelno → 緩衝中的行數（lowest 策略用）
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._sampled = 0
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def _evict_oldest(self):
+        level = self._buf.popleft()[0]
+        self._levels[level] -= 1
+
+    def _make_room(self, level: int) -> bool:
+        """緩衝已滿；依策略騰出一格，回傳 False 表示改丟棄新進的這一行。"""
+        s = self.settings
+        if s.policy == "lowest":
+            lowest = min(lv for lv, n in self._levels.items() if n > 0)
+            if lowest > level:
+                return False
+            for i, rec in enumerate(self._buf):
+                lv = rec[0]
+                if lv == lowest:
+                    del self._buf[i]
+                    self._levels[lv] -= 1
+                    return True
+        if s.policy == "sample":
+            self._sampled += 1
+            if self._sampled % max(2, s.sample_every):
+                return False
+        self._evict_oldest()
+        return True
+
+    def put(self, level: int, guild_id: int, msg: str):
+        waiter = None
+        with self._lock:
+            cap = max(1, self.settings.capacity)
+            while len(self._buf) > cap:         # 容量被調小
+                self._evict_oldest()
+                self.stats.dropped += 1
+            if len(self._buf) >= cap:
+                self.stats.dropped += 1
+                if not self._make_room(level):
+                    return
+            self._buf.append((level, guild_id, msg))
+            self._levels[level] += 1
+            self.stats.enqueued += 1
+            if len(self._buf) > self.stats.max_depth:
+                self.stats.max_depth = len(self._buf)
+            if self._waiter is not None:
+                waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            if threading.get_ident() == self._loop_thread:
+                self._loop.call_soon(self._wake, waiter)
+            else:
+                self._loop.call_soon_threadsafe(self._wake, waiter)
+
+    @staticmethod
+    def _wake(waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def get_nowait(self) -> Optional[LogRecordTuple]:
+        with self._lock:
+            if not self._buf:
+                return None
+            rec = self._buf.popleft()
+            self._levels[rec[0]] -= 1
+            return rec
+
+    async def get(self) -> LogRecordTuple:
+        """取出下一行（只能由事件迴圈中的單一消費者呼叫）。"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+        while True:
+            with self._lock:
+                if self._buf:
+                    rec = self._buf.popleft()
+                    self._levels[rec[0]] -= 1
+                    return rec
+                waiter = self._waiter = self._loop.create_future()
+            await waiter
+
+LOG_RING = LogRing()
 
 class DiscordQueueHandler(logging.Handler):
     def emit(self, record: logging.LogRecord):
         try:
+            # 經過 QueueHandler 時，伺服器標記已在產生紀錄的 task 裡取好（見 _AppendQueueHandler）
+            guild_id = getattr(record, "log_guild", None)
+            if guild_id is None:
+                guild_id = LOG_GUILD.get()
+            # 沒有任何串流目的地要的紀錄在格式化之前就丟掉
+            if not LOG_ROUTES.wants(guild_id, record.levelno):
+                return
             msg = self.format(record)
-            LOG_QUEUE.put_nowait(msg)
+            LOG_RING.put(record.levelno, guild_id, msg)
         except Exception:
             pass
 
-def _gzip_rotator(source: str, dest: str):
-    """把旋轉出的檔案壓成 .gz（dest 可能是預設名，這裡統一加 .gz）"""
-    # 例：source=logs/latest.log.2025-08-13 → 轉成 logs/2025-08-13.log.gz
-    base = Path(source).name  # latest.log.YYYY-MM-DD
-    try:
-        date_str = base.split(".")[-1]  # YYYY-MM-DD
-        out = Path(source).with_name(f"{date_str}.log.gz")
-    except Exception:
-        out = Path(dest).with_suffix(".gz")
-
-    with open(source, "rb") as f_in, gzip.open(out, "wb") as f_out:
-        shutil.copyfileobj(f_in, f_out)
-    os.remove(source)
-
-def _namer(default_name: str):
-    # 讓旋轉暫存名長成 logs/latest.log.YYYY-MM-DD（之後 rotator 會把它壓成 YYYY-MM-DD.log.gz）
-    return default_name
-
-def setup_logging():
-    Path("logs").mkdir(exist_ok=True)
+# ---------- 非同步寫出：QueueHandler → 背景執行緒 ----------
+LOG_BATCH = 256     # 背景執行緒一次最多取出幾筆後才 flush
+
+class _AppendQueueHandler(QueueHandler):
+    """emit 只把紀錄放進佇列；格式化與所有 I/O 都在背景執行緒。
+
+    本專案的日誌幾乎都用 f-string，訊息在呼叫時就已固定，所以不像預設的 prepare() 那樣先格式化；
+    只記下產生紀錄時的伺服器標記（contextvar 在別的執行緒讀不到），
+    以及例外的 traceback 文字（frame 之後可能改變）。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.log_guild = LOG_GUILD.get()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class _BatchFlush:
+    """在背景執行緒中使用的 handler：每筆只寫進緩衝，整批寫完才 flush 一次。"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+class _BatchFileHandler(_BatchFlush, TimedRotatingFileHandler):
+    pass
+
+class _BatchStreamHandler(_BatchFlush, logging.StreamHandler):
+    pass
+
+_STOP = object()
+
+class _BatchListener:
+    """從佇列取出紀錄交給各 handler；一次取完佇列中現有的（最多 LOG_BATCH 筆）再統一 flush。"""
+
+    def __init__(self, q: "queue.SimpleQueue", handlers: List[logging.Handler]):
+        self.queue = q
+        self.handlers = handlers
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < LOG_BATCH:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is _STOP:
+                    stop = True
+                    continue
+                for h in self.handlers:
+                    if record.levelno >= h.level:
+                        h.handle(record)
+            for h in self.handlers:
+                if isinstance(h, _BatchFlush):
+                    h.flush_batch()
+            if stop:
+                return
+
+    def stop(self):
+        """寫完佇列中剩下的紀錄後結束（程式結束時由 atexit 呼叫）。"""
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+# ---------- 旋轉後的壓縮 ----------
+# codec → (副檔名, 開檔函式)；等級：gzip/bz2 為 1–9，xz 為 preset 0–9
+_CODECS: Dict[str, Tuple[str, Callable[..., Any]]] = {
+    "gzip": (".gz", lambda path, level: gzip.open(path, "wb", compresslevel=level)),
+    "bz2": (".bz2", lambda path, level: bz2.open(path, "wb", compresslevel=level)),
+    "xz": (".xz", lambda path, level: lzma.open(path, "wb", preset=level)),
+}
+LOG_KEEP = 30       # 保留最近幾份壓縮檔
+
+class _Archiver:
+    """旋轉時只 rename（在寫出執行緒上、很快），壓縮與清除舊檔交給另一條背景執行緒。"""
+
+    def __init__(self, codec: str, level: int, keep: int = LOG_KEEP):
+        if codec != "none" and codec not in _CODECS:
+            raise ValueError("LOG_COMPRESS 必須是 gzip / bz2 / xz / none")
+        self.codec = codec
+        self.level = level
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-archive")
+
+    def rotator(self, source: str, dest: str):
+        # source=logs/latest.log，dest=logs/latest.log.YYYY-MM-DD
+        os.replace(source, dest)
+        self._pool.submit(self._archive, Path(dest))
+
+    def resume(self, log_dir: Path, base: str):
+        """上次結束前還沒壓縮完的檔案（latest.log.YYYY-MM-DD）補做。"""
+        for p in sorted(log_dir.glob(f"{base}.*")):
+            if p.suffix not in (".gz", ".bz2", ".xz"):
+                self._pool.submit(self._archive, p)
+
+    def _archive(self, path: Path):
+        try:
+            date_str = path.name.rsplit(".", 1)[-1]     # YYYY-MM-DD
+            if self.codec == "none":
+                os.replace(path, path.with_name(f"{date_str}.log"))
+            else:
+                ext, open_out = _CODECS[self.codec]
+                out = path.with_name(f"{date_str}.log{ext}")
+                tmp = out.with_name(out.name + ".tmp")
+                with open(path, "rb") as f_in, open_out(tmp, self.level) as f_out:
+                    shutil.copyfileobj(f_in, f_out, 1 << 20)
+                os.replace(tmp, out)
+                os.remove(path)
+            self._prune(path.parent)
+        except Exception as e:
+            # 這裡不能用 logging（可能正卡在寫出執行緒的旋轉中）
+            print(f"日誌壓縮失敗（{path}）：{e}", file=sys.stderr)
+
+    def _prune(self, log_dir: Path):
+        """不論壓縮設定（含 none、或中途換過 codec），只保留最近 keep 天的舊日誌。"""
+        if not self.keep:
+            return
+        archives = sorted(p for p in log_dir.glob("????-??-??.log*") if not p.name.endswith(".tmp"))
+        for old in archives[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+_shutdown_hook: Optional[Callable[[], None]] = None
+
+def shutdown_logging():
+    """寫完佇列中的紀錄、等背景壓縮完成。程式結束時由 atexit 呼叫；os.execv 不會執行 atexit，重啟前要自行呼叫。"""
+    global _shutdown_hook
+    hook, _shutdown_hook = _shutdown_hook, None
+    if hook is not None:
+        hook()
+
+def setup_logging(codec: Optional[str] = None, level: Optional[int] = None):
+    """所有輸出（檔案、終端、Discord 串流）都在背景執行緒；logger.info 在事件迴圈上只是一次佇列附加。
+
+    codec / level 未指定時讀環境變數 LOG_COMPRESS（預設 gzip）與 LOG_COMPRESS_LEVEL（預設 6）。
+    """
+    log_dir = Path("logs")
+    log_dir.mkdir(exist_ok=True)
     formatter = logging.Formatter(
         fmt="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
@@ -46,30 +338,40 @@ def setup_logging():
     root = logging.getLogger()
     root.setLevel(logging.INFO)
 
-    # 檔案：latest.log（午夜輪替，保留 30 份，歷史自動 .gz）
-    fh = TimedRotatingFileHandler(
-        "logs/latest.log",
+    archiver = _Archiver(codec or os.getenv("LOG_COMPRESS", "gzip"),
+                         int(level if level is not None else os.getenv("LOG_COMPRESS_LEVEL", "6")))
+    archiver.resume(log_dir, "latest.log")
+
+    # 檔案：latest.log（午夜輪替；舊檔在背景壓成 YYYY-MM-DD.log.gz，保留 LOG_KEEP 份）
+    fh = _BatchFileHandler(
+        str(log_dir / "latest.log"),
         when="midnight",
-        backupCount=30,
         encoding="utf-8",
         utc=False,
     )
-    # 預設命名：logs/latest.log.YYYY-MM-DD，後由 rotator 壓成 logs/YYYY-MM-DD.log.gz
-    fh.namer = _namer
-    fh.rotator = _gzip_rotator
+    fh.rotator = archiver.rotator
     fh.setFormatter(formatter)
-    root.addHandler(fh)
 
     # 終端
-    sh = logging.StreamHandler()
+    sh = _BatchStreamHandler()
     sh.setFormatter(formatter)
-    root.addHandler(sh)
 
-    # 丟到 Discord Queue（INFO 以上）
+    # Discord 串流；等級由各目的地的 min_level 決定（見 LogRoutes）
     qh = DiscordQueueHandler()
     qh.setFormatter(formatter)
-    qh.setLevel(logging.INFO)
-    root.addHandler(qh)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    listener = _BatchListener(q, [fh, sh, qh])
+    listener.start()
+    root.addHandler(_AppendQueueHandler(q))
+
+    global _shutdown_hook
+    def _shutdown():
+        listener.stop()
+        fh.close()
+        archiver.shutdown()
+    _shutdown_hook = _shutdown
+    atexit.register(shutdown_logging)
 
     # 開機時打一行，方便看分隔
     root.info("==== Bot started at %s ====", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
@@ -0,0 +1,215 @@
+# utils/outbound.py
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional
+
+logger = logging.getLogger("trpg_bot")
+
+class Priority(IntEnum):
+    REPLY = 0       # 玩家指令的回覆
+    REPORT = 1      # 大成功/大失敗上報
+    LOG = 2         # 日誌串流
+
+MAX_LOG_PENDING = 50    # 單一頻道排隊中的 LOG 工作上限，超過就丟棄新的
+REPLY_RESERVE = 1       # bucket 只剩這麼多額度時，LOG 先等重置，留給玩家回覆
+LANE_IDLE = 60.0        # 頻道佇列閒置多久後結束背景任務
+SAFETY = 0.05           # 重置時間外加的緩衝（秒）
+
+# 送出、編輯訊息的路由：Discord 以 channel_id 為主要參數，每個頻道各自一個 bucket
+_CHANNEL_PATH = re.compile(r"/channels/(\d+)/messages")
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    call: Callable[[], Awaitable[Any]] = field(compare=False)
+    key: Optional[Hashable] = field(default=None, compare=False)
+    future: Optional[asyncio.Future] = field(default=None, compare=False)
+
+class _Lane:
+    def __init__(self):
+        self.heap: List[_Job] = []
+        self.keyed: Dict[Hashable, _Job] = {}
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.log_pending = 0
+        self.remaining: Optional[int] = None    # 最近一次回應標頭的剩餘額度；None = 未知
+        self.reset_at = 0.0                     # monotonic；額度重置時間
+
+@dataclass
+class OutboundStats:
+    sent: int = 0
+    failed: int = 0
+    coalesced: int = 0      # 被較新的編輯取代而未送出
+    dropped: int = 0        # LOG 佇列已滿而丟棄
+    rate_limited: int = 0   # 收到的 429 次數
+    paced: float = 0.0      # 主動配速等待的總秒數
+
+class OutboundScheduler:
+    """所有送往 Discord 的訊息/編輯都從這裡排隊。
+
+    - 每個頻道一條佇列，依優先序送出：玩家回覆 > 上報 > 日誌
+    - 帶 key 的工作（通常是同一則訊息的編輯）尚未送出時，新的會直接取代舊的
+    - 依回應標頭（X-RateLimit-Remaining / Reset-After、429 的 Retry-After）配速，
+      在撞上 429 之前先等；額度快用完時日誌讓路給玩家回覆
+
+    送出本身由呼叫端提供的 call() 完成，標頭則透過 observe() 回報，
+    因此可以用假的 HTTP 端點驗證行為（見 bench/sim_outbound.py）。
+    """
+
+    def __init__(self, *, clock: Callable[[], float] = time.monotonic):
+        self._lanes: Dict[int, _Lane] = {}
+        self._seq = itertools.count()
+        self._global_reset_at = 0.0
+        self._clock = clock
+        self.stats = OutboundStats()
+
+    # ---------- 提交 ----------
+    def submit(self, channel_id: int, call: Callable[[], Awaitable[Any]], *,
+               priority: Priority = Priority.REPLY, key: Optional[Hashable] = None) -> asyncio.Future:
+        """排入 call()，回傳其結果的 Future。"""
+        loop = asyncio.get_running_loop()
+        lane = self._lanes.get(channel_id)
+        if lane is None:
+            lane = self._lanes[channel_id] = _Lane()
+
+        if key is not None:
+            job = lane.keyed.get(key)
+            if job is not None:
+                job.call = call
+                self.stats.coalesced += 1
+                return job.future
+
+        if priority >= Priority.LOG and lane.log_pending >= MAX_LOG_PENDING:
+            self.stats.dropped += 1
+            fut = loop.create_future()
+            fut.set_result(None)
+            return fut
+
+        job = _Job(int(priority), next(self._seq), call, key, loop.create_future())
+        heapq.heappush(lane.heap, job)
+        if key is not None:
+            lane.keyed[key] = job
+        if priority >= Priority.LOG:
+            lane.log_pending += 1
+        lane.wake.set()
+        if lane.task is None:
+            # 頻道佇列會處理之後所有呼叫者的工作：不沿用第一個呼叫者的 context（LOG_GUILD）
+            lane.task = loop.create_task(self._run(channel_id, lane), context=contextvars.Context())
+        return job.future
+
+    def fire(self, channel_id: int, call: Callable[[], Awaitable[Any]], *,
+             priority: Priority = Priority.LOG, key: Optional[Hashable] = None,
+             on_error: Optional[Callable[[BaseException], None]] = None):
+        """不等結果的 submit；失敗交給 on_error（預設只記 debug）。"""
+        def _done(fut: asyncio.Future):
+            if fut.cancelled():
+                return
+            e = fut.exception()
+            if e is not None:
+                (on_error or (lambda e: logger.debug(f"送出失敗（{channel_id}）：{e}")))(e)
+        self.submit(channel_id, call, priority=priority, key=key).add_done_callback(_done)
+
+    # ---------- 回應標頭 ----------
+    def observe(self, channel_id: int, status: int, headers: Mapping[str, str]):
+        lane = self._lanes.get(channel_id)
+        now = self._clock()
+        if status == 429:
+            self.stats.rate_limited += 1
+            retry = float(headers.get("Retry-After") or headers.get("X-RateLimit-Reset-After") or 1.0)
+            if headers.get("X-RateLimit-Global") or headers.get("X-RateLimit-Scope") == "global":
+                self._global_reset_at = max(self._global_reset_at, now + retry + SAFETY)
+            elif lane is not None:
+                lane.remaining = 0
+                lane.reset_at = now + retry + SAFETY
+            return
+        if lane is None:
+            return
+        remaining, reset_after = headers.get("X-RateLimit-Remaining"), headers.get("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None:
+            lane.remaining = int(remaining)
+            lane.reset_at = now + float(reset_after) + SAFETY
+
+    def trace_config(self):
+        """給 commands.Bot(http_trace=...) 的 aiohttp TraceConfig：把訊息路由的回應標頭餵給 observe()。"""
+        import aiohttp
+
+        async def on_request_end(session, ctx, params):
+            m = _CHANNEL_PATH.search(params.url.path)
+            if m:
+                self.observe(int(m.group(1)), params.response.status, params.response.headers)
+
+        tc = aiohttp.TraceConfig()
+        tc.on_request_end.append(on_request_end)
+        return tc
+
+    # ---------- 每頻道的送出迴圈 ----------
+    def _wait_for(self, lane: _Lane, job: _Job, now: float) -> float:
+        wait = self._global_reset_at - now
+        if lane.remaining is not None:
+            if now >= lane.reset_at:
+                lane.remaining = None
+            elif lane.remaining <= 0 or (job.priority >= Priority.LOG and lane.remaining <= REPLY_RESERVE):
+                wait = max(wait, lane.reset_at - now)
+        return wait
+
+    async def _run(self, channel_id: int, lane: _Lane):
+        try:
+            while True:
+                if not lane.heap:
+                    lane.wake.clear()
+                    try:
+                        await asyncio.wait_for(lane.wake.wait(), LANE_IDLE)
+                    except asyncio.TimeoutError:
+                        if not lane.heap:
+                            break
+                    continue
+
+                wait = self._wait_for(lane, lane.heap[0], self._clock())
+                if wait > 0:
+                    # 等待期間可能有更高優先的工作進來，醒來後重新挑
+                    self.stats.paced += wait
+                    lane.wake.clear()
+                    try:
+                        await asyncio.wait_for(lane.wake.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                job = heapq.heappop(lane.heap)
+                if job.key is not None:
+                    lane.keyed.pop(job.key, None)
+                if job.priority >= Priority.LOG:
+                    lane.log_pending -= 1
+                if job.future.done():       # 呼叫端已取消
+                    continue
+                if lane.remaining is not None:
+                    lane.remaining -= 1     # 回應標頭到達前先預扣
+                try:
+                    res = await job.call()
+                except Exception as e:
+                    self.stats.failed += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    self.stats.sent += 1
+                    if not job.future.done():
+                        job.future.set_result(res)
+        finally:
+            if self._lanes.get(channel_id) is lane:
+                del self._lanes[channel_id]
+            for job in lane.heap:
+                job.future.cancel()
+
+    def pending(self) -> Dict[int, int]:
+        """各頻道排隊中的工作數。"""
+        return {cid: len(lane.heap) for cid, lane in self._lanes.items() if lane.heap}
@@ -0,0 +1,151 @@
+# utils/persist.py
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import os
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("trpg_bot")
+
+WRITE_DELAY = 0.5   # 秒；這段時間內的連續修改合併成一次寫入
+RETRY_MAX = 30.0    # 秒；寫入失敗後重試的間隔上限（每次失敗加倍）
+
+def atomic_write_text(path: Path, text: str):
+    """寫到同目錄的暫存檔、fsync 後 rename 取代；中途當機只會留下舊檔或新檔。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # rename 本身也要落盤（POSIX；Windows 無法開啟目錄，略過）
+    try:
+        dfd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dfd)
+
+Items = List[Tuple[Hashable, Dict[str, Any]]]
+Sink = Callable[[Items], List[Tuple[Hashable, Exception]]]
+
+class WriteBehind:
+    """設定的延遲寫入：setter 只標記 dirty，由背景任務合併後在執行緒中交給 sink 批次寫入。
+
+    沒有執行中的事件迴圈時（啟動階段、腳本）直接同步寫入。
+    尚未寫出的物件可用 pending() 取回，被快取淘汰後再讀取時不會讀到舊檔。
+    """
+
+    def __init__(self, sink: Sink, encode: Callable[[Any], Dict[str, Any]] = asdict, delay: float = WRITE_DELAY):
+        self.sink = sink
+        self.encode = encode
+        self.delay = delay
+        self._dirty: Dict[Hashable, Any] = {}
+        self._inflight: Dict[Hashable, Any] = {}    # 已取快照、正在寫入
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None   # 讓各批寫入依序完成，同一檔案不會新舊顛倒
+        self._retry = 0.0                           # 目前的重試間隔；0 表示上一批沒有失敗
+        self.writes = 0
+        self.coalesced = 0
+
+    def mark(self, key: Hashable, obj: Any):
+        if key in self._dirty:
+            self.coalesced += 1
+        self._dirty[key] = obj
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        self._schedule(loop)
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop):
+        if self._task is None:
+            # 一次寫出多個伺服器的設定：不沿用觸發它的指令的 context（LOG_GUILD），紀錄只送全域串流
+            self._task = loop.create_task(self._flush_later(), context=contextvars.Context())
+
+    def pending(self, key: Hashable) -> Any:
+        obj = self._dirty.get(key)
+        return obj if obj is not None else self._inflight.get(key)
+
+    def pending_items(self) -> Iterator[Tuple[Hashable, Any]]:
+        yield from self._inflight.items()
+        yield from self._dirty.items()
+
+    def _snapshot(self) -> Items:
+        # 在呼叫端執行緒（事件迴圈）編碼成獨立的 dict，之後的序列化與 I/O 不再碰到共用物件
+        items = [(key, self.encode(obj)) for key, obj in self._dirty.items()]
+        self._inflight = dict(self._dirty)
+        self._dirty.clear()
+        return items
+
+    def _write_all(self, items: Items) -> List[Tuple[Hashable, Exception]]:
+        errors = self.sink(items)
+        self.writes += len(items) - len(errors)
+        return errors
+
+    def _settle(self, items: Items, errors: List[Tuple[Hashable, Exception]]):
+        """記錄結果；寫入失敗的 key 重新標成 dirty（除非已有更新的修改在等），下一輪重試。"""
+        for key, e in errors:
+            logger.error(f"設定寫入失敗（{key}），稍後重試：{e}")
+            if key not in self._dirty and key in self._inflight:
+                self._dirty[key] = self._inflight[key]
+        self._inflight = {}
+        if len(errors) < len(items):
+            logger.info(f"設定已儲存：{len(items) - len(errors)} 筆")
+        self._retry = min(max(self._retry * 2, self.delay), RETRY_MAX) if errors else 0.0
+
+    async def _flush_later(self):
+        try:
+            # 寫入期間又有新的修改時，再等一輪一併寫出
+            while self._dirty:
+                await asyncio.sleep(self._retry or self.delay)
+                await self.flush()
+        finally:
+            self._task = None
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._dirty:
+                items = self._snapshot()
+                try:
+                    errors = await asyncio.to_thread(self._write_all, items)
+                except Exception as e:
+                    errors = [(key, e) for key, _ in items]
+                except BaseException:
+                    # 沒有拿到結果（例如被取消）：放回 dirty，不讓修改消失
+                    for key, obj in self._inflight.items():
+                        self._dirty.setdefault(key, obj)
+                    self._inflight = {}
+                    raise
+                self._settle(items, errors)
+                if self._dirty:
+                    # 直接呼叫 flush()（例如 rpg!admin restart）時也要排定重試
+                    self._schedule(asyncio.get_running_loop())
+
+    def flush_sync(self):
+        """同步寫出所有 dirty（事件迴圈已結束、或即將 exec 取代行程時使用）。"""
+        if self._dirty:
+            items = self._snapshot()
+            self._settle(items, self._write_all(items))
+        if self._dirty:
+            logger.error(f"仍有 {len(self._dirty)} 筆設定未能儲存：{', '.join(map(str, self._dirty))}")
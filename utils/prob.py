@@ -0,0 +1,193 @@
+# utils/prob.py
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import List, Optional, Tuple
+
+from utils.dice import DiceError, DicePlan
+
+DIST_CACHE_CELLS = 1_000_000   # 快取中所有分布的值域格數總和上限
+CHECKPOINT_EVERY = 8           # 逐顆累加時每幾顆留一份中間結果
+MAX_SUPPORT = 50_000           # 結果值域上限（最大值 - 最小值 + 1）
+MAX_CONVOLVE_OPS = 5_000_000   # 多組骰合併時的乘法次數上限
+MAX_ADD_OPS = 5_000_000        # 逐顆累加時的加法次數上限（約 1 秒）
+
+@dataclass(frozen=True)
+class Distribution:
+    """精確分布：total = offset + i 的組合數為 ways[i]，總組合數為 denom。"""
+    offset: int
+    ways: Tuple[int, ...]
+    denom: int
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.ways) - 1
+
+    def prob(self, total: int) -> float:
+        i = total - self.offset
+        if 0 <= i < len(self.ways):
+            return self.ways[i] / self.denom
+        return 0.0
+
+    def mean(self) -> float:
+        s = sum(i * w for i, w in enumerate(self.ways))
+        return self.offset + s / self.denom
+
+    def stdev(self) -> float:
+        # 以整數累加再做一次除法：denom 可能遠超過 float 的範圍（例如 1000d6）
+        s1 = sum(i * w for i, w in enumerate(self.ways))
+        s2 = sum(i * i * w for i, w in enumerate(self.ways))
+        return math.sqrt(Fraction(s2 * self.denom - s1 * s1, self.denom * self.denom))
+
+    def prob_where(self, pred) -> float:
+        hit = sum(w for i, w in enumerate(self.ways) if pred(self.offset + i))
+        return hit / self.denom
+
+    def percentile(self, q: float) -> int:
+        """最小的 total 使 P(X <= total) >= q。"""
+        num, den = q.as_integer_ratio()     # 整數比較，不把 denom 轉成 float
+        need = num * self.denom
+        acc = 0
+        for i, w in enumerate(self.ways):
+            acc += w
+            if acc * den >= need:
+                return self.offset + i
+        return self.max
+
+# ---------- NdS 分布（以 (count, sides) 記憶） ----------
+_dist_cache: "OrderedDict[Tuple[int, int], Distribution]" = OrderedDict()
+_cache_cells = 0
+_cache_lock = threading.Lock()   # 指令會在執行緒中計算，快取需互斥
+
+def _cache_get(key: Tuple[int, int]) -> Optional[Distribution]:
+    d = _dist_cache.get(key)
+    if d is not None:
+        _dist_cache.move_to_end(key)
+    return d
+
+def _cache_put(key: Tuple[int, int], d: Distribution):
+    global _cache_cells
+    if key in _dist_cache:
+        return
+    _dist_cache[key] = d
+    _cache_cells += len(d.ways)
+    while _cache_cells > DIST_CACHE_CELLS and len(_dist_cache) > 1:
+        _, old = _dist_cache.popitem(last=False)
+        _cache_cells -= len(old.ways)
+
+def _add_die(ways: List[int], sides: int) -> List[int]:
+    """再加一顆 dS：滑動視窗加總，O(值域) 而非 O(值域 × 面數)。"""
+    out = [0] * (len(ways) + sides - 1)
+    window = 0
+    for k in range(len(out)):
+        if k < len(ways):
+            window += ways[k]
+        if k >= sides:
+            window -= ways[k - sides]
+        out[k] = window
+    return out
+
+def dice_distribution(count: int, sides: int) -> Distribution:
+    """count 顆 sides 面骰的和；從快取中最接近的顆數往上逐顆累加。
+
+    只有查/寫快取時持有鎖，計算本身不擋住其他查詢。
+    """
+    if count < 1 or sides < 2:
+        raise DiceError("骰子顆數至少 1、骰面數至少 2")
+    if count * (sides - 1) + 1 > MAX_SUPPORT:
+        raise DiceError("骰式值域過大，無法精確計算")
+    base_n, ways = 0, [1]
+    with _cache_lock:
+        hit = _cache_get((count, sides))
+        if hit is not None:
+            return hit
+        for n in range(count - 1, 0, -1):
+            d = _cache_get((n, sides))
+            if d is not None:
+                base_n, ways = n, list(d.ways)
+                break
+
+    # 第 n 顆的累加要走過 n × (sides - 1) + 1 格
+    if (count - base_n) * (count + base_n + 1) * (sides - 1) // 2 > MAX_ADD_OPS:
+        raise DiceError("骰式過於複雜，無法精確計算")
+    checkpoints = []
+    for n in range(base_n + 1, count + 1):
+        ways = _add_die(ways, sides)
+        if n % CHECKPOINT_EVERY == 0 and n != count:
+            checkpoints.append(((n, sides), Distribution(offset=n, ways=tuple(ways), denom=sides ** n)))
+    dist = Distribution(offset=count, ways=tuple(ways), denom=sides ** count)
+    with _cache_lock:
+        for key, d in checkpoints:
+            _cache_put(key, d)
+        _cache_put((count, sides), dist)
+    return dist
+
+def _convolve(a: Distribution, b: Distribution) -> Distribution:
+    out = [0] * (len(a.ways) + len(b.ways) - 1)
+    for i, x in enumerate(a.ways):
+        if not x:
+            continue
+        for j, y in enumerate(b.ways):
+            out[i + j] += x * y
+    return Distribution(offset=a.offset + b.offset, ways=tuple(out), denom=a.denom * b.denom)
+
+def _negate(d: Distribution) -> Distribution:
+    return Distribution(offset=-d.max, ways=tuple(reversed(d.ways)), denom=d.denom)
+
+def plan_distribution(plan: DicePlan) -> Distribution:
+    """整個骰式（多組骰 + 常數）的精確分布；各組從快取取出後依序卷積。"""
+    if plan.has_house_rules:
+        raise DiceError("含重擲（r）或留高/留低（kh/kl）的骰式沒有封閉解，請改用 `rpg!sim`")
+    parts = []
+    for t in plan.terms:
+        d = dice_distribution(t.count, t.sides)
+        parts.append(d if t.sign > 0 else _negate(d))
+    # 小的先合併，乘法次數最少
+    parts.sort(key=lambda d: len(d.ways))
+
+    ops = 0
+    acc = parts[0]
+    for d in parts[1:]:
+        ops += len(acc.ways) * len(d.ways)
+        if ops > MAX_CONVOLVE_OPS or len(acc.ways) + len(d.ways) - 1 > MAX_SUPPORT:
+            raise DiceError("骰式過於複雜，無法精確計算")
+        acc = _convolve(acc, d)
+    return Distribution(offset=acc.offset + plan.mod, ways=acc.ways, denom=acc.denom)
+
+@dataclass
+class ProbReport:
+    dist: Distribution
+    success: Optional[float] = None     # 有比較式時的成功機率
+    crit_success: float = 0.0
+    crit_failure: float = 0.0
+
+def analyze(plan: DicePlan, *, d20_crit_succ: int = 20, d20_crit_fail: int = 1,
+            d100_crit_succ: int = 1, d100_crit_fail: int = 100) -> ProbReport:
+    dist = plan_distribution(plan)
+    rep = ProbReport(dist=dist)
+    if plan.compare is not None:
+        cmp, target = plan.compare, plan.target
+        rep.success = dist.prob_where(lambda x: cmp(x, target))
+
+    # 大成功/大失敗只看單顆 d20/d100 的自然值（與 DicePlan.roll 相同）
+    if plan.crit_sides:
+        sides = plan.crit_sides
+        succ, fail = ((d20_crit_succ, d20_crit_fail) if sides == 20
+                      else (d100_crit_succ, d100_crit_fail))
+        if 1 <= succ <= sides:
+            rep.crit_success = 1 / sides
+        if 1 <= fail <= sides and fail != succ:
+            rep.crit_failure = 1 / sides
+    return rep
+
+def top_outcomes(dist: Distribution, n: int = 10) -> List[Tuple[int, float]]:
+    ranked = sorted(range(len(dist.ways)), key=lambda i: dist.ways[i], reverse=True)[:n]
+    return [(dist.offset + i, dist.ways[i] / dist.denom) for i in sorted(ranked)]
@@ -0,0 +1,126 @@
+# utils/sim.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("trpg_bot")
+
+MAX_TRIALS = 10_000_000
+DEFAULT_TIME_BUDGET = 10.0     # 秒；超過即停止派發並回傳部分結果
+CHUNK_DRAWS = 400_000          # 每塊約抽多少顆骰（決定單塊耗時，也就是逾時後最多多跑多久）
+PROGRESS_INTERVAL = 1.0        # 秒；串流回報部分結果的最短間隔
+
+# worker 回傳：(結果 → 次數, 額外計數)
+ChunkResult = Tuple[Dict[object, int], Dict[str, int]]
+
+@dataclass
+class SimResult:
+    requested: int
+    trials: int = 0
+    hist: Dict[object, int] = field(default_factory=dict)
+    extra: Dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+    timed_out: bool = False
+
+    def merge(self, part: ChunkResult):
+        hist, extra = part
+        for k, v in hist.items():
+            self.hist[k] = self.hist.get(k, 0) + v
+            self.trials += v
+        for k, v in extra.items():
+            self.extra[k] = self.extra.get(k, 0) + v
+
+_pool: Optional[Executor] = None
+
+def _workers() -> int:
+    return max(1, (os.cpu_count() or 2) - 1)
+
+def get_pool() -> Executor:
+    """共用的行程池（main.py 啟動時由 start_pool() 建立）。
+
+    main.py 在模組層直接啟動 bot（沒有 __main__ 保護），spawn/forkserver 的子行程會重新執行它，
+    所以只用 fork。fork 一個已有其他執行緒（日誌寫出、to_thread、SQLite）的行程，子行程可能卡在
+    fork 當下被持有的鎖上，因此只在還沒有其他執行緒時建立行程池；否則退回單一執行緒，至少不卡事件迴圈。
+    """
+    global _pool
+    if _pool is None:
+        if "fork" in multiprocessing.get_all_start_methods() and threading.active_count() == 1:
+            _pool = ProcessPoolExecutor(max_workers=_workers(), mp_context=multiprocessing.get_context("fork"))
+        else:
+            _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sim")
+    return _pool
+
+def start_pool():
+    """在任何執行緒啟動前建立行程池，並立刻 fork 出全部 worker（fork 模式下第一次 submit 會一次啟動全部）。"""
+    pool = get_pool()
+    if isinstance(pool, ProcessPoolExecutor):
+        pool.submit(os.getpid).result()
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def run_chunks(fn: Callable[[int, int], ChunkResult], trials: int, chunk: int, *,
+                     time_budget: float = DEFAULT_TIME_BUDGET,
+                     on_progress: Optional[Callable[[SimResult], Awaitable[None]]] = None) -> SimResult:
+    """把 trials 切成 chunk 大小的塊，以 fn(n, seed) 在池中執行並彙整。
+
+    同時在池中的塊數不超過 worker 數，逾時後只需等待（並丟棄）已在跑的那幾塊。
+    """
+    trials = max(1, min(MAX_TRIALS, int(trials)))
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    inflight = _workers() if isinstance(pool, ProcessPoolExecutor) else 1
+    base_seed = secrets.randbits(64)
+
+    res = SimResult(requested=trials)
+    started = time.monotonic()
+    deadline = started + time_budget
+    last_report = started
+    submitted = idx = 0
+    pending: set[asyncio.Future] = set()
+
+    try:
+        while submitted < trials or pending:
+            while submitted < trials and len(pending) < inflight:
+                n = min(chunk, trials - submitted)
+                # 每塊種子 = 基底種子 + 塊序號，互不重疊
+                seed = (base_seed << 32) | idx
+                pending.add(loop.run_in_executor(pool, fn, n, seed))
+                submitted += n
+                idx += 1
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                res.timed_out = True
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for f in done:
+                res.merge(f.result())
+
+            now = time.monotonic()
+            if on_progress and done and now - last_report >= PROGRESS_INTERVAL and (submitted < trials or pending):
+                res.elapsed = now - started
+                last_report = now
+                try:
+                    await on_progress(res)
+                except Exception as e:
+                    logger.debug(f"模擬進度回報失敗：{e}")
+    finally:
+        for f in pending:
+            f.cancel()
+
+    res.elapsed = time.monotonic() - started
+    return res